@@ -0,0 +1,99 @@
+import os
+import hashlib
+import logging
+from datetime import datetime, timezone
+from typing import List
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError, PyMongoError
+from langchain_core.embeddings import Embeddings
+from caching.memory_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class CachedEmbeddings(Embeddings):
+    """Content-addressed cache around an embeddings model.
+
+    Vectors are keyed by SHA-256 of the model name and the exact text, looked up in an
+    in-process LRU first and then in a persistent Mongo collection, so the same text is
+    only ever sent to the embeddings API once.
+    """
+
+    def __init__(self, embeddings, collection=None, model_name="", maxsize=None, ttl_seconds=None):
+        self.embeddings = embeddings
+        self.collection = collection
+        self.model_name = model_name or getattr(embeddings, "model", "")
+        self.local = TTLCache(maxsize=maxsize or int(os.getenv("EMBEDDING_CACHE_LOCAL_MAXSIZE", "4096")))
+        self.counters = {"local_hits": 0, "mongo_hits": 0, "embedded": 0}
+        if self.collection is not None:
+            ttl_seconds = ttl_seconds or int(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+            try:
+                self.collection.create_index([("timestamp", ASCENDING)], expireAfterSeconds=ttl_seconds, name="timestamp_ttl")
+            except PyMongoError as e:
+                logger.warning("Could not create embedding cache TTL index: %s", e)
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys):
+        found = {}
+        missing = []
+        for key in keys:
+            vector = self.local.get(key)
+            if vector is None:
+                missing.append(key)
+            else:
+                found[key] = vector
+        self.counters["local_hits"] += len(found)
+        if missing and self.collection is not None:
+            try:
+                for doc in self.collection.find({"_id": {"$in": missing}}, {"vector": 1}):
+                    found[doc["_id"]] = doc["vector"]
+                    self.local.set(doc["_id"], doc["vector"])
+                    self.counters["mongo_hits"] += 1
+            except PyMongoError as e:
+                logger.warning("Embedding cache lookup failed: %s", e)
+        return found
+
+    def _store(self, vectors_by_key):
+        for key, vector in vectors_by_key.items():
+            self.local.set(key, vector)
+        if not vectors_by_key or self.collection is None:
+            return
+        now = datetime.now(timezone.utc)
+        docs = [{"_id": key, "model": self.model_name, "vector": vector, "timestamp": now} for key, vector in vectors_by_key.items()]
+        try:
+            self.collection.insert_many(docs, ordered=False)
+        except BulkWriteError:
+            # another worker stored some of the same texts first
+            pass
+        except PyMongoError as e:
+            logger.warning("Embedding cache insert failed: %s", e)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+        to_embed = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                to_embed.setdefault(key, text)
+        if to_embed:
+            vectors = self.embeddings.embed_documents(list(to_embed.values()))
+            new_vectors = dict(zip(to_embed.keys(), vectors))
+            self.counters["embedded"] += len(new_vectors)
+            self._store(new_vectors)
+            found.update(new_vectors)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        found = self._lookup([key])
+        if key in found:
+            return found[key]
+        vector = self.embeddings.embed_query(text)
+        self.counters["embedded"] += 1
+        self._store({key: vector})
+        return vector
+
+    def stats(self):
+        return {**self.counters, "local": self.local.stats()}
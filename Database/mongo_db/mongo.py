@@ -1,5 +1,7 @@
 import os
 import os
+import logging
+import threading
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -8,7 +10,8 @@ env_path = Path(__file__).resolve().parent.parent / ".env"
 print(env_path)
 
 load_dotenv(dotenv_path=env_path)
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING
+from pymongo.errors import PyMongoError
 from langchain_community.vectorstores.azure_cosmos_db import (
     AzureCosmosDBVectorSearch,
 )
@@ -19,7 +22,33 @@ from langchain_community.vectorstores.azure_cosmos_db import (
     CosmosDBVectorSearchType,
 )
 from langchain_mongodb import MongoDBChatMessageHistory
+from Database.mongo_db.embedding_cache import CachedEmbeddings
 
+logger = logging.getLogger(__name__)
+
+
+
+# Defaults assume Shopify-style product metadata (the embedding writer is not in this repo).
+# A document with none of these fields is returned with its whole metadata instead.
+def _compact_product(doc, fields, text_chars):
+    metadata=doc.get("metadata") or {}
+    variant_fields=[field.strip() for field in os.getenv("PRODUCT_SEARCH_VARIANT_FIELDS","id,title,price,available").split(",") if field.strip()]
+    if metadata and not any(field in metadata for field in fields):
+        logger.warning("Product metadata has none of PRODUCT_SEARCH_FIELDS %s, returning it uncompacted", fields)
+        fields=list(metadata)
+    product={}
+    for field in fields:
+        value=metadata.get(field)
+        if value in (None,"",[]):
+            continue
+        if field=="variants" and isinstance(value,list):
+            value=[{key:variant[key] for key in variant_fields if key in variant} if isinstance(variant,dict) else variant for variant in value]
+        product[field]=value
+    if text_chars and doc.get("textContent"):
+        product["text"]=doc["textContent"]
+    if doc.get("score") is not None:
+        product["score"]=round(float(doc["score"]),4)
+    return product
 
 
 class MongoDatabase:
@@ -28,15 +57,23 @@ class MongoDatabase:
         self.db_uri = os.environ['MONGODB_URI']
         self.client = MongoClient(self.db_uri)
         self.db_embeddings = self.client[self.db_name_embeddings]
-        self.embeddings = OpenAIEmbeddings(model="text-embedding-ada-002")
+        self.embeddings = CachedEmbeddings(
+            OpenAIEmbeddings(model="text-embedding-ada-002"),
+            collection=self.db_embeddings["Embedding_cache"],
+            model_name="text-embedding-ada-002",
+        )
 
         self.db_costing= self.client[os.environ['MONGO_DB']]
         self.collection_costing = self.db_costing["llm_costing"]
         self.collection_chat_history = self.db_embeddings["Chat_history"]
         self.collection_order_update = self.db_costing["order_update_bills"]
 
+        self._vector_stores={}
+        self._retrievers={}
+        self._registry_lock=threading.Lock()
+        self._invalidation_callbacks=[]
+
         self.botid=""
-        self.products_vector_store=""
         self.pages_vector_store=""
         self.chat_history=""
 
@@ -53,84 +90,111 @@ class MongoDatabase:
     
     def set_botid(self,bot_id):
         self.botid=bot_id
-        collection_products = self.db_embeddings[(bot_id+"_products_embeddings")]
-        self.products_vector_store=AzureCosmosDBVectorSearch(
-            collection=collection_products,     
-            embedding=self.embeddings,
-            index_name="vectorSearchIndex"
-        )
-        collection_pages = self.db_embeddings[(self.botid+"_embeddings")]
-        self.pages_vector_store= AzureCosmosDBVectorSearch(
-            collection=collection_pages,     
-            embedding=self.embeddings,
-            index_name="vectorSearchIndex"
-        )   
+        self.pages_vector_store=self.vector_store(bot_id,"_embeddings")
         return
-        
+
+    ## Vector Store Registry
+    # One AzureCosmosDBVectorSearch / retriever per (bot_id, collection[, search type, k]), created
+    # lazily on first use and reused on every later chatbot turn.
+    def vector_store(self, bot_id, suffix):
+        key=(bot_id,suffix)
+        vector_store=self._vector_stores.get(key)
+        if vector_store is None:
+            with self._registry_lock:
+                vector_store=self._vector_stores.get(key)
+                if vector_store is None:
+                    vector_store=AzureCosmosDBVectorSearch(
+                        collection=self.db_embeddings[(bot_id+suffix)],
+                        embedding=self.embeddings,
+                        index_name="vectorSearchIndex"
+                    )
+                    self._vector_stores[key]=vector_store
+        return vector_store
+
+    def retriever(self, bot_id, suffix, k, search_type="similarity", **search_kwargs):
+        key=(bot_id,suffix,search_type,k,tuple(sorted(search_kwargs.items())))
+        retriever=self._retrievers.get(key)
+        if retriever is None:
+            vector_store=self.vector_store(bot_id,suffix)
+            with self._registry_lock:
+                retriever=self._retrievers.get(key)
+                if retriever is None:
+                    retriever=vector_store.as_retriever(search_type=search_type,
+                                                        search_kwargs={"k":k, **search_kwargs})
+                    self._retrievers[key]=retriever
+        return retriever
+
+    def invalidate_bot(self, bot_id=None):
+        """Drop cached vector stores and retrievers for one bot, or all bots, and notify on_invalidate callbacks.
+
+        Call it whenever a bot is re-embedded or its configuration changes (the embedding jobs
+        live outside this repo); the chatbots' agent caches are registered as callbacks.
+        """
+        with self._registry_lock:
+            if bot_id is None:
+                self._vector_stores.clear()
+                self._retrievers.clear()
+            else:
+                self._vector_stores={key:value for key,value in self._vector_stores.items() if key[0]!=bot_id}
+                self._retrievers={key:value for key,value in self._retrievers.items() if key[0]!=bot_id}
+        for callback in self._invalidation_callbacks:
+            callback(bot_id)
+
+    def on_invalidate(self, callback):
+        """Register callback(bot_id) to run after invalidate_bot, for caches built on top of the registry."""
+        self._invalidation_callbacks.append(callback)
+
     ## MMR Retriever
     def products_mmr_retriever(self, bot_id,k):
-        collection_products = self.db_embeddings[(bot_id+"_products_embeddings")]
-        vector_store = AzureCosmosDBVectorSearch(
-            collection=collection_products,     
-            embedding=self.embeddings,
-            index_name="vectorSearchIndex"
-        )
-        self.products_vector_store=vector_store
-        retriver=vector_store.as_retriever(search_type="mmr",
-                                           search_kwargs={"k":k, 'lambda_mult': 0.5})
+        vector_store=self.vector_store(bot_id,"_products_embeddings")
+        retriver=self.retriever(bot_id,"_products_embeddings",k,search_type="mmr",lambda_mult=0.5)
         return vector_store,retriver
     
     def pages_mmr_retriever(self, bot_id,k):
-        collection_pages = self.db_embeddings[(bot_id+"_embeddings")]
-        vector_store = AzureCosmosDBVectorSearch(
-            collection=collection_pages,     
-            embedding=self.embeddings,
-            index_name="vectorSearchIndex"
-        )
-        retriver=vector_store.as_retriever(search_type="mmr",
-                                           search_kwargs={"k":k, 'lambda_mult': 0.5})
-        return retriver
+        return self.retriever(bot_id,"_embeddings",k,search_type="mmr",lambda_mult=0.5)
     
     ## KNN Retriever
     def pages_k_retriever(self, bot_id,k):
-        collection_pages = self.db_embeddings[(bot_id+"_embeddings")]
-        vector_store = AzureCosmosDBVectorSearch(
-            collection=collection_pages,     
-            embedding=self.embeddings,
-            index_name="vectorSearchIndex"
-        )
-        return vector_store,vector_store.as_retriever(search_kwargs={"k":k})
+        return self.vector_store(bot_id,"_embeddings"),self.retriever(bot_id,"_embeddings",k)
     
     def products_k_retriever(self, bot_id,k):
-        collection_products = self.db_embeddings[(bot_id+"_products_embeddings")]
-        vector_store = AzureCosmosDBVectorSearch(
-            collection=collection_products,     
-            embedding=self.embeddings,
-            index_name="vectorSearchIndex"
-        )
-        self.products_vector_store=vector_store
-        return vector_store,vector_store.as_retriever(search_kwargs={"k":k})
+        return self.vector_store(bot_id,"_products_embeddings"),self.retriever(bot_id,"_products_embeddings",k)
 
     ## Similarity Search
     def pages_similarity_search(self, bot_id,question,k):
-        collection_pages = self.db_embeddings[(bot_id+"_embeddings")]
-        vector_store = AzureCosmosDBVectorSearch(
-            collection=collection_pages,     
-            embedding=self.embeddings,
-            index_name="vectorSearchIndex"
-        )      
-        return vector_store.similarity_search_with_score(question, k=k)
+        return self.vector_store(bot_id,"_embeddings").similarity_search_with_score(question, k=k)
     
     def products_similarity_search(self, bot_id,question,k):
-        collection_products = self.db_embeddings[(bot_id+"_products_embeddings")]
-        vector_store = AzureCosmosDBVectorSearch(
-            collection=collection_products,     
-            embedding=self.embeddings,
-            index_name="vectorSearchIndex"  
-        ) 
-        self.products_vector_store=vector_store     
-        return vector_store.similarity_search_with_score(question, k=k)
+        return self.vector_store(bot_id,"_products_embeddings").similarity_search_with_score(question, k=k)
     
+    ## Structured Product Search
+    # Same k-NN search as products_similarity_search, but only the metadata, a prefix of the
+    # text and the score leave the database (no embedding vector), compacted to the configured
+    # fields and returned as plain dicts for the agent-facing tool output. Variant resolution
+    # (get_productid) keeps using products_similarity_search with the full page content.
+    def products_search(self, bot_id, question, k, fields=None, text_chars=None):
+        if fields is None:
+            fields=[field.strip() for field in os.getenv("PRODUCT_SEARCH_FIELDS","title,product_type,variants,price,available,url").split(",") if field.strip()]
+        if text_chars is None:
+            text_chars=int(os.getenv("PRODUCT_SEARCH_TEXT_CHARS","300"))
+        vector_store=self.vector_store(bot_id,"_products_embeddings")
+
+        projection={"_id":0,"score":{"$meta":"searchScore"}}
+        projection["metadata"]=1
+        if text_chars:
+            projection["textContent"]={"$substrCP":["$textContent",0,text_chars]}
+        pipeline=[
+            {"$search":{"cosmosSearch":{"vector":self.embeddings.embed_query(question),"path":"vectorContent","k":k},"returnStoredSource":True}},
+            {"$project":projection},
+        ]
+        try:
+            docs=list(self.db_embeddings[(bot_id+"_products_embeddings")].aggregate(pipeline))
+        except Exception as e:
+            logger.warning("Projected product search failed, falling back to similarity search: %s", e)
+            docs=[{"metadata":doc.metadata,"textContent":doc.page_content[:text_chars] if text_chars else None,"score":score}
+                  for doc,score in vector_store.similarity_search_with_score(question, k=k)]
+        return [_compact_product(doc,fields,text_chars) for doc in docs]
+
     ## Collections
     def pages_data(self,bot_id):
         collection_pages_data = self.db_embeddings[(bot_id+"_embeddings")]
@@ -145,13 +209,33 @@ class MongoDatabase:
         return self.pages_vector_store.similarity_search_with_score(question, k=k)
     
     def self_products_similarity_search(self,question,k):
-        ans=self.products_vector_store.similarity_search_with_score(question, k=k)
-        return ans
+        return self.vector_store(self.botid,"_products_embeddings").similarity_search_with_score(question, k=k)
     
     ## Cache Retriever
     def cache_retriever(self):
         collection_cache = self.db_embeddings[("Debales_cache")]
         return collection_cache
+
+    def cache_vector_store(self, bot_id, dimensions=1536, num_lists=1, ttl_seconds=None):
+        vector_store=self.vector_store(bot_id,"_cache_embeddings")
+        if not vector_store.index_exists():
+            vector_store.create_index(
+                num_lists=num_lists,
+                dimensions=dimensions,
+                similarity=CosmosDBSimilarityType.COS,
+                kind=CosmosDBVectorSearchType.VECTOR_IVF,
+            )
+        if ttl_seconds:
+            # semantic cache entries expire like the Debales_cache documents they point to
+            try:
+                self.db_embeddings[(bot_id+"_cache_embeddings")].create_index(
+                    [("metadata.timestamp", ASCENDING)],
+                    expireAfterSeconds=ttl_seconds,
+                    name="timestamp_ttl",
+                )
+            except PyMongoError as e:
+                logger.warning("Could not create TTL index on %s_cache_embeddings: %s", bot_id, e)
+        return vector_store
     
     ## Costing
     def costing(self,cost_dict):
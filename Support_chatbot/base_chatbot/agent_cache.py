@@ -0,0 +1,81 @@
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class AgentCache:
+    """Ready-built agent executors keyed by ``(bot_id, *variant)``.
+
+    Building the retriever tool, the tool list, the tool-calling agent and the executor
+    only depends on the bot, so it is done once per key and reused for every question.
+    Entries are dropped when ``MongoDatabase.invalidate_bot`` runs for the bot and rebuilt
+    after ``ttl`` seconds (AGENT_CACHE_TTL) otherwise. Nothing in this repo re-embeds bots:
+    the job or endpoint that re-embeds a bot or changes its configuration is expected to call
+    ``invalidate_bot(bot_id)`` on the MongoDatabase the chatbots use; until then changes
+    are picked up within ``ttl``.
+    """
+
+    def __init__(self, name, ttl=None):
+        self.name = name
+        self.ttl = ttl or float(os.getenv("AGENT_CACHE_TTL", "3600"))
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._build_locks = {}
+        self._generation = 0
+        self._watched = set()
+        self.metrics = {"hits": 0, "builds": 0, "invalidations": 0}
+
+    def watch(self, db):
+        """Drop a bot's executors whenever ``db.invalidate_bot`` runs for it (registered once per db)."""
+        if id(db) in self._watched or not hasattr(db, "on_invalidate"):
+            return
+        with self._lock:
+            if id(db) in self._watched:
+                return
+            self._watched.add(id(db))
+        db.on_invalidate(self.invalidate)
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._build_locks.get(key)
+            if lock is None:
+                lock = self._build_locks[key] = threading.Lock()
+            return lock
+
+    def get(self, key, build):
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[1] <= self.ttl:
+            self.metrics["hits"] += 1
+            return entry[0]
+        # one build per key at a time, a cold build for one bot does not block the others
+        with self._key_lock(key):
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] > self.ttl:
+                t0 = time.perf_counter()
+                generation = self._generation
+                entry = (build(), time.monotonic())
+                with self._lock:
+                    # an invalidation during the build may have made it stale, use it once only
+                    if generation == self._generation:
+                        self._entries[key] = entry
+                self.metrics["builds"] += 1
+                logger.info("Built %s agent for %s in %.3fs", self.name, key, time.perf_counter() - t0)
+            else:
+                self.metrics["hits"] += 1
+        return entry[0]
+
+    def invalidate(self, bot_id=None):
+        with self._lock:
+            if bot_id is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == bot_id]:
+                    del self._entries[key]
+            self._generation += 1
+            self.metrics["invalidations"] += 1
+
+    def stats(self):
+        return {**self.metrics, "entries": len(self._entries)}
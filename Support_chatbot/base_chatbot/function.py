@@ -2,6 +2,7 @@ from dotenv import load_dotenv
 load_dotenv()
 import os
 import json
+import asyncio
 import logging
 from langchain_core.runnables import RunnablePassthrough
 from langchain_openai import AzureChatOpenAI
@@ -11,6 +12,9 @@ from langchain_community.callbacks import get_openai_callback
 from langchain.schema import HumanMessage, AIMessage
 from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.chat_history import BaseChatMessageHistory
+from Support_chatbot.base_chatbot.session_store import SessionStore, format_session_histories
+from Support_chatbot.base_chatbot.history_summary import HistoryCompactor
+from Support_chatbot.base_chatbot.streaming import ResponseStreamer, token_event, final_event, stream_in_task
 from langchain_core.output_parsers import StrOutputParser
 import time
 
@@ -24,7 +28,9 @@ logger = logging.getLogger(__name__)
 model = AzureChatOpenAI(
     openai_api_version=os.environ["AZURE_OPENAI_API_VERSION"],
     azure_deployment=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"],
+    stream_usage=True,  # token usage for get_openai_callback on streamed answers
 )
+history_compactor = HistoryCompactor(model)
 
 #Format Chat History
 def format_chat_history(chat_history):
@@ -37,12 +43,9 @@ def format_chat_history(chat_history):
     return "".join(formatted_chat)
 
 
-store = {}
+store = SessionStore()
 def get_session_history(session_id: str) -> BaseChatMessageHistory:
-    global store
-    if session_id not in store:
-        store[session_id] = ChatMessageHistory()
-    return store[session_id]
+    return store.get(session_id)
 
 def format_cache_chat_history(chat_history):
     formatted_chat = []
@@ -52,20 +55,12 @@ def format_cache_chat_history(chat_history):
     return "".join(formatted_chat)
 
 #MAIN FUNCTION
-def Qna(question,session_id,bot_id,user_prompt,db,cache,language):
-
-    completion_tokens=0
-    prompt_tokens=0
-
-    t0=time.time()
-
-    global prompts,contextualize_q_system_prompt,store
-
+def _start_turn(question, session_id, bot_id, cache, language):
+    # history, cache lookup and compaction; a cache hit is recorded in the history right away
     chat_message_history = get_session_history(session_id)
-    chat_history = format_chat_history(chat_message_history.messages)
+    chat_history, chat_history_cache = format_session_histories(chat_message_history)
 
     ##CACHING
-    chat_history_cache=format_cache_chat_history(chat_message_history.messages)
     cached_data = cache.check_cache(bot_id, question, chat_history_cache,language)
     if cached_data:
         logger.info("Cache hit: %s", cached_data)
@@ -74,11 +69,14 @@ def Qna(question,session_id,bot_id,user_prompt,db,cache,language):
         ans=("response : "+ str(a_out['response']) + '\nSuggestive_Answers: '+str(a_out['leading_queries'])).replace("{","(").replace("}",")")
 
         chat_message_history.add_ai_message(ans)
-        return cached_data
+        return cached_data, chat_message_history, chat_history, chat_history_cache
     else:
         logger.info("Cache miss")
+    chat_history = history_compactor.compact(chat_message_history, bot_id, chat_history)
+    return None, chat_message_history, chat_history, chat_history_cache
 
 
+def _build_chains(bot_id, user_prompt, db, chat_history, language):
     logger.debug("Chat History= %s", chat_history)
     
     #Prompt
@@ -89,12 +87,10 @@ def Qna(question,session_id,bot_id,user_prompt,db,cache,language):
     #Prompt History LLM
     prompt_history=contextualize_q_system_prompt.replace("{chat_history}",chat_history).replace("{language}",language)
     prompt_his_final =  PromptTemplate.from_template(prompt_history)
-    t1=time.time()
 
 
     # Retriever
     _,pages_retriever = db.pages_k_retriever(bot_id,8)
-    t2=time.time()
 
     # CHAINING
     chain_his = (
@@ -109,6 +105,75 @@ def Qna(question,session_id,bot_id,user_prompt,db,cache,language):
         | model
         | StrOutputParser()
     )
+    return chain_his, chain
+
+
+def _error_output(response, completion_tokens, prompt_tokens):
+    return {
+        "response": response,
+        "leading_queries":[],
+        "completion_tokens":completion_tokens,
+        "prompt_tokens":prompt_tokens
+    }
+
+
+def _finish_turn(a, question, bot_id, cache, language, chat_message_history, chat_history_cache, completion_tokens, prompt_tokens):
+    # parses the model output, then saves it to the cache and the history
+    try:
+        a= a[a.find("{"):a.rfind("}")+1].replace("None","null")
+        a= json.loads(a, strict=False)
+        if 'Suggestive_Answers' in a:
+            a['leading_queries']=a['Suggestive_Answers']
+        elif 'leading_queries' in a:
+            a['Suggestive_Answers']=a['leading_queries']
+        else:
+            a['leading_queries']=[]
+            a['Suggestive_Answers']=[]
+
+        a_out=a
+        logger.debug(a_out)
+
+    except Exception as e:
+        logger.error("Parsing error: %s", str(e))
+        return _error_output("Sorry there was an Network Error,Please ask the question again.", completion_tokens, prompt_tokens)
+
+    # Save History and Cache
+    try:
+        t6=time.time()
+        ans=("response : "+ str(a_out['response']) +'\nSuggestive_Answers: '+str(a_out['leading_queries'])).replace("{","(").replace("}",")")
+        # Updated Cache 
+        cache.insert_cache(bot_id, question, chat_history_cache, a_out,language)
+        t7=time.time()
+
+        #Update chat    
+        chat_message_history.add_user_message(question)
+        chat_message_history.add_ai_message(ans)
+    except Exception as e:
+        logger.error("Error: %s", str(e))
+        return _error_output("Sorry there was an issue ,Please ask the question again.", completion_tokens, prompt_tokens)
+    
+    logger.info("Done= %s", a_out)
+    logger.info("Time to save cache: %s", t7-t6)
+    logger.info("Time Save history: %s", time.time()-t7)
+
+    a_out["completion_tokens"]=completion_tokens
+    a_out["prompt_tokens"]=prompt_tokens
+    return a_out
+
+
+def Qna(question,session_id,bot_id,user_prompt,db,cache,language):
+
+    completion_tokens=0
+    prompt_tokens=0
+
+    t0=time.time()
+
+    cached_data, chat_message_history, chat_history, chat_history_cache = _start_turn(question, session_id, bot_id, cache, language)
+    if cached_data:
+        return cached_data
+    t1=time.time()
+
+    chain_his, chain = _build_chains(bot_id, user_prompt, db, chat_history, language)
     t3=time.time()
     try:
 
@@ -132,83 +197,77 @@ def Qna(question,session_id,bot_id,user_prompt,db,cache,language):
         logger.debug("Output Initial= %s", a)
         t5=time.time()
 
-        try:
-            a= a[a.find("{"):a.rfind("}")+1].replace("None","null")
-            a= json.loads(a, strict=False)
-            if 'Suggestive_Answers' in a:
-                a['leading_queries']=a['Suggestive_Answers']
-            elif 'leading_queries' in a:
-                a['Suggestive_Answers']=a['leading_queries']
-            else:
-                a['leading_queries']=[]
-                a['Suggestive_Answers']=[]
-
-            a_out=a
-            logger.debug(a_out)
-
-        except Exception as e:
-            logger.error("Parsing error: %s", str(e))
-            output_data = {
-                "response": "Sorry there was an Network Error,Please ask the question again.",
-                "leading_queries":[],
-                "completion_tokens":completion_tokens,
-                "prompt_tokens":prompt_tokens
-            }
-            return output_data
-
-        
-
-        
-        # Save History and Cache
-        try:
-            t6=time.time()
-            ans=("response : "+ str(a_out['response']) +'\nSuggestive_Answers: '+str(a_out['leading_queries'])).replace("{","(").replace("}",")")
-            # Updated Cache 
-            cache.insert_cache(bot_id, question, chat_history_cache, a_out,language)
-            t7=time.time()
-
-            #Update chat    
-            chat_message_history.add_user_message(question)
-            chat_message_history.add_ai_message(ans)
-        except Exception as e:
-            logger.error("Error: %s", str(e))
-            output_data = {
-                "response": "Sorry there was an issue ,Please ask the question again.",
-                "leading_queries":[],
-                "completion_tokens":completion_tokens,
-                "prompt_tokens":prompt_tokens
-            }
-            return output_data
-        
-        logger.info("Done= %s", a_out)
-
+        a_out = _finish_turn(a, question, bot_id, cache, language, chat_message_history, chat_history_cache, completion_tokens, prompt_tokens)
 
         t8=time.time()
 
         logger.info("Time initialize prompt and history: %s", t1-t0)
-        logger.info("Time Retriver: %s", t2-t1)
-        logger.info("Time Chaining: %s", t3-t2)
+        logger.info("Time Retriver and Chaining: %s", t3-t1)
         logger.info("Time reformulate question: %s", t4-t3)
         logger.info("Time output: %s", t5-t4)
-        logger.info("Time by loading expert: %s", t6-t5)
-        logger.info("Time to save cache: %s", t7-t6)
-        logger.info("Time Save history: %s", t8-t7)
+        logger.info("Time save: %s", t8-t5)
         logger.info("Total Time: %s", t8-t0)
-
-        a_out["completion_tokens"]=completion_tokens
-        a_out["prompt_tokens"]=prompt_tokens
         
         return a_out
     
     except Exception as e:
         logger.error("Invoke error: %s", e)
-        output_data = {
-                "response": "Please ask appropriate question.",
-                "leading_queries":[],
-                "completion_tokens":completion_tokens,
-                "prompt_tokens":prompt_tokens
-            }
-        return output_data
+        return _error_output("Please ask appropriate question.", completion_tokens, prompt_tokens)
+
+
+async def aQna_stream(question,session_id,bot_id,user_prompt,db,cache,language):
+    """Streaming version of Qna, as an async generator of events.
+
+    The question is still reformulated first, then the answer chain is streamed: token
+    events carry the "response" text as the model writes it and the final event has the
+    same dict Qna returns (see base_chatbot.streaming). It runs in its own task, so the
+    token-counting callbacks stay out of the consumer's context.
+    """
+    async for event in stream_in_task(_qna_events(question,session_id,bot_id,user_prompt,db,cache,language)):
+        yield event
+
+
+async def _qna_events(question,session_id,bot_id,user_prompt,db,cache,language):
+    completion_tokens=0
+    prompt_tokens=0
+
+    t0=time.time()
+
+    cached_data, chat_message_history, chat_history, chat_history_cache = await asyncio.to_thread(_start_turn, question, session_id, bot_id, cache, language)
+    if cached_data:
+        yield token_event(str(cached_data['response']))
+        yield final_event(cached_data)
+        return
+
+    try:
+        chain_his, chain = await asyncio.to_thread(_build_chains, bot_id, user_prompt, db, chat_history, language)
+
+        with get_openai_callback() as cb:
+            b= await chain_his.ainvoke(question)
+            completion_tokens+=cb.completion_tokens
+            prompt_tokens+=cb.prompt_tokens
+        logger.debug("Reform question = %s", b)
+
+        streamer = ResponseStreamer()
+        chunks = []
+        with get_openai_callback() as cb:
+            async for chunk in chain.astream(b):
+                chunks.append(chunk)
+                text = streamer.feed(chunk)
+                if text:
+                    if len(streamer.parts) == 1:
+                        logger.info("Time to first token: %s", time.time()-t0)
+                    yield token_event(text)
+            completion_tokens+=cb.completion_tokens
+            prompt_tokens+=cb.prompt_tokens
+    except Exception as e:
+        logger.error("Invoke error: %s", e)
+        yield final_event(_error_output("Please ask appropriate question.", completion_tokens, prompt_tokens))
+        return
+
+    a_out = await asyncio.to_thread(_finish_turn, "".join(chunks), question, bot_id, cache, language, chat_message_history, chat_history_cache, completion_tokens, prompt_tokens)
+    logger.info("Total Time: %s", time.time()-t0)
+    yield final_event(a_out)
         
 
 
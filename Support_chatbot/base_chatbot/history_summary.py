@@ -0,0 +1,101 @@
+import os
+import json
+import logging
+import threading
+from langchain_core.prompts import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from Support_chatbot.base_chatbot.session_store import BoundedChatMessageHistory, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryCompactor:
+    """Keeps the ``{chat_history}`` injected into prompts inside a per-bot token budget.
+
+    When the rendered transcript is over budget, the last ``keep_turns`` human turns stay
+    verbatim and everything older is folded into a running summary that is cached on the
+    session history, so each older turn is only summarized once. Folding waits until the
+    unsummarized older turns no longer fit, which keeps the extra LLM call off most turns.
+    """
+
+    def __init__(self, model, keep_turns=None, default_budget=None, budgets=None):
+        self.keep_turns = keep_turns or int(os.getenv("HISTORY_KEEP_TURNS", "3"))
+        # 0 disables compaction; per-bot overrides come from HISTORY_TOKEN_BUDGETS='{"bot_id": 1500}'
+        self.default_budget = default_budget if default_budget is not None else int(os.getenv("HISTORY_TOKEN_BUDGET", "0"))
+        self.budgets = budgets if budgets is not None else json.loads(os.getenv("HISTORY_TOKEN_BUDGETS", "{}"))
+        self.chain = PromptTemplate.from_template(summary_prompt) | model | StrOutputParser()
+        self._lock = threading.Lock()
+        self.metrics = {"compacted_turns": 0, "summaries": 0, "summary_errors": 0, "tokens_before": 0, "tokens_after": 0}
+
+    def set_budget(self, bot_id, tokens):
+        self.budgets[bot_id] = tokens
+
+    def budget_for(self, bot_id):
+        return int(self.budgets.get(bot_id, self.default_budget) or 0)
+
+    def compact(self, history, bot_id, chat_history):
+        """Return ``chat_history`` unchanged when it fits the bot's budget, otherwise summary + recent turns."""
+        budget = self.budget_for(bot_id)
+        if not budget or not isinstance(history, BoundedChatMessageHistory):
+            return chat_history
+        tokens_before = estimate_tokens(chat_history)
+        if tokens_before <= budget:
+            return chat_history
+
+        window_start = history.window_start()
+        recent_start = max(history.window_start(max_turns=self.keep_turns, max_tokens=0), window_start)
+        recent = history.transcript(start=recent_start)
+
+        summary, pending_start = history.summary_state(window_start, recent_start)
+        pending = history.transcript(start=pending_start, end=recent_start)
+        compacted = self._render(summary, pending, recent)
+
+        if pending and estimate_tokens(compacted) > budget:
+            try:
+                summary = self.chain.invoke({"summary": summary or "(none)", "new_lines": pending}).strip()
+                # the history is substituted into prompt templates, keep it free of template braces
+                summary = summary.replace("{", "(").replace("}", ")")
+                history.set_summary(summary, recent_start)
+                self.metrics["summaries"] += 1
+                pending = ""
+                compacted = self._render(summary, pending, recent)
+            except Exception as e:
+                self.metrics["summary_errors"] += 1
+                logger.error("History summarization failed for bot_id %s: %s", bot_id, e)
+                return chat_history
+
+        tokens_after = estimate_tokens(compacted)
+        with self._lock:
+            self.metrics["compacted_turns"] += 1
+            self.metrics["tokens_before"] += tokens_before
+            self.metrics["tokens_after"] += tokens_after
+        logger.info("Compacted chat history for bot_id %s: ~%d -> ~%d tokens", bot_id, tokens_before, tokens_after)
+        return compacted
+
+    @staticmethod
+    def _render(summary, pending, recent):
+        parts = []
+        if summary:
+            parts.append(f"Summary of the earlier conversation: {summary}\n\n")
+        parts.append(pending)
+        parts.append(recent)
+        return "".join(parts)
+
+    def stats(self):
+        with self._lock:
+            metrics = dict(self.metrics)
+        metrics["prompt_tokens_saved"] = metrics["tokens_before"] - metrics["tokens_after"]
+        return metrics
+
+
+summary_prompt = """You maintain a running summary of a customer support conversation.
+Update the summary with the new lines of conversation. Keep every order number, email, name,
+product, variant and decision the customer made. Do not add anything that was not said.
+Answer with the updated summary only, in at most 150 words.
+
+Current summary:
+{summary}
+
+New lines of conversation:
+{new_lines}
+"""
@@ -0,0 +1,50 @@
+import contextvars
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar("chatbot_request")
+
+
+class RequestContext:
+    """State of one chatbot request that the agent tools need (database, bot, session, history).
+
+    It lives in a ContextVar instead of module globals, so concurrent requests in one worker,
+    whether in threads or asyncio tasks, each see their own. Tools record side effects on it
+    (e.g. ``tags``); the object is shared by reference, so changes made inside
+    ``asyncio.to_thread`` or LangChain's executor threads are visible to the request.
+    """
+
+    __slots__ = ("db", "bot_id", "session_id", "chat_history", "product_resolver", "tags")
+
+    def __init__(self, db=None, bot_id="", session_id="", chat_history="", product_resolver=None):
+        self.db = db
+        self.bot_id = bot_id
+        self.session_id = session_id
+        self.chat_history = chat_history
+        self.product_resolver = product_resolver
+        self.tags = []
+
+    @property
+    def chat_id(self):
+        return f"{self.session_id}{self.bot_id}"
+
+    def add_tag(self, tag):
+        if tag not in self.tags:
+            self.tags.append(tag)
+
+    def __repr__(self):
+        return f"RequestContext(bot_id={self.bot_id!r}, session_id={self.session_id!r}, tags={self.tags!r})"
+
+
+def current_request():
+    """The RequestContext of the running request; raises LookupError outside request_scope."""
+    return _current.get()
+
+
+@contextmanager
+def request_scope(**fields):
+    ctx = RequestContext(**fields)
+    token = _current.set(ctx)
+    try:
+        yield ctx
+    finally:
+        _current.reset(token)
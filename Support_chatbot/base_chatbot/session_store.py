@@ -0,0 +1,469 @@
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+from pydantic import PrivateAttr
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, message_to_dict, messages_from_dict
+from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.chat_history import BaseChatMessageHistory
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) used for history windows and budgets."""
+    return len(text) // 4 + 1 if text else 0
+
+
+def _render_message(message):
+    """Prompt chunk, cache-key chunk and estimated tokens for one message, in the chatbot transcript format."""
+    if isinstance(message, HumanMessage):
+        prompt_chunk = f"Human: {message.content}\n"
+        return prompt_chunk, f"{message.content}\n", estimate_tokens(prompt_chunk)
+    if isinstance(message, AIMessage):
+        prompt_chunk = f"AI: {message.content}\n\n"
+        return prompt_chunk, "", estimate_tokens(prompt_chunk)
+    return "", "", 0
+
+
+class BoundedChatMessageHistory(ChatMessageHistory):
+    """In-memory chat history that keeps at most ``max_messages`` of the most recent messages.
+
+    Each message is rendered once when it is added, so building the prompt and cache-key
+    transcripts for a turn only joins the already rendered chunks inside the configured
+    window instead of re-formatting the whole conversation.
+    """
+
+    max_messages: Optional[int] = None
+    window_turns: Optional[int] = None
+    window_tokens: Optional[int] = None
+    _on_add: Optional[Callable] = PrivateAttr(default=None)
+    _chunks: list = PrivateAttr(default_factory=list)
+    _summary: str = PrivateAttr(default="")
+    _summary_last: Optional[BaseMessage] = PrivateAttr(default=None)
+
+    def add_message(self, message: BaseMessage) -> None:
+        super().add_message(message)
+        self._chunks.append(_render_message(message))
+        self._trim()
+        if self._on_add is not None:
+            self._on_add(message)
+
+    def clear(self) -> None:
+        super().clear()
+        self._chunks = []
+        self._summary = ""
+        self._summary_last = None
+
+    def load_messages(self, messages):
+        """Seed the history from a backend without writing the messages back."""
+        self.messages.extend(messages)
+        self._chunks.extend(_render_message(message) for message in messages)
+        self._trim()
+
+    def _trim(self):
+        if self.max_messages and len(self.messages) > self.max_messages:
+            excess = len(self.messages) - self.max_messages
+            del self.messages[:excess]
+            del self._chunks[:excess]
+
+    def _synced_chunks(self):
+        # messages can be replaced from outside (clear(), refresh); re-render only then
+        if len(self._chunks) != len(self.messages):
+            self._chunks = [_render_message(message) for message in self.messages]
+        return self._chunks
+
+    def window_start(self, max_turns=None, max_tokens=None):
+        """Index of the first message inside the last ``max_turns`` human turns and ``max_tokens`` tokens."""
+        chunks = self._synced_chunks()
+        max_turns = self.window_turns if max_turns is None else max_turns
+        max_tokens = self.window_tokens if max_tokens is None else max_tokens
+        if not max_turns and not max_tokens:
+            return 0
+        turns = 0
+        tokens = 0
+        start = len(chunks)
+        for index in range(len(chunks) - 1, -1, -1):
+            tokens += chunks[index][2]
+            if max_tokens and tokens > max_tokens:
+                break
+            start = index
+            if isinstance(self.messages[index], HumanMessage):
+                turns += 1
+                if max_turns and turns >= max_turns:
+                    break
+        return start
+
+    def transcript(self, max_turns=None, max_tokens=None, start=None, end=None):
+        """Formatted "Human:/AI:" transcript, same output as format_chat_history over the window."""
+        chunks = self._synced_chunks()
+        if start is None:
+            start = self.window_start(max_turns, max_tokens)
+        return "".join(chunk[0] for chunk in chunks[start:end])
+
+    def cache_transcript(self, max_turns=None, max_tokens=None, start=None):
+        """Human-only transcript, same output as format_cache_chat_history over the window."""
+        chunks = self._synced_chunks()
+        if start is None:
+            start = self.window_start(max_turns, max_tokens)
+        return "".join(chunk[1] for chunk in chunks[start:])
+
+    def transcripts(self, max_turns=None, max_tokens=None):
+        """Prompt and cache-key transcripts for the same window in one pass over it."""
+        start = self.window_start(max_turns, max_tokens)
+        return self.transcript(start=start), self.cache_transcript(start=start)
+
+
+    def summary_state(self, window_start, recent_start):
+        """Cached running summary and the index of the first message before recent_start it does not cover."""
+        if not self._summary:
+            return "", window_start
+        for index in range(min(recent_start, len(self.messages)) - 1, -1, -1):
+            if self.messages[index] is self._summary_last:
+                return self._summary, max(index + 1, window_start)
+        # the last summarized message was trimmed away, so everything still held is newer than the summary
+        return self._summary, window_start
+
+    def set_summary(self, summary, upto):
+        """Cache ``summary`` as covering every message before index ``upto``."""
+        self._summary = summary
+        self._summary_last = self.messages[upto - 1] if upto > 0 else None
+
+    def adopt_summary(self, other):
+        """Take over ``other``'s running summary, matching its last summarized message by value."""
+        if not other._summary:
+            return
+        self._summary = other._summary
+        self._summary_last = None
+        if other._summary_last is not None:
+            for message in reversed(self.messages):
+                if message == other._summary_last:
+                    self._summary_last = message
+                    break
+
+
+def format_session_histories(history):
+    """Prompt and cache-key transcripts for a session history, incremental when the history supports it."""
+    if isinstance(history, BoundedChatMessageHistory):
+        return history.transcripts()
+    prompt_chunks = []
+    cache_chunks = []
+    for message in history.messages:
+        prompt_chunk, cache_chunk, _ = _render_message(message)
+        prompt_chunks.append(prompt_chunk)
+        cache_chunks.append(cache_chunk)
+    return "".join(prompt_chunks), "".join(cache_chunks)
+
+
+class InMemorySessionBackend:
+    """Keeps nothing outside the process; the default, same behaviour as the old store dicts."""
+
+    persistent = False
+
+    def load(self, session_id, limit=None):
+        return []
+
+    def save(self, batch):
+        return
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _shared_client():
+    # one MongoClient (and connection pool) per process for every Mongo session backend
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(os.environ['MONGODB_URI'])
+    return _client
+
+
+class MongoSessionBackend:
+    """Chat_history collection, in the same document format MongoDBChatMessageHistory reads and writes.
+
+    Pass the ``collection`` (e.g. ``MongoDatabase().collection_chat_history``) or a ``client``
+    to reuse existing connections; otherwise one client is shared by the process. Messages
+    carry a ``Timestamp`` (nanoseconds, increasing within a flushed batch) that orders a
+    session's history; documents written without it sort as the oldest.
+    """
+
+    persistent = True
+
+    def __init__(self, collection=None, client=None):
+        if collection is None:
+            client = client if client is not None else _shared_client()
+            collection = client[os.environ['MONGO_DB_EMBEDDINGS']]["Chat_history"]
+        self.collection = collection
+        try:
+            self.collection.create_index([("SessionId", ASCENDING), ("Timestamp", DESCENDING)], name="session_timestamp")
+        except Exception as e:
+            logger.warning("Could not create SessionId/Timestamp index on Chat_history: %s", e)
+
+    def load(self, session_id, limit=None):
+        cursor = self.collection.find({"SessionId": session_id}).sort([("Timestamp", DESCENDING), ("_id", DESCENDING)])
+        if limit:
+            cursor = cursor.limit(limit)
+        docs = list(cursor)
+        docs.reverse()
+        return messages_from_dict([json.loads(doc["History"]) for doc in docs])
+
+    def save(self, batch):
+        if not batch:
+            return
+        # batches are saved in order under the flush lock, so later messages get larger timestamps
+        base = time.time_ns()
+        self.collection.insert_many(
+            [{"SessionId": session_id, "History": json.dumps(message_to_dict(message)), "Timestamp": base + index}
+             for index, (session_id, message) in enumerate(batch)],
+            ordered=True,
+        )
+
+
+def make_session_backend(name=None, collection=None, client=None):
+    name = (name or os.getenv("SESSION_BACKEND", "memory")).lower()
+    if name == "mongo":
+        return MongoSessionBackend(collection=collection, client=client)
+    if name != "memory":
+        logger.warning("Unknown SESSION_BACKEND %r, falling back to in-memory sessions", name)
+    return InMemorySessionBackend()
+
+
+class SessionStore:
+    """Per-process session histories with an LRU bound, idle expiry and a per-session message cap.
+
+    Replaces the unbounded module level ``store = {}`` dicts of the chatbots so long running
+    workers stay flat in memory. With a persistent backend the local histories act as a
+    read-through cache and new messages are flushed to the backend in batches from a
+    background thread, so several workers can share sessions without a DB write per turn.
+    """
+
+    def __init__(self, max_sessions=None, idle_ttl=None, max_messages=None, sweep_interval=60,
+                 backend=None, flush_interval=None, flush_batch_size=None, window_turns=None, window_tokens=None,
+                 max_pending=None):
+        self.max_sessions = max_sessions or int(os.getenv("SESSION_STORE_MAX_SESSIONS", "5000"))
+        self.idle_ttl = idle_ttl or float(os.getenv("SESSION_STORE_IDLE_TTL", "7200"))
+        self.max_messages = max_messages or int(os.getenv("SESSION_STORE_MAX_MESSAGES", "40"))
+        # Sliding window used when rendering transcripts for prompts and cache keys, 0 means unbounded
+        self.window_turns = window_turns if window_turns is not None else int(os.getenv("CHAT_HISTORY_WINDOW_TURNS", "0"))
+        self.window_tokens = window_tokens if window_tokens is not None else int(os.getenv("CHAT_HISTORY_WINDOW_TOKENS", "0"))
+        self.sweep_interval = sweep_interval
+        self._sessions = OrderedDict()  # session_id -> [history, last_access, loaded_at]
+        self._lock = threading.RLock()
+        self._last_sweep = time.monotonic()
+        self.evictions = {"lru": 0, "idle": 0}
+
+        self.backend = backend or make_session_backend()
+        self.flush_interval = flush_interval or float(os.getenv("SESSION_FLUSH_INTERVAL", "1.0"))
+        self.flush_batch_size = flush_batch_size or int(os.getenv("SESSION_FLUSH_BATCH_SIZE", "200"))
+        self.refresh_interval = float(os.getenv("SESSION_REFRESH_INTERVAL", "30"))
+        # Unsaved messages kept while the backend is failing; the oldest are dropped beyond this
+        self.max_pending = max_pending or int(os.getenv("SESSION_FLUSH_MAX_PENDING", "10000"))
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._flusher = None
+        self.flush_stats = {"flushes": 0, "messages": 0, "errors": 0, "dropped": 0}
+
+    def _new_history(self, session_id) -> BaseChatMessageHistory:
+        history = self._empty_history()
+        if self.backend.persistent:
+            if self._has_pending(session_id):
+                self.flush()
+            try:
+                history.load_messages(self.backend.load(session_id, limit=self.max_messages))
+            except Exception as e:
+                logger.error("Could not load history for session %s: %s", session_id, e)
+            history._on_add = lambda message: self._enqueue(session_id, message)
+        return history
+
+    def _empty_history(self):
+        return BoundedChatMessageHistory(
+            max_messages=self.max_messages,
+            window_turns=self.window_turns,
+            window_tokens=self.window_tokens,
+        )
+
+    ## Write-behind
+
+    def _has_pending(self, session_id):
+        with self._pending_lock:
+            return any(pending_id == session_id for pending_id, _ in self._pending)
+
+    def _enqueue(self, session_id, message):
+        with self._pending_lock:
+            self._pending.append((session_id, message))
+            self._trim_pending()
+            pending = len(self._pending)
+        if self._flusher is None:
+            self._start_flusher()
+        if pending >= self.flush_batch_size:
+            self._flush_event.set()
+
+    def _trim_pending(self):
+        # caller holds _pending_lock
+        excess = len(self._pending) - self.max_pending
+        if excess > 0:
+            sessions = {session_id for session_id, _ in self._pending[:excess]}
+            del self._pending[:excess]
+            self.flush_stats["dropped"] += excess
+            logger.error("Session history backlog over %d messages, dropped the %d oldest (sessions: %s)",
+                         self.max_pending, excess, ", ".join(sorted(sessions)))
+
+    def _start_flusher(self):
+        with self._flush_lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name="session-store-flusher", daemon=True)
+            self._flusher.start()
+            atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            self.flush()
+
+    def flush(self):
+        """Write every pending message to the backend; safe to call from any thread."""
+        with self._flush_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                self.backend.save(batch)
+            except Exception as e:
+                self.flush_stats["errors"] += 1
+                logger.error("Session history flush of %d messages failed: %s", len(batch), e)
+                with self._pending_lock:
+                    self._pending[:0] = batch
+                    self._trim_pending()
+                return 0
+            self.flush_stats["flushes"] += 1
+            self.flush_stats["messages"] += len(batch)
+            return len(batch)
+
+    def get(self, session_id: str) -> BaseChatMessageHistory:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sweep > self.sweep_interval:
+                self._evict_idle(now)
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                entry[1] = now
+                self._sessions.move_to_end(session_id)
+                if not (self.backend.persistent and now - entry[2] > self.refresh_interval):
+                    return entry[0]
+
+        if entry is not None:
+            # Another worker may have appended to this session since we loaded it
+            return self._refresh(session_id, entry, now)
+
+        # Backend reads happen outside the lock so one slow load does not stall every other session
+        history = self._new_history(session_id)
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                return entry[0]
+            self._sessions[session_id] = [history, now, now]
+            while len(self._sessions) > self.max_sessions:
+                evicted_id, _ = self._sessions.popitem(last=False)
+                self.evictions["lru"] += 1
+                logger.debug("Evicted least recently used session %s", evicted_id)
+        return history
+
+    def _refresh(self, session_id, entry, now):
+        # Reload into a new history and swap it in under the lock; the old one stays intact for
+        # requests already holding it, and messages they add meanwhile are carried over.
+        old = entry[0]
+        last_seen = old.messages[-1] if old.messages else None
+        if self._has_pending(session_id):
+            self.flush()
+        try:
+            messages = self.backend.load(session_id, limit=self.max_messages)
+        except Exception as e:
+            logger.error("Could not refresh history for session %s: %s", session_id, e)
+            entry[2] = now
+            return old
+        history = self._empty_history()
+        history.load_messages(messages)
+        with self._lock:
+            if self._sessions.get(session_id) is not entry or entry[0] is not old:
+                return entry[0]
+            # added to the old history after the load began; skip any the load already returned
+            added = self._added_since(old, last_seen)
+            loaded_tail = history.messages[-len(added):] if added else []
+            history.load_messages([message for message in added if message not in loaded_tail])
+            history.adopt_summary(old)
+            history._on_add = old._on_add
+            entry[0] = history
+            entry[2] = now
+        return history
+
+    @staticmethod
+    def _added_since(history, last_seen):
+        if last_seen is None:
+            return list(history.messages)
+        for index in range(len(history.messages) - 1, -1, -1):
+            if history.messages[index] is last_seen:
+                return history.messages[index + 1:]
+        return list(history.messages)
+
+    def _evict_idle(self, now):
+        self._last_sweep = now
+        # Oldest sessions sit at the front, so stop at the first one still inside the TTL
+        while self._sessions:
+            session_id, (_, last_access, _) = next(iter(self._sessions.items()))
+            if now - last_access <= self.idle_ttl:
+                break
+            del self._sessions[session_id]
+            self.evictions["idle"] += 1
+
+    def evict_idle(self):
+        with self._lock:
+            self._evict_idle(time.monotonic())
+
+    def drop(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __contains__(self, session_id):
+        with self._lock:
+            return session_id in self._sessions
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def memory_usage(self):
+        """Approximate footprint of the stored histories, for health and metrics endpoints."""
+        with self._lock:
+            histories = [entry[0] for entry in self._sessions.values()]
+        with self._pending_lock:
+            pending = len(self._pending)
+        messages = 0
+        approx_bytes = 0
+        for history in histories:
+            for message in history.messages:
+                messages += 1
+                approx_bytes += sys.getsizeof(message.content) + sys.getsizeof(message)
+        return {
+            "sessions": len(histories),
+            "max_sessions": self.max_sessions,
+            "messages": messages,
+            "approx_bytes": approx_bytes,
+            "evictions": dict(self.evictions),
+            "pending_writes": pending,
+            "max_pending_writes": self.max_pending,
+            "flush": dict(self.flush_stats),
+        }
@@ -0,0 +1,158 @@
+import re
+import json
+import asyncio
+import contextlib
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+# longest tail kept while looking for the key, in case it is split across chunks
+_SEARCH_TAIL = 64
+_DONE = object()
+
+
+class ResponseStreamer:
+    """Extracts the ``"response"`` string of the JSON answer the prompts ask for, chunk by chunk.
+
+    ``feed`` takes raw model tokens and returns the newly decoded part of the field (escapes,
+    including ``\\uXXXX`` split across chunks, are decoded). Everything before the key and after
+    the closing quote, e.g. ``Suggestive_Answers``, is ignored; the caller still parses the full
+    output for the final answer.
+    """
+
+    def __init__(self, field="response"):
+        self._key = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._buffer = ""
+        self.state = "search"
+        self.parts = []
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+    @property
+    def done(self):
+        return self.state == "done"
+
+    def feed(self, chunk):
+        if self.state == "done" or not chunk:
+            return ""
+        self._buffer += chunk
+        if self.state == "search":
+            match = self._key.search(self._buffer)
+            if match is None:
+                self._buffer = self._buffer[-_SEARCH_TAIL:]
+                return ""
+            self._buffer = self._buffer[match.end():]
+            self.state = "value"
+        text, consumed = self._decode(self._buffer)
+        self._buffer = self._buffer[consumed:]
+        if text:
+            self.parts.append(text)
+        return text
+
+    def _decode(self, buf):
+        out = []
+        i, n = 0, len(buf)
+        while i < n:
+            c = buf[i]
+            if c == '"':
+                self.state = "done"
+                return "".join(out), i + 1
+            if c != "\\":
+                out.append(c)
+                i += 1
+                continue
+            if i + 1 >= n:
+                break
+            escape = buf[i + 1]
+            if escape != "u":
+                out.append(_ESCAPES.get(escape, escape))
+                i += 2
+                continue
+            if i + 6 > n:
+                break
+            try:
+                code = int(buf[i + 2:i + 6], 16)
+            except ValueError:
+                out.append(buf[i:i + 6])
+                i += 6
+                continue
+            if 0xD800 <= code < 0xDC00:
+                # high surrogate, wait for the low half
+                if i + 12 > n:
+                    break
+                try:
+                    low = int(buf[i + 8:i + 12], 16) if buf[i + 6:i + 8] == "\\u" else None
+                except ValueError:
+                    low = None
+                if low is not None and 0xDC00 <= low < 0xE000:
+                    out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                    i += 12
+                    continue
+            out.append(chr(code))
+            i += 6
+        return "".join(out), i
+
+
+def chunk_text(chunk):
+    """Text of a streamed message chunk (content may be a string or a list of content blocks)."""
+    content = getattr(chunk, "content", chunk)
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(part if isinstance(part, str) else str(part.get("text", "")) for part in content if isinstance(part, (str, dict)))
+    return ""
+
+
+def token_event(text):
+    return {"type": "token", "text": text}
+
+
+def final_event(data):
+    """Last event of a stream, with the same dict the non-streaming function returns."""
+    return {"type": "final", "data": data}
+
+
+def sse(event):
+    return f"data: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+
+
+async def sse_stream(events):
+    """Wrap an event stream as Server-Sent Events (e.g. for a StreamingResponse with text/event-stream)."""
+    async for event in events:
+        yield sse(event)
+
+
+async def stream_in_task(events):
+    """Run an async generator of events in its own task and re-yield them through a queue.
+
+    The task works on a copy of the caller's context, so ContextVars the generator sets
+    (request_scope, get_openai_callback) are set and reset in that task and never held across
+    the consumer's yields. Closing this stream (client disconnect, aclose) cancels the task.
+    """
+    queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for event in events:
+                queue.put_nowait((event, None))
+        except Exception as e:
+            queue.put_nowait((_DONE, e))
+        else:
+            queue.put_nowait((_DONE, None))
+        finally:
+            await events.aclose()
+
+    task = asyncio.create_task(pump())
+    try:
+        while True:
+            event, error = await queue.get()
+            if event is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield event
+    finally:
+        if not task.done():
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
@@ -2,21 +2,30 @@ from dotenv import load_dotenv
 load_dotenv()
 import os
 import json
+import asyncio
 import logging
+import threading
 from langchain_openai import AzureChatOpenAI
 from typing import List
 from langchain.schema import HumanMessage, AIMessage
 from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.chat_history import BaseChatMessageHistory
+from Support_chatbot.base_chatbot.session_store import SessionStore, format_session_histories
+from Support_chatbot.base_chatbot.history_summary import HistoryCompactor
+from Support_chatbot.base_chatbot.agent_cache import AgentCache
+from Support_chatbot.base_chatbot.request_context import request_scope, current_request
+from Support_chatbot.base_chatbot.streaming import ResponseStreamer, chunk_text, token_event, final_event, stream_in_task
 from langchain.agents import AgentExecutor, create_tool_calling_agent
 from langchain.tools.retriever import create_retriever_tool
 from langchain.prompts import ChatPromptTemplate
-from Support_chatbot.custom_chatbots.tools.monday_blossom import get_Monday_details,get_Monday_details_from_email,update_in_monday
+from Support_chatbot.custom_chatbots.tools.monday_blossom import get_Monday_details,get_Monday_details_from_email,update_in_monday,aget_Monday_details,aget_Monday_details_from_email,aupdate_in_monday
+from Support_chatbot.custom_chatbots.tools.monday_records import render_details
 from Support_chatbot.custom_chatbots.tools.response_format_bot import response_format_chatbot
-from Support_chatbot.custom_chatbots.tools.shopify_order_editing import add_line_item_and_commit,get_order_details
-from Support_chatbot.custom_chatbots.tools.check_productid import get_productid
+from Support_chatbot.custom_chatbots.tools.shopify_order_editing import add_line_item_and_commit,aadd_line_item_and_commit
+from Support_chatbot.custom_chatbots.tools.check_productid import get_productid,aget_productid
+from Support_chatbot.custom_chatbots.tools.product_resolver import ProductResolver
 from product_chatbot.product_parser.get_details import get_product_data
-from langchain_core.tools import tool
+from langchain_core.tools import StructuredTool
 import re
 from datetime import datetime
 from pymongo import MongoClient
@@ -34,7 +43,9 @@ logger = logging.getLogger(__name__)
 model = AzureChatOpenAI(
     openai_api_version=os.environ["AZURE_OPENAI_API_VERSION"],
     azure_deployment=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"],
+    stream_usage=True,  # token usage for get_openai_callback on streamed answers
 )
+history_compactor = HistoryCompactor(model)
 
 #Format Chat History
 def format_chat_history(chat_history):
@@ -47,12 +58,9 @@ def format_chat_history(chat_history):
     return "".join(formatted_chat)
 
 
-store = {}
+store = SessionStore()
 def get_session_history(session_id: str) -> BaseChatMessageHistory:
-    global store
-    if session_id not in store:
-        store[session_id] = ChatMessageHistory()
-    return store[session_id]
+    return store.get(session_id)
 
 def format_cache_chat_history(chat_history):
     formatted_chat = []
@@ -61,11 +69,6 @@ def format_cache_chat_history(chat_history):
             formatted_chat.append(f"{message.content}\n")
     return "".join(formatted_chat)
   
-database=None
-chat_history_tool=[]
-bot_id_global=""
-tag=False
-session_id_global=""
 
 def log_order_update(order_number, variant_id, variant_title, quantity, session_id, bot_id, discount_percentage, discount_description, line_item_id=None, customer_name=None, customer_email=None):
     try:
@@ -132,8 +135,47 @@ def log_order_update(order_number, variant_id, variant_title, quantity, session_
         logger.error(f"Error logging order update: {str(e)}", exc_info=True)
         return False
 
-@tool
-def Order_details_order_number_name(order_number: str,name: str) -> str:
+def _format_order_number_name(ans, name):
+    if ans is None:
+        return "Order number or name not found"
+    else:
+        matched=[]
+        for i in ans:
+            names=str(name).lower().strip()
+            order_name=str(i.name).lower().strip()
+            print(names)
+            print(order_name)
+            if names in order_name:
+                matched.append(i)
+        ans_str=render_details(matched)
+
+        if ans_str=="":
+            return "Order number or name not found"
+        else:
+            return ans_str
+
+def _format_email(ans):
+    if ans is None:
+        return "Email not found"
+    else:
+        ans_str=render_details(ans)
+        if ans_str=="":
+            return "Email not found"
+        else:
+            return ans_str
+
+def _finish_order_update(order_update, order_number, variantid, variant_title, quantity, customer_name, customer_email):
+    # logs a committed order edit and returns the message for the customer
+    discount_percentage = order_update.get("discount_percentage", 15)
+    discount_description = order_update.get("discount_description", "15% off")
+    order_message = order_update.get("message", "Order update successful")
+    ctx = current_request()
+    log_result = log_order_update(order_number=order_number,variant_id=variantid,variant_title=variant_title,quantity=quantity,session_id=ctx.session_id,bot_id=ctx.bot_id,discount_percentage=discount_percentage,discount_description=discount_description,line_item_id=None,customer_name=customer_name,customer_email=customer_email)
+    logger.info(f"Log result: {log_result}")
+    return order_message
+
+
+def order_details_order_number_name(order_number: str,name: str) -> str:
     """Get details about a orders with order number and name
     Args:
         order_number: The order number to get details about
@@ -142,31 +184,20 @@ def Order_details_order_number_name(order_number: str,name: str) -> str:
         A string containing the details of the order
     """
     try:
-        ans=get_Monday_details(order_number)
-        if ans is None:
-            return "Order number or name not found"
-        else:
-            ans_str=""
-            for i in ans:
-                names=str(name).lower().strip()
-                order_name=str(i.name).lower().strip()
-                print(names)
-                print(order_name)
-                if names in order_name:
-                    ans_str += i.str_details()
-                    ans_str += "\n\n"
-
-            if ans_str=="":
-                return "Order number or name not found"
-            else:
-                return ans_str
+        return _format_order_number_name(get_Monday_details(order_number), name)
     except Exception as e:
         logger.error("Error in Order_details_order_number_name: %s", str(e), exc_info=True)
         return "Order number or name not found"
-        
 
-@tool
-def Order_details_email(email: str) -> str:
+async def aorder_details_order_number_name(order_number: str,name: str) -> str:
+    try:
+        return _format_order_number_name(await aget_Monday_details(order_number), name)
+    except Exception as e:
+        logger.error("Error in Order_details_order_number_name: %s", str(e), exc_info=True)
+        return "Order number or name not found"
+
+
+def order_details_email(email: str) -> str:
     """Get details about a orders with email
     Args:
         email: The email of the customer
@@ -174,25 +205,20 @@ def Order_details_email(email: str) -> str:
         A string containing the details of the order
     """
     try:
-        ans=get_Monday_details_from_email(email)
-        if ans is None:
-            return "Email not found"
-        else:
-            ans_str=""
-            for i in ans:
-                ans_str+=i.str_details()
-                ans_str+="\n\n"
-            if ans_str=="":
-                return "Email not found"
-            else:
-                return ans_str
+        return _format_email(get_Monday_details_from_email(email))
+    except Exception as e:
+        logger.error("Error in Order_details_email: %s", str(e), exc_info=True)
+        return "Email not found"
+
+async def aorder_details_email(email: str) -> str:
+    try:
+        return _format_email(await aget_Monday_details_from_email(email))
     except Exception as e:
         logger.error("Error in Order_details_email: %s", str(e), exc_info=True)
         return "Email not found"
 
 
-@tool
-def get_product_details(product_description: str) -> str:
+def product_details(product_description: str) -> str:
     """Get details about a product
     Args:
         product_description: The description of the product or the product name
@@ -200,17 +226,121 @@ def get_product_details(product_description: str) -> str:
         A string containing the details of the product
     """
     try:
-        ans=str(database.products_similarity_search(bot_id_global,product_description,5))
-        if ans is None:
+        # compact JSON (title, variants, price, availability, score) instead of Document reprs
+        ctx = current_request()
+        ans=ctx.db.products_search(ctx.bot_id,product_description,5)
+        if not ans:
             return "Product not found"
         else:
-            return ans
+            return json.dumps(ans, ensure_ascii=False, default=str)
     except Exception as e:
         logger.error("Error in get_product_details: %s", str(e), exc_info=True)
         return "Product not found"
 
-@tool
-def add_product_to_order_name(order_number: str,name: str,product_name: str,variant_title: str,details: str,quantity: int=1) -> str:
+async def aproduct_details(product_description: str) -> str:
+    # the vector search is a blocking pymongo call
+    return await asyncio.to_thread(product_details, product_description)
+
+
+def _product_documents(product_name):
+    # full product documents for get_productid, the compact tool output can drop variant ids
+    try:
+        ctx = current_request()
+        return str(ctx.db.products_similarity_search(ctx.bot_id,product_name,5))
+    except Exception as e:
+        logger.error("Error in _product_documents: %s", str(e), exc_info=True)
+        return "Product not found"
+
+
+# Deterministic variant lookup, one resolver (and catalog index) per products_data collection
+_product_resolvers = {}
+_product_resolvers_lock = threading.Lock()
+
+def _product_resolver(collection_product_data):
+    if collection_product_data is None:
+        return None
+    # db.products_data() returns a new Collection object per call, key on the "db.collection" name
+    key = getattr(collection_product_data, "full_name", None) or id(collection_product_data)
+    resolver = _product_resolvers.get(key)
+    if resolver is None:
+        with _product_resolvers_lock:
+            resolver = _product_resolvers.get(key)
+            if resolver is None:
+                resolver = _product_resolvers[key] = ProductResolver(collection_product_data)
+    return resolver
+
+def _resolve_variant(product_name, variant_title):
+    ctx = current_request()
+    checker = ctx.product_resolver.resolve(ctx.bot_id, product_name, variant_title) if ctx.product_resolver is not None else None
+    if checker is None:
+        product_details_str=_product_documents(product_name)
+        checker=get_productid(product_details_str,ctx.chat_history,product_name,variant_title)
+        checker["resolved_by"]="llm"
+    logger.info("Variant for %s / %s resolved by %s", product_name, variant_title, checker["resolved_by"])
+    return checker
+
+async def _aresolve_variant(product_name, variant_title):
+    ctx = current_request()
+    checker = None
+    if ctx.product_resolver is not None:
+        # the catalog index is built from a blocking Mongo read
+        checker = await asyncio.to_thread(ctx.product_resolver.resolve, ctx.bot_id, product_name, variant_title)
+    if checker is None:
+        product_details_str=await asyncio.to_thread(_product_documents, product_name)
+        checker=await aget_productid(product_details_str,ctx.chat_history,product_name,variant_title)
+        checker["resolved_by"]="llm"
+    logger.info("Variant for %s / %s resolved by %s", product_name, variant_title, checker["resolved_by"])
+    return checker
+
+
+def _variant_or_reason(checker):
+    # (variant id, None) when the product was found, else (None, message for the customer)
+    if checker["product_found"]:
+        return checker["variant_id"], None
+    return None, checker["reason"]
+
+def _order_update_message(order_update, order_number, variantid, variant_title, quantity, customer_name, customer_email):
+    if order_update is None:
+        return "Order update failed"
+    if not isinstance(order_update, dict):
+        return order_update
+    order_message=_finish_order_update(order_update,order_number,variantid,variant_title,quantity,customer_name,customer_email)
+    current_request().add_tag("Order Update")
+    return order_message
+
+def _add_product(product_name, variant_title, details, quantity, order_number=None, name=None, email=None):
+    ctx = current_request()
+    variantid, reason = _variant_or_reason(_resolve_variant(product_name,variant_title))
+    if variantid is None:
+        return reason
+    ans,check=update_in_monday(order_number,name,email,details)
+    if check:
+        return ans
+    if email is not None:
+        # the email lookup returns the order number
+        order_number=ans
+    logger.debug("Adding variant %s to order %s", variantid, order_number)
+    # logs the order before and after the edit, from the lookup and commit responses
+    order_update=add_line_item_and_commit(order_number,variantid,quantity,ctx.chat_id,ctx.bot_id,ctx.session_id)
+    return _order_update_message(order_update,order_number,variantid,variant_title,quantity,name,email)
+
+async def _aadd_product(product_name, variant_title, details, quantity, order_number=None, name=None, email=None):
+    ctx = current_request()
+    variantid, reason = _variant_or_reason(await _aresolve_variant(product_name,variant_title))
+    if variantid is None:
+        return reason
+    ans,check=await aupdate_in_monday(order_number,name,email,details)
+    if check:
+        return ans
+    if email is not None:
+        order_number=ans
+    logger.debug("Adding variant %s to order %s", variantid, order_number)
+    order_update=await aadd_line_item_and_commit(order_number,variantid,quantity,ctx.chat_id,ctx.bot_id,ctx.session_id)
+    # logging the update is a blocking Mongo write
+    return await asyncio.to_thread(_order_update_message,order_update,order_number,variantid,variant_title,quantity,name,email)
+
+
+def add_product_to_order_name_sync(order_number: str,name: str,product_name: str,variant_title: str,details: str,quantity: int=1) -> str:
     """Add products to your existing order using the order number and name of the customer
     Args:
         order_number: The order number to add the product to
@@ -223,39 +353,20 @@ def add_product_to_order_name(order_number: str,name: str,product_name: str,vari
         A string informing if the update was successful or not
     """
     try:
-        global tag
-        product_details=get_product_details(product_name)
-        checker=get_productid(product_details,chat_history_tool,product_name,variant_title)
-        if checker["product_found"]:
-            variantid=checker["variant_id"]
-        else:
-            return checker["reason"]
-        ans,check=update_in_monday(order_number,name,None,details)
-        print("order_number: ",order_number,"\nname: ",name,"\nans: ",ans,"\nvariantid: ",variantid)
-        if check:
-            return ans
-        get_order_details(order_number,(session_id_global+bot_id_global),bot_id_global,session_id_global)
-        order_update=add_line_item_and_commit(order_number,variantid,quantity)
-        if order_update is None:
-            return "Order update failed"
-        elif isinstance(order_update, dict):
-            get_order_details(order_number,(session_id_global+bot_id_global),bot_id_global,session_id_global)
-            discount_percentage = order_update.get("discount_percentage", 15)
-            discount_description = order_update.get("discount_description", "15% off")
-            order_message = order_update.get("message", "Order update successful")
-            log_result = log_order_update(order_number=order_number,variant_id=variantid,variant_title=variant_title,quantity=quantity,session_id=session_id_global,bot_id=bot_id_global,discount_percentage=discount_percentage,discount_description=discount_description,line_item_id=None,customer_name=name,customer_email=None)
-            logger.info(f"Log result: {log_result}")
-            tag=True
-            return order_message
-        else:
-            return order_update
+        return _add_product(product_name,variant_title,details,quantity,order_number=order_number,name=name)
+    except Exception as e:
+        logger.error("Error in add_product_to_order_name: %s", str(e), exc_info=True)
+        return "Order update failed"
+
+async def aadd_product_to_order_name(order_number: str,name: str,product_name: str,variant_title: str,details: str,quantity: int=1) -> str:
+    try:
+        return await _aadd_product(product_name,variant_title,details,quantity,order_number=order_number,name=name)
     except Exception as e:
         logger.error("Error in add_product_to_order_name: %s", str(e), exc_info=True)
         return "Order update failed"
     
 
-@tool
-def add_product_to_order_email(email: str,product_name: str,variant_title: str,details: str,quantity: int=1) -> str:
+def add_product_to_order_email_sync(email: str,product_name: str,variant_title: str,details: str,quantity: int=1) -> str:
     """Add products to your existing order using the email of the customer
     Args:
         email: The email of the customer
@@ -267,69 +378,30 @@ def add_product_to_order_email(email: str,product_name: str,variant_title: str,d
         A string informing if the update was successful or not
     """
     try:
-        global tag
-        product_details=get_product_details(product_name)
-        checker=get_productid(product_details,chat_history_tool,product_name,variant_title)
-        if checker["product_found"]:
-            variantid=checker["variant_id"]
-        else:
-            return checker["reason"]
-        ans,check=update_in_monday(None,None,email,details)
-        print("email: ",email,"\nans: ",ans,"\nvariantid: ",variantid)
-        if check:
-            return ans
-        print("email: ",email,"\nans: ",ans,"\nvariantid: ",variantid)
-        get_order_details(ans,(session_id_global+bot_id_global),bot_id_global,session_id_global)
-        order_update=add_line_item_and_commit(ans,variantid,quantity)
-        if order_update is None:
-            return "Order update failed"
-        elif isinstance(order_update, dict):
-            get_order_details(ans,(session_id_global+bot_id_global),bot_id_global,session_id_global)
-            discount_percentage = order_update.get("discount_percentage", 15)
-            discount_description = order_update.get("discount_description", "15% off")
-            order_message = order_update.get("message", "Order update successful")
-            log_result = log_order_update(order_number=ans,variant_id=variantid,variant_title=variant_title,quantity=quantity,session_id=session_id_global,bot_id=bot_id_global,discount_percentage=discount_percentage,discount_description=discount_description,line_item_id=None,customer_name=None,customer_email=email)
-            logger.info(f"Log result: {log_result}")
-            tag=True
-            return order_message
-        else:
-            return order_update
+        return _add_product(product_name,variant_title,details,quantity,email=email)
     except Exception as e:
         logger.error("Error in add_product_to_order_email: %s", str(e), exc_info=True)
         return "Order update failed"
 
-#MAIN FUNCTION
-def blossom_monday_order_update_Qna(question, session_id, bot_id, user_prompt, db, cache, collection_product_data, shop, order_editing_flag=True):
-    global database,chat_history_tool,tag,session_id_global,bot_id_global
-    tag=False
-    database=db
-    session_id_global=session_id
-    logger.info("Starting QnA process for session_id: %s, bot_id: %s", session_id, bot_id)
-    t0 = time.time()
+async def aadd_product_to_order_email(email: str,product_name: str,variant_title: str,details: str,quantity: int=1) -> str:
+    try:
+        return await _aadd_product(product_name,variant_title,details,quantity,email=email)
+    except Exception as e:
+        logger.error("Error in add_product_to_order_email: %s", str(e), exc_info=True)
+        return "Order update failed"
 
-    global store,format_for_chat,bot_id_global
-    bot_id_global=bot_id
-    
-    chat_message_history = get_session_history(session_id)
-    chat_history = format_chat_history(chat_message_history.messages)
-    chat_history_tool=chat_history
 
-    ##CACHING
-    chat_history_cache = format_cache_chat_history(chat_message_history.messages)
-    logger.debug("Checking cache with bot_id: %s, question: %s", bot_id, question)
-    cached_data = cache.check_cache(bot_id, question, chat_history_cache)
-    if cached_data:
-        logger.info("Cache hit: %s", cached_data)
-        chat_message_history.add_user_message(question)
-        a_out = cached_data
-        ans = ("response : "+ str(a_out['response']) + '\nSuggestive_Answers: '+str(a_out['leading_queries'])).replace("{","(").replace("}",")")
-        
-        chat_message_history.add_ai_message(ans)
-        logger.info("Returning cached response")
-        return cached_data
-    else:
-        logger.info("Cache miss - proceeding with retrieval")
+# Tools with both a sync and a native async implementation (agent.invoke / agent.ainvoke)
+Order_details_order_number_name = StructuredTool.from_function(func=order_details_order_number_name, coroutine=aorder_details_order_number_name, name="Order_details_order_number_name")
+Order_details_email = StructuredTool.from_function(func=order_details_email, coroutine=aorder_details_email, name="Order_details_email")
+get_product_details = StructuredTool.from_function(func=product_details, coroutine=aproduct_details, name="get_product_details")
+add_product_to_order_name = StructuredTool.from_function(func=add_product_to_order_name_sync, coroutine=aadd_product_to_order_name, name="add_product_to_order_name")
+add_product_to_order_email = StructuredTool.from_function(func=add_product_to_order_email_sync, coroutine=aadd_product_to_order_email, name="add_product_to_order_email")
+
+#MAIN FUNCTION
+agent_cache = AgentCache("blossom_order_update")
 
+def _build_agent_executor(db, bot_id, order_editing_flag):
     logger.debug("Initializing retriever for bot_id: %s", bot_id)
     vector_store_pages,pages_retriever = db.pages_k_retriever(bot_id,8)
     retriever_tool = create_retriever_tool(
@@ -351,92 +423,175 @@ def blossom_monday_order_update_Qna(question, session_id, bot_id, user_prompt, d
     
     logger.debug("Creating agent with tools: %s", tools)
     agent = create_tool_calling_agent(model, tools, current_prompt)
-    agent_executor = AgentExecutor(agent=agent, tools=tools)
+    return AgentExecutor(agent=agent, tools=tools)
+
+def blossom_monday_order_update_Qna(question, session_id, bot_id, user_prompt, db, cache, collection_product_data, shop, order_editing_flag=True):
+    # the tools read db/bot/session/history from the request context, not module globals
+    with request_scope(db=db, bot_id=bot_id, session_id=session_id, product_resolver=_product_resolver(collection_product_data)) as ctx:
+        return _order_update_Qna(ctx, question, session_id, bot_id, user_prompt, db, cache, collection_product_data, shop, order_editing_flag)
+
+def _start_turn(question, session_id, bot_id, cache):
+    # history, cache lookup and compaction; a cache hit is recorded in the history right away
+    chat_message_history = get_session_history(session_id)
+    chat_history, chat_history_cache = format_session_histories(chat_message_history)
+
+    ##CACHING
+    logger.debug("Checking cache with bot_id: %s, question: %s", bot_id, question)
+    cached_data = cache.check_cache(bot_id, question, chat_history_cache)
+    if cached_data:
+        logger.info("Cache hit: %s", cached_data)
+        chat_message_history.add_user_message(question)
+        a_out = cached_data
+        ans = ("response : "+ str(a_out['response']) + '\nSuggestive_Answers: '+str(a_out['leading_queries'])).replace("{","(").replace("}",")")
+        
+        chat_message_history.add_ai_message(ans)
+        logger.info("Returning cached response")
+        return cached_data, chat_message_history, chat_history, chat_history_cache
+    else:
+        logger.info("Cache miss - proceeding with retrieval")
+    chat_history = history_compactor.compact(chat_message_history, bot_id, chat_history)
+    return None, chat_message_history, chat_history, chat_history_cache
+
+def _finish_turn(ctx, a, question, bot_id, db, cache, collection_product_data, shop, chat_message_history, chat_history_cache, t0):
+    # parses the agent output, adds product data and the order-update tag, then saves it to the cache and the history
+    try:
+        logger.debug("Parsing agent output: %s", a)
+        # Improved JSON extraction logic
+        json_match = re.search(r'(\{.*\})', a, re.DOTALL)
+        if json_match:
+            json_str = json_match.group(1).replace("None","null")
+            try:
+                a = json.loads(json_str, strict=False)
+            except Exception as e:
+                a=response_format_chatbot(format_for_chat,a)
+            if "Suggestive_Answers" in a:
+                a['leading_queries'] = a['Suggestive_Answers']
+            a_out = a
+            logger.debug("Parsed output: %s", a_out)
+        else:
+            logger.error("No JSON found in output: %s", a)
+            a_out = response_format_chatbot(format_for_chat,a)
+            if a_out is None:
+                logger.info("LLM formater error in output: %s", a)
+                output_data = {
+                    "response": "Sorry there was an Network Error,Please ask the question again.",
+                    "leading_queries":[]
+                }
+                return output_data
+            if "Suggestive_Answers" in a_out:
+                a_out['leading_queries'] = a_out['Suggestive_Answers']
+        
+
+    except Exception as e:
+        logger.error("JSON parsing error: %s\nRaw output: %s", str(e), a)
+        output_data = {
+            "response": "Sorry there was an Network Error,Please ask the question again.",
+            "leading_queries":[]
+        }
+        return output_data
+    
+    print("a_out: ",a_out)
+    
+    ## get product details
+    a_out=get_product_data(a_out,bot_id,shop,db.vector_store(bot_id,"_products_embeddings"),collection_product_data)
+
+    # Save History and Cache
+    try:
+        t6 = time.time()
+        ans = ("response : "+ str(a_out['response']) +'\nSuggestive_Answers: '+str(a_out['leading_queries'])+'\nProducts: '+str(a_out['products'])).replace("{","(").replace("}",")")
+        
+        logger.info("Updating cache for bot_id: %s, question: %s", bot_id, question)
+        cache.insert_cache(bot_id, question, chat_history_cache, a_out)
+        t7 = time.time()
+        logger.debug("Cache update took %.2f seconds", t7-t6)
+
+        logger.info("Updating chat history")
+        chat_message_history.add_user_message(question)
+        chat_message_history.add_ai_message(ans)
+        
+        logger.info("Total processing time: %.2f seconds", time.time() - t0)
+        
+    except Exception as e:
+        logger.error("Error saving history/cache: %s", str(e), exc_info=True)
+        output_data = {
+            "response": "Sorry there was an issue ,Please ask the question again.",
+            "leading_queries":[]
+        }
+        return output_data
+
+    if ctx.tags:
+        a_out["tags"]=list(ctx.tags)
+    return a_out
+
+AGENT_ERROR = {
+    "response": "Please ask appropriate question.",
+    "leading_queries":[]
+}
+
+def _order_update_Qna(ctx, question, session_id, bot_id, user_prompt, db, cache, collection_product_data, shop, order_editing_flag):
+    logger.info("Starting QnA process for session_id: %s, bot_id: %s", session_id, bot_id)
+    t0 = time.time()
+
+    cached_data, chat_message_history, chat_history, chat_history_cache = _start_turn(question, session_id, bot_id, cache)
+    if cached_data:
+        return cached_data
+    ctx.chat_history=chat_history
+
+    agent_cache.watch(db)
+    agent_executor = agent_cache.get((bot_id, bool(order_editing_flag)), lambda: _build_agent_executor(db, bot_id, order_editing_flag))
 
     try:
         logger.info("Executing agent with question: %s", question)
         for step in agent_executor.stream({"input": question,"chat_history":chat_history,"user_prompt":user_prompt}):
             logger.info("Agent step: %s", step)
             ans = step
-        a = ans['output']
+        return _finish_turn(ctx, ans['output'], question, bot_id, db, cache, collection_product_data, shop, chat_message_history, chat_history_cache, t0)
+    
+    except Exception as e:
+        logger.error("Agent execution error: %s", str(e), exc_info=True)
+        return dict(AGENT_ERROR)
 
-        try:
-            logger.debug("Parsing agent output: %s", a)
-            # Improved JSON extraction logic
-            import re
-            json_match = re.search(r'(\{.*\})', a, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1).replace("None","null")
-                try:
-                    a = json.loads(json_str, strict=False)
-                except Exception as e:
-                    a=response_format_chatbot(format_for_chat,a)
-                if "Suggestive_Answers" in a:
-                    a['leading_queries'] = a['Suggestive_Answers']
-                a_out = a
-                logger.debug("Parsed output: %s", a_out)
-            else:
-                logger.error("No JSON found in output: %s", a)
-                a_out = response_format_chatbot(format_for_chat,a)
-                if a_out is None:
-                    logger.info("LLM formater error in output: %s", a)
-                    output_data = {
-                        "response": "Sorry there was an Network Error,Please ask the question again.",
-                        "leading_queries":[]
-                    }
-                    return output_data
-                if "Suggestive_Answers" in a_out:
-                    a_out['leading_queries'] = a_out['Suggestive_Answers']
-            
+async def ablossom_monday_order_update_Qna_stream(question, session_id, bot_id, user_prompt, db, cache, collection_product_data, shop, order_editing_flag=True):
+    """Streaming version of blossom_monday_order_update_Qna, as an async generator of events.
 
-        except Exception as e:
-            logger.error("JSON parsing error: %s\nRaw output: %s", str(e), a)
-            output_data = {
-                "response": "Sorry there was an Network Error,Please ask the question again.",
-                "leading_queries":[]
-            }
-            return output_data
-        
-        print("a_out: ",a_out)
-        
-        ## get product details
-        a_out=get_product_data(a_out,bot_id,shop,db.products_vector_store,collection_product_data)
+    Yields token events with the "response" text as the model writes it, then one final
+    event with the same dict blossom_monday_order_update_Qna returns (products and tags
+    included). The agent runs in its own task, which holds the request context.
+    """
+    async for event in stream_in_task(_order_update_events(question, session_id, bot_id, user_prompt, db, cache, collection_product_data, shop, order_editing_flag)):
+        yield event
+
+async def _order_update_events(question, session_id, bot_id, user_prompt, db, cache, collection_product_data, shop, order_editing_flag):
+    logger.info("Starting streaming QnA process for session_id: %s, bot_id: %s", session_id, bot_id)
+    t0 = time.time()
+
+    with request_scope(db=db, bot_id=bot_id, session_id=session_id, product_resolver=_product_resolver(collection_product_data)) as ctx:
+        cached_data, chat_message_history, chat_history, chat_history_cache = await asyncio.to_thread(_start_turn, question, session_id, bot_id, cache)
+        if cached_data:
+            yield token_event(str(cached_data['response']))
+            yield final_event(cached_data)
+            return
+        ctx.chat_history=chat_history
 
-        # Save History and Cache
         try:
-            t6 = time.time()
-            ans = ("response : "+ str(a_out['response']) +'\nSuggestive_Answers: '+str(a_out['leading_queries'])+'\nProducts: '+str(a_out['products'])).replace("{","(").replace("}",")")
-            
-            logger.info("Updating cache for bot_id: %s, question: %s", bot_id, question)
-            cache.insert_cache(bot_id, question, chat_history_cache, a_out)
-            t7 = time.time()
-            logger.debug("Cache update took %.2f seconds", t7-t6)
-
-            logger.info("Updating chat history")
-            chat_message_history.add_user_message(question)
-            chat_message_history.add_ai_message(ans)
-            
-            logger.info("Total processing time: %.2f seconds", time.time() - t0)
-            
+            agent_cache.watch(db)
+            agent_executor = await asyncio.to_thread(agent_cache.get, (bot_id, bool(order_editing_flag)), lambda: _build_agent_executor(db, bot_id, order_editing_flag))
+            streamer = ResponseStreamer()
+            output = None
+            logger.info("Executing agent with question: %s", question)
+            async for event in agent_executor.astream_events({"input": question,"chat_history":chat_history,"user_prompt":user_prompt}, version="v2"):
+                if event["event"] == "on_chat_model_stream":
+                    text = streamer.feed(chunk_text(event["data"]["chunk"]))
+                    if text:
+                        yield token_event(text)
+                elif event["event"] == "on_chain_end" and not event.get("parent_ids"):
+                    output = event["data"]["output"]["output"]
+            logger.info("Time to stream agent output: %.2f seconds", time.time() - t0)
+            a_out = await asyncio.to_thread(_finish_turn, ctx, output, question, bot_id, db, cache, collection_product_data, shop, chat_message_history, chat_history_cache, t0)
         except Exception as e:
-            logger.error("Error saving history/cache: %s", str(e), exc_info=True)
-            output_data = {
-                "response": "Sorry there was an issue ,Please ask the question again.",
-                "leading_queries":[]
-            }
-            return output_data
-
-        if tag:
-            a_out["tags"]=["Order Update"]
-        return a_out
-    
-    except Exception as e:
-        logger.error("Agent execution error: %s", str(e), exc_info=True)
-        output_data = {
-                "response": "Please ask appropriate question.",
-                "leading_queries":[]
-            }
-        return output_data
+            logger.error("Agent execution error: %s", str(e), exc_info=True)
+            a_out = dict(AGENT_ERROR)
+        yield final_event(a_out)
 
 
 def blossom_monday_order_update_predifined_history(question,session_id,answer,product):
@@ -2,18 +2,24 @@ from dotenv import load_dotenv
 load_dotenv()
 import os
 import json
+import asyncio
 import logging
 from langchain_openai import AzureChatOpenAI
 from typing import List
 from langchain.schema import HumanMessage, AIMessage
 from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.chat_history import BaseChatMessageHistory
+from Support_chatbot.base_chatbot.session_store import SessionStore, format_session_histories
+from Support_chatbot.base_chatbot.history_summary import HistoryCompactor
+from Support_chatbot.base_chatbot.agent_cache import AgentCache
+from Support_chatbot.base_chatbot.streaming import ResponseStreamer, chunk_text, token_event, final_event, stream_in_task
 from langchain.agents import AgentExecutor, create_tool_calling_agent
 from langchain.tools.retriever import create_retriever_tool
 from langchain.prompts import ChatPromptTemplate
-from Support_chatbot.custom_chatbots.tools.monday_blossom import get_Monday_details,get_Monday_details_from_email
+from Support_chatbot.custom_chatbots.tools.monday_blossom import get_Monday_details,get_Monday_details_from_email,aget_Monday_details,aget_Monday_details_from_email
+from Support_chatbot.custom_chatbots.tools.monday_records import render_details
 from Support_chatbot.custom_chatbots.tools.response_format_bot import response_format_chatbot
-from langchain_core.tools import tool
+from langchain_core.tools import StructuredTool
 import re
 
 
@@ -30,7 +36,9 @@ logger = logging.getLogger(__name__)
 model = AzureChatOpenAI(
     openai_api_version=os.environ["AZURE_OPENAI_API_VERSION"],
     azure_deployment=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"],
+    stream_usage=True,  # token usage for get_openai_callback on streamed answers
 )
+history_compactor = HistoryCompactor(model)
 
 #Format Chat History
 def format_chat_history(chat_history):
@@ -43,12 +51,9 @@ def format_chat_history(chat_history):
     return "".join(formatted_chat)
 
 
-store = {}
+store = SessionStore()
 def get_session_history(session_id: str) -> BaseChatMessageHistory:
-    global store
-    if session_id not in store:
-        store[session_id] = ChatMessageHistory()
-    return store[session_id]
+    return store.get(session_id)
 
 def format_cache_chat_history(chat_history):
     formatted_chat = []
@@ -58,70 +63,90 @@ def format_cache_chat_history(chat_history):
     return "".join(formatted_chat)
   
 
-@tool
-def Order_details_order_number_name(order_number: str,name: str) -> str:
-    """Get details about a orders with order number and name
-    Args:
-        order_number: The order number to get details about
-        name: The name of the customer
-    Returns:
-        A string containing the details of the order
-    """
-    ans=get_Monday_details(order_number)
+def _format_order_number_name(ans, name):
     if ans is None:
         return "Order number or name not found"
     else:
-        ans_str=""
+        matched=[]
         for i in ans:
             names=name.lower().strip()
             order_name=i.name.lower().strip()
             print(names)
             print(order_name)
             if name in order_name:
-                ans_str += i.str_details()
-                ans_str += "\n\n"
+                matched.append(i)
+        ans_str=render_details(matched)
 
         if ans_str=="":
             return "Order number or name not found"
         else:
             return ans_str
-        
-@tool
-def Order_details_email(email: str) -> str:
-    """Get details about a orders with email
-    Args:
-        email: The email of the customer
-    Returns:
-        A string containing the details of the order
-    """
-    ans=get_Monday_details_from_email(email)
+
+def _format_email(ans):
     if ans is None:
         return "Email not found"
     else:
-        ans_str=""
-        for i in ans:
-            ans_str+=i.str_details()
-            ans_str+="\n\n"
+        ans_str=render_details(ans)
         if ans_str=="":
             return "Email not found"
         else:
             return ans_str
-        
+
+
+def order_details_order_number_name(order_number: str,name: str) -> str:
+    """Get details about a orders with order number and name
+    Args:
+        order_number: The order number to get details about
+        name: The name of the customer
+    Returns:
+        A string containing the details of the order
+    """
+    return _format_order_number_name(get_Monday_details(order_number), name)
+
+async def aorder_details_order_number_name(order_number: str,name: str) -> str:
+    return _format_order_number_name(await aget_Monday_details(order_number), name)
+
+def order_details_email(email: str) -> str:
+    """Get details about a orders with email
+    Args:
+        email: The email of the customer
+    Returns:
+        A string containing the details of the order
+    """
+    return _format_email(get_Monday_details_from_email(email))
+
+async def aorder_details_email(email: str) -> str:
+    return _format_email(await aget_Monday_details_from_email(email))
+
+# Tools with both a sync and a native async implementation (agent.invoke / agent.ainvoke)
+Order_details_order_number_name = StructuredTool.from_function(func=order_details_order_number_name, coroutine=aorder_details_order_number_name, name="Order_details_order_number_name")
+Order_details_email = StructuredTool.from_function(func=order_details_email, coroutine=aorder_details_email, name="Order_details_email")
 
 
 #MAIN FUNCTION
-def blossom_monday_support_Qna(question, session_id, bot_id, user_prompt, db, cache):
-    logger.info("Starting QnA process for session_id: %s, bot_id: %s", session_id, bot_id)
-    t0 = time.time()
+agent_cache = AgentCache("blossom_support")
 
-    global store,format_for_chat
-    
+def _build_agent_executor(db, bot_id):
+    logger.debug("Initializing retriever for bot_id: %s", bot_id)
+    vector_store_pages,pages_retriever = db.pages_k_retriever(bot_id,8)
+    retriever_tool = create_retriever_tool(
+        pages_retriever,
+        "Blossom_pages_retriever",
+        "Search for information about Blossom. For any questions about Blossom products,delivery,support, you must use this tool!",
+    )
+
+    tools = [retriever_tool,Order_details_order_number_name,Order_details_email]
+    logger.debug("Creating agent with tools: %s", tools)
+    agent = create_tool_calling_agent(model, tools, prompt)
+    return AgentExecutor(agent=agent, tools=tools)
+
+def _start_turn(question, session_id, bot_id, cache):
+    # history, cache lookup and compaction; a cache hit is recorded in the history right away
     chat_message_history = get_session_history(session_id)
-    chat_history = format_chat_history(chat_message_history.messages)
+    chat_history, chat_history_cache = format_session_histories(chat_message_history)
     logger.debug("Formatted chat history: %s", chat_history)
 
     ##CACHING
-    chat_history_cache = format_cache_chat_history(chat_message_history.messages)
     logger.debug("Checking cache with bot_id: %s, question: %s", bot_id, question)
     cached_data = cache.check_cache(bot_id, question, chat_history_cache)
     if cached_data:
@@ -132,97 +157,139 @@ def blossom_monday_support_Qna(question, session_id, bot_id, user_prompt, db, ca
         
         chat_message_history.add_ai_message(ans)
         logger.info("Returning cached response")
-        return cached_data
+        return cached_data, chat_message_history, chat_history, chat_history_cache
     else:
         logger.info("Cache miss - proceeding with retrieval")
+    chat_history = history_compactor.compact(chat_message_history, bot_id, chat_history)
+    return None, chat_message_history, chat_history, chat_history_cache
 
-    logger.debug("Initializing retriever for bot_id: %s", bot_id)
-    vector_store_pages,pages_retriever = db.pages_k_retriever(bot_id,8)
-    retriever_tool = create_retriever_tool(
-        pages_retriever,
-        "Blossom_pages_retriever",
-        "Search for information about Blossom. For any questions about Blossom products,delivery,support, you must use this tool!",
-    )
+def _finish_turn(a, question, bot_id, cache, chat_message_history, chat_history_cache, t0):
+    # parses the agent output, then saves it to the cache and the history
+    try:
+        logger.debug("Parsing agent output: %s", a)
+        # Improved JSON extraction logic
+        json_match = re.search(r'(\{.*\})', a, re.DOTALL)
+        if json_match:
+            json_str = json_match.group(1).replace("None","null")
+            a = json.loads(json_str, strict=False)
+            if "Suggestive_Answers" in a:
+                a['leading_queries'] = a['Suggestive_Answers']
+            a_out = a
+            logger.debug("Parsed output: %s", a_out)
+        else:
+            logger.error("No JSON found in output: %s", a)
+            a_out = response_format_chatbot(format_for_chat,a)
+            if a_out is None:
+                logger.info("LLM formater error in output: %s", a)
+                output_data = {
+                    "response": "Sorry there was an Network Error,Please ask the question again.",
+                    "leading_queries":[]
+                }
+                return output_data
+            if "Suggestive_Answers" in a_out:
+                a_out['leading_queries'] = a_out['Suggestive_Answers']
+        
 
-    tools = [retriever_tool,Order_details_order_number_name,Order_details_email]
-    logger.debug("Creating agent with tools: %s", tools)
-    agent = create_tool_calling_agent(model, tools, prompt)
-    agent_executor = AgentExecutor(agent=agent, tools=tools)
+    except Exception as e:
+        logger.error("JSON parsing error: %s\nRaw output: %s", str(e), a)
+        output_data = {
+            "response": "Sorry there was an Network Error,Please ask the question again.",
+            "leading_queries":[]
+        }
+        return output_data
+
+    # Save History and Cache
+    try:
+        t6 = time.time()
+        ans = ("response : "+ str(a_out['response']) +'\nSuggestive_Answers: '+str(a_out['leading_queries'])).replace("{","(").replace("}",")")
+        
+        logger.info("Updating cache for bot_id: %s, question: %s", bot_id, question)
+        cache.insert_cache(bot_id, question, chat_history_cache, a_out)
+        t7 = time.time()
+        logger.debug("Cache update took %.2f seconds", t7-t6)
+
+        logger.info("Updating chat history")
+        chat_message_history.add_user_message(question)
+        chat_message_history.add_ai_message(ans)
+        
+        logger.info("Total processing time: %.2f seconds", time.time() - t0)
+        
+    except Exception as e:
+        logger.error("Error saving history/cache: %s", str(e), exc_info=True)
+        output_data = {
+            "response": "Sorry there was an issue ,Please ask the question again.",
+            "leading_queries":[]
+        }
+        return output_data
+
+    return a_out
+
+AGENT_ERROR = {
+    "response": "Please ask appropriate question.",
+    "leading_queries":[]
+}
+
+def blossom_monday_support_Qna(question, session_id, bot_id, user_prompt, db, cache):
+    logger.info("Starting QnA process for session_id: %s, bot_id: %s", session_id, bot_id)
+    t0 = time.time()
+
+    cached_data, chat_message_history, chat_history, chat_history_cache = _start_turn(question, session_id, bot_id, cache)
+    if cached_data:
+        return cached_data
+
+    agent_cache.watch(db)
+    agent_executor = agent_cache.get((bot_id,), lambda: _build_agent_executor(db, bot_id))
 
     try:
         logger.info("Executing agent with question: %s", question)
         for step in agent_executor.stream({"input": question,"chat_history":chat_history,"user_prompt":user_prompt}):
             logger.info("Agent step: %s", step)
             ans = step
-        a = ans['output']
-
-        try:
-            logger.debug("Parsing agent output: %s", a)
-            # Improved JSON extraction logic
-            import re
-            json_match = re.search(r'(\{.*\})', a, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1).replace("None","null")
-                a = json.loads(json_str, strict=False)
-                if "Suggestive_Answers" in a:
-                    a['leading_queries'] = a['Suggestive_Answers']
-                a_out = a
-                logger.debug("Parsed output: %s", a_out)
-            else:
-                logger.error("No JSON found in output: %s", a)
-                a_out = response_format_chatbot(format_for_chat,a)
-                if a_out is None:
-                    logger.info("LLM formater error in output: %s", a)
-                    output_data = {
-                        "response": "Sorry there was an Network Error,Please ask the question again.",
-                        "leading_queries":[]
-                    }
-                    return output_data
-                if "Suggestive_Answers" in a_out:
-                    a_out['leading_queries'] = a_out['Suggestive_Answers']
-            
-
-        except Exception as e:
-            logger.error("JSON parsing error: %s\nRaw output: %s", str(e), a)
-            output_data = {
-                "response": "Sorry there was an Network Error,Please ask the question again.",
-                "leading_queries":[]
-            }
-            return output_data
-
-        # Save History and Cache
-        try:
-            t6 = time.time()
-            ans = ("response : "+ str(a_out['response']) +'\nSuggestive_Answers: '+str(a_out['leading_queries'])).replace("{","(").replace("}",")")
-            
-            logger.info("Updating cache for bot_id: %s, question: %s", bot_id, question)
-            cache.insert_cache(bot_id, question, chat_history_cache, a_out)
-            t7 = time.time()
-            logger.debug("Cache update took %.2f seconds", t7-t6)
-
-            logger.info("Updating chat history")
-            chat_message_history.add_user_message(question)
-            chat_message_history.add_ai_message(ans)
-            
-            logger.info("Total processing time: %.2f seconds", time.time() - t0)
-            
-        except Exception as e:
-            logger.error("Error saving history/cache: %s", str(e), exc_info=True)
-            output_data = {
-                "response": "Sorry there was an issue ,Please ask the question again.",
-                "leading_queries":[]
-            }
-            return output_data
-
-        return a_out
+        return _finish_turn(ans['output'], question, bot_id, cache, chat_message_history, chat_history_cache, t0)
     
     except Exception as e:
         logger.error("Agent execution error: %s", str(e), exc_info=True)
-        output_data = {
-                "response": "Please ask appropriate question.",
-                "leading_queries":[]
-            }
-        return output_data
+        return dict(AGENT_ERROR)
+
+async def ablossom_monday_support_Qna_stream(question, session_id, bot_id, user_prompt, db, cache):
+    """Streaming version of blossom_monday_support_Qna, as an async generator of events.
+
+    Yields token events with the "response" text as the model writes it, then one final
+    event with the same dict blossom_monday_support_Qna returns (see base_chatbot.streaming).
+    The agent runs in its own task, so its callbacks stay out of the consumer's context.
+    """
+    async for event in stream_in_task(_support_events(question, session_id, bot_id, user_prompt, db, cache)):
+        yield event
+
+async def _support_events(question, session_id, bot_id, user_prompt, db, cache):
+    logger.info("Starting streaming QnA process for session_id: %s, bot_id: %s", session_id, bot_id)
+    t0 = time.time()
+
+    cached_data, chat_message_history, chat_history, chat_history_cache = await asyncio.to_thread(_start_turn, question, session_id, bot_id, cache)
+    if cached_data:
+        yield token_event(str(cached_data['response']))
+        yield final_event(cached_data)
+        return
+
+    try:
+        agent_cache.watch(db)
+        agent_executor = await asyncio.to_thread(agent_cache.get, (bot_id,), lambda: _build_agent_executor(db, bot_id))
+        streamer = ResponseStreamer()
+        output = None
+        logger.info("Executing agent with question: %s", question)
+        async for event in agent_executor.astream_events({"input": question,"chat_history":chat_history,"user_prompt":user_prompt}, version="v2"):
+            if event["event"] == "on_chat_model_stream":
+                text = streamer.feed(chunk_text(event["data"]["chunk"]))
+                if text:
+                    yield token_event(text)
+            elif event["event"] == "on_chain_end" and not event.get("parent_ids"):
+                output = event["data"]["output"]["output"]
+        logger.info("Time to stream agent output: %.2f seconds", time.time() - t0)
+        a_out = await asyncio.to_thread(_finish_turn, output, question, bot_id, cache, chat_message_history, chat_history_cache, t0)
+    except Exception as e:
+        logger.error("Agent execution error: %s", str(e), exc_info=True)
+        a_out = dict(AGENT_ERROR)
+    yield final_event(a_out)
 
 
 def blossom_monday_support_predifined_history(question,session_id,answer,product):
@@ -68,6 +68,28 @@ def get_productid(products,chat_history,product_name,variant_name):
                 "spam":False
             }
         return output_data
+
+
+async def aget_productid(products,chat_history,product_name,variant_name):
+    print("products: ",products,"\nchat_history: ",chat_history,"\nproduct_name: ",product_name,"\nvariant_name: ",variant_name)
+
+    try:
+        with get_openai_callback() as cb:
+            a= await chain.ainvoke({
+                "products": products,
+                "chat_history": chat_history,
+                "product_name": product_name,
+                "variant_name": variant_name
+            })
+            logger.info(cb)
+
+        logger.debug("Output Initial= %s", a)
+
+        return {"variant_id":a.variant_id,"product_found":a.product_found,"reason":a.reason}
+
+    except Exception as e:
+        logger.error("Invoke error: %s", e)
+        return {"spam":False}
         
 
 
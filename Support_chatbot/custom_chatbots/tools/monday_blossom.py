@@ -4,9 +4,12 @@ import os
 from dotenv import load_dotenv
 import asyncio
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
+from Support_chatbot.custom_chatbots.tools import monday_client, monday_queries
+from Support_chatbot.custom_chatbots.tools.monday_records import details_monday
+from Support_chatbot.custom_chatbots.tools.monday_mirror import MondayMirror
+from caching.memory_cache import TTLCache
 import base64
 import io
 
@@ -23,39 +26,6 @@ from Support_chatbot.custom_chatbots.tools.monday_testing import get_Monday_deta
 
 testing_check=os.getenv("TESTING_CHECK")
 
-class details_monday:
-    def __init__(self,name,status,arrival_date,order_number,order_view,order_type,item_ids,group_name=None):
-        self.name=name
-        self.status=status
-        self.arrival_date=arrival_date
-        self.order_number=order_number
-        self.order_view=order_view
-        self.order_type=order_type
-        self.item_id=item_ids
-        self.group_name=group_name
-    
-    def get_details(self):
-        return self.name,self.status,self.arrival_date,self.order_number,self.order_view,self.order_type,self.group_name
-    
-    def str_details(self):
-        result = f"Name: {self.name}\nStatus: {self.status}"
-        
-        if self.arrival_date != 'Unknown':
-            result += f"\nFlowers Recieved Date: {self.arrival_date}"
-            
-        result += f"\nOrder Number: {self.order_number}"
-        
-        if self.order_view is not None and self.order_view:
-            result += f"\nOrder View: {self.order_view}"
-            
-        result += f"\nOrder Type: {self.order_type}"
-        
-        if self.group_name is not None and self.group_name != 'Unknown':
-            result += f"\nCurrent Stage: {self.group_name}"
-            
-        return result
-
-
 #### Helper Functions ####
 
 def cutoff_date(date_str):
@@ -71,241 +41,36 @@ def cutoff_date(date_str):
         return False
 
 
+###### Boards ######
+# One entry per Monday board, keyed by the alias used in the batched query
+BOARDS = {
+    "painting": {"order_type": "Painting", "board_id": 7874400216, "order_column": "text_mkkybb4e", "email_column": "email_mkkytxjj",
+                 "status_column": "status", "date_column": "date4", "order_view_column": None},
+    "resin": {"order_type": "Resin", "board_id": 1736814970, "order_column": "text2", "email_column": "email",
+              "status_column": "status", "date_column": "date4", "order_view_column": "text28"},
+    "pressed": {"order_type": "Pressed", "board_id": 5511004697, "order_column": "text7", "email_column": "email7",
+                "status_column": "status", "date_column": "arrival_date", "order_view_column": None},
+}
+
+
 ###### Details from Order Number ######
 def get_painting_details(order_number):
     if not order_number:
         print("Error: Order number cannot be empty")
         return None
-        
-    query_painting=f'''query {{
-    items_page_by_column_values (limit: 5, board_id: 7874400216, columns: [{{column_id: "text_mkkybb4e", column_values: ["{order_number}"]}}]) {{
-        cursor
-        items {{
-        id
-        name
-        group {{
-            title
-        }}
-        column_values {{
-            id
-            type
-            value
-            ... on StatusValue  {{ 
-                label
-                update_id
-            }}
-        }}
-        }}
-    }}
-    }}'''
-    data={"query":query_painting}
-    
-    try:
-        r=requests.post(url=apiUrl, json=data, headers=headers, timeout=10)
-        r.raise_for_status()  # Raise exception for 4XX/5XX responses
-    except requests.exceptions.Timeout:
-        print(f"Timeout error when getting painting details for order {order_number}")
-        return None
-    except requests.exceptions.RequestException as e:
-        print(f"Error in getting painting details: {e}")
-        return None
-
-    try:
-        a=r.json()
-    except json.JSONDecodeError:
-        print(f"Invalid JSON response from Monday API for painting order {order_number}")
-        return None
-
-    a=a.get('data', {}).get('items_page_by_column_values', {}).get('items', [])
-
-    if not a:
-        print(f"No details found in painting for order {order_number}")
-        return None
-
-    ans=[]
-    for i in range(len(a)):
-        try:
-            item_id=a[i].get("id")
-            name=a[i].get('name', 'Unknown')
-            status = 'Unknown'
-            arrival_date = 'Unknown'
-            order_number_value = ''
-            group_name = a[i].get('group', {}).get('title', 'Unknown')
-            
-            for j in a[i].get('column_values', []):
-                if j.get('id') == "status":
-                    status = j.get('label', 'Unknown')
-                elif j.get('id') == "date4":
-                    value = j.get('value', '{}')
-                    try:
-                        arrival_date = json.loads(value).get('date', 'Unknown')
-                    except Exception as e:
-                        arrival_date = 'Unknown'
-                elif j.get('id') == "text_mkkybb4e":
-                    order_number_value = j.get('value', '')
-            
-            ans.append(details_monday(name, status, arrival_date, order_number_value, None, "Painting", item_id, group_name))
-        except Exception as e:
-            print(f"Error processing painting item: {e}")
-            continue
-    
-    return ans
+    return monday_queries.fetch_board(BOARDS["painting"], "order_column", order_number, details_monday)
 
 def get_resin_details(order_number):
     if not order_number:
         print("Error: Order number cannot be empty")
         return None
-        
-    query_resin=f'''query {{
-    items_page_by_column_values (limit: 5, board_id: 1736814970, columns: [{{column_id: "text2", column_values: ["{order_number}"]}}]) {{
-        cursor
-        items {{
-        id
-        name
-        group {{
-            title
-        }}
-        column_values {{
-            id
-            type
-            value
-            ... on StatusValue  {{ 
-                label
-                update_id
-            }}
-        }}
-        }}
-    }}
-    }}'''
-    data={"query":query_resin}
-    
-    try:
-        r=requests.post(url=apiUrl, json=data, headers=headers, timeout=10)
-        r.raise_for_status()
-    except requests.exceptions.Timeout:
-        print(f"Timeout error when getting resin details for order {order_number}")
-        return None
-    except requests.exceptions.RequestException as e:
-        print(f"Error in getting resin details: {e}")
-        return None
-        
-    try:
-        a=r.json()
-    except json.JSONDecodeError:
-        print(f"Invalid JSON response from Monday API for resin order {order_number}")
-        return None
-        
-    a=a.get('data', {}).get('items_page_by_column_values', {}).get('items', [])
-    
-    if not a:
-        print(f"No details found in resin for order {order_number}")
-        return None
-
-    ans=[]
-    for i in range(len(a)):
-        item_id=a[i].get("id")
-        name=a[i].get('name', 'Unknown')
-        status = 'Unknown'
-        arrival_date = 'Unknown'
-        order_number_value = ''
-        order_view = ''
-        group_name = a[i].get('group', {}).get('title', 'Unknown')
-        
-        for j in a[i].get('column_values', []):
-            if j.get('id') == "status":
-                status = j.get('label', 'Unknown')
-            elif j.get('id') == "date4":
-                value = j.get('value', '{}')
-                try:
-                    arrival_date = json.loads(value).get('date', 'Unknown')
-                except Exception as e:
-                    arrival_date = 'Unknown'
-            elif j.get('id') == "text2":
-                order_number_value = j.get('value', '')
-            elif j.get('id') == "text28":
-                order_view = j.get('value', '')
-        
-        ans.append(details_monday(name, status, arrival_date, order_number_value, order_view, "Resin", item_id, group_name))
-    
-    return ans
-
+    return monday_queries.fetch_board(BOARDS["resin"], "order_column", order_number, details_monday)
 
 def get_pressed_details(order_number):
     if not order_number:
         print("Error: Order number cannot be empty")
         return None
-        
-    query_pressed=f'''query {{
-    items_page_by_column_values (limit: 5, board_id: 5511004697, columns: [{{column_id: "text7", column_values: ["{order_number}"]}}]) {{
-        cursor
-        items {{
-        id
-        name
-        group {{
-            title
-        }}
-        column_values {{
-            id
-            type
-            value
-            ... on StatusValue  {{ 
-                label
-                update_id
-            }}
-        }}
-        }}
-    }}
-    }}'''
-    data={"query":query_pressed}
-    
-    try:
-        r=requests.post(url=apiUrl, json=data, headers=headers, timeout=10)
-        r.raise_for_status()
-    except requests.exceptions.Timeout:
-        print(f"Timeout error when getting pressed details for order {order_number}")
-        return None
-    except requests.exceptions.RequestException as e:
-        print(f"Error in getting pressed details: {e}")
-        return None
-        
-    try:
-        a=r.json()
-    except json.JSONDecodeError:
-        print(f"Invalid JSON response from Monday API for pressed order {order_number}")
-        return None
-        
-    a=a.get('data', {}).get('items_page_by_column_values', {}).get('items', [])
-    
-    if not a:
-        print(f"No details found in pressed for order {order_number}")
-        return None
-
-    ans=[]
-    for i in range(len(a)):
-        item_id=a[i].get("id")
-        name=a[i].get('name', 'Unknown')
-        status = 'Unknown'
-        arrival_date = 'Unknown'
-        order_number_value = ''
-        group_name = a[i].get('group', {}).get('title', 'Unknown')
-        
-        for j in a[i].get('column_values', []):
-            if j.get('id') == "status":
-                status = j.get('label', 'Unknown')
-            elif j.get('id') == "arrival_date":
-                value = j.get('value', '{}')
-                try:
-                    arrival_date = json.loads(value).get('date', 'Unknown')
-                except Exception as e:
-                    arrival_date = 'Unknown'
-            elif j.get('id') == "text7":
-                order_number_value = j.get('value', '')
-        
-        ans.append(details_monday(name, status, arrival_date, order_number_value, None, "Pressed", item_id, group_name))
-    
-    return ans
-
-
+    return monday_queries.fetch_board(BOARDS["pressed"], "order_column", order_number, details_monday)
 
 
 ###### EMAIL SEARCH ######
@@ -314,356 +79,149 @@ def get_painting_details_from_email(email):
     if not email:
         print("Error: Email cannot be empty")
         return None
-        
-    query_painting=f'''query {{
-    items_page_by_column_values (limit: 5, board_id: 7874400216, columns: [{{column_id: "email_mkkytxjj", column_values: ["{email}"]}}]) {{
-        cursor
-        items {{
-        id
-        name
-        group {{
-            title
-        }}
-        column_values {{
-            id
-            type
-            value
-            ... on StatusValue  {{ 
-                label
-                update_id
-            }}
-        }}
-        }}
-    }}
-    }}'''
-    data={"query":query_painting}
-    
-    try:
-        r=requests.post(url=apiUrl, json=data, headers=headers, timeout=10)
-        r.raise_for_status()  # Raise exception for 4XX/5XX responses
-    except requests.exceptions.Timeout:
-        print(f"Timeout error when getting painting details for email {email}")
-        return None
-    except requests.exceptions.RequestException as e:
-        print(f"Error in getting painting details: {e}")
-        return None
-
-    try:
-        a=r.json()
-    except json.JSONDecodeError:
-        print(f"Invalid JSON response from Monday API for painting email {email}")
-        return None
-
-    a=a.get('data', {}).get('items_page_by_column_values', {}).get('items', [])
-
-    if not a:
-        print(f"No details found in painting for email {email}")
-        return None
-
-    ans=[]
-    for i in range(len(a)):
-        try:
-            item_id=a[i].get("id")
-            name=a[i].get('name', 'Unknown')
-            status = 'Unknown'
-            arrival_date = 'Unknown'
-            order_number_value = ''
-            group_name = a[i].get('group', {}).get('title', 'Unknown')
-            
-            for j in a[i].get('column_values', []):
-                if j.get('id') == "status":
-                    status = j.get('label', 'Unknown')
-                elif j.get('id') == "date4":
-                    value = j.get('value', '{}')
-                    try:
-                        arrival_date = json.loads(value).get('date', 'Unknown')
-                    except Exception as e:
-                        arrival_date = 'Unknown'
-                elif j.get('id') == "text_mkkybb4e":
-                    order_number_value = j.get('value', '')
-            
-            ans.append(details_monday(name, status, arrival_date, order_number_value, None, "Painting", item_id, group_name))
-        except Exception as e:
-            print(f"Error processing painting item: {e}")
-            continue
-    
-    return ans
+    return monday_queries.fetch_board(BOARDS["painting"], "email_column", email, details_monday)
 
 def get_resin_details_from_email(email):
     if not email:
-        print("Error: Order number cannot be empty")
-        return None
-        
-    query_resin=f'''query {{
-    items_page_by_column_values (limit: 5, board_id: 1736814970, columns: [{{column_id: "email", column_values: ["{email}"]}}]) {{
-        cursor
-        items {{
-        id
-        name
-        group {{
-            title
-        }}
-        column_values {{
-            id
-            type
-            value
-            ... on StatusValue  {{ 
-                label
-                update_id
-            }}
-        }}
-        }}
-    }}
-    }}'''
-    data={"query":query_resin}
-    
-    try:
-        r=requests.post(url=apiUrl, json=data, headers=headers, timeout=10)
-        r.raise_for_status()
-    except requests.exceptions.Timeout:
-        print(f"Timeout error when getting resin details for email {email}")
-        return None
-    except requests.exceptions.RequestException as e:
-        print(f"Error in getting resin details: {e}")
-        return None
-        
-    try:
-        a=r.json()
-    except json.JSONDecodeError:
-        print(f"Invalid JSON response from Monday API for resin email {email}")
-        return None
-        
-    a=a.get('data', {}).get('items_page_by_column_values', {}).get('items', [])
-    
-    if not a:
-        print(f"No details found in resin for email {email}")
+        print("Error: Email cannot be empty")
         return None
-
-    ans=[]
-    for i in range(len(a)):
-        item_id=a[i].get("id")
-        name=a[i].get('name', 'Unknown')
-        status = 'Unknown'
-        arrival_date = 'Unknown'
-        order_number_value = ''
-        order_view = ''
-        group_name = a[i].get('group', {}).get('title', 'Unknown')
-        
-        for j in a[i].get('column_values', []):
-            if j.get('id') == "status":
-                status = j.get('label', 'Unknown')
-            elif j.get('id') == "date4":
-                value = j.get('value', '{}')
-                try:
-                    arrival_date = json.loads(value).get('date', 'Unknown')
-                except Exception as e:
-                    arrival_date = 'Unknown'
-            elif j.get('id') == "text2":
-                order_number_value = j.get('value', '')
-            elif j.get('id') == "text28":
-                order_view = j.get('value', '')
-        
-        ans.append(details_monday(name, status, arrival_date, order_number_value, order_view, "Resin", item_id, group_name))
-    
-    return ans
+    return monday_queries.fetch_board(BOARDS["resin"], "email_column", email, details_monday)
 
 def get_pressed_details_from_email(email):
     if not email:
-        print("Error: Order number cannot be empty")
-        return None
-        
-    query_pressed=f'''query {{
-    items_page_by_column_values (limit: 5, board_id: 5511004697, columns: [{{column_id: "email7", column_values: ["{email}"]}}]) {{
-        cursor
-        items {{
-        id
-        name
-        group {{
-            title
-        }}
-        column_values {{
-            id
-            type
-            value
-            ... on StatusValue  {{ 
-                label
-                update_id
-            }}
-        }}
-        }}
-    }}
-    }}'''
-    data={"query":query_pressed}
-    
-    try:
-        r=requests.post(url=apiUrl, json=data, headers=headers, timeout=10)
-        r.raise_for_status()
-    except requests.exceptions.Timeout:
-        print(f"Timeout error when getting pressed details for email {email}")
-        return None
-    except requests.exceptions.RequestException as e:
-        print(f"Error in getting pressed details: {e}")
-        return None
-        
-    try:
-        a=r.json()
-    except json.JSONDecodeError:
-        print(f"Invalid JSON response from Monday API for pressed email {email}")
-        return None
-        
-    a=a.get('data', {}).get('items_page_by_column_values', {}).get('items', [])
-    
-    if not a:
-        print(f"No details found in pressed for email {email}")
+        print("Error: Email cannot be empty")
         return None
+    return monday_queries.fetch_board(BOARDS["pressed"], "email_column", email, details_monday)
 
-    ans=[]
-    for i in range(len(a)):
-        item_id=a[i].get("id")
-        name=a[i].get('name', 'Unknown')
-        status = 'Unknown'
-        arrival_date = 'Unknown'
-        order_number_value = ''
-        group_name = a[i].get('group', {}).get('title', 'Unknown')
-        
-        for j in a[i].get('column_values', []):
-            if j.get('id') == "status":
-                status = j.get('label', 'Unknown')
-            elif j.get('id') == "arrival_date":
-                value = j.get('value', '{}')
-                try:
-                    arrival_date = json.loads(value).get('date', 'Unknown')
-                except Exception as e:
-                    arrival_date = 'Unknown'
-            elif j.get('id') == "text7":
-                order_number_value = j.get('value', '')
-        
-        ans.append(details_monday(name, status, arrival_date, order_number_value, None, "Pressed", item_id, group_name))
-    
-    return ans
+
+###### LOOKUP CACHE ######
+# Recent lookups per order number / email, so repeated tool calls within a conversation
+# (LLM retries, update_in_monday -> get_correct_order) do not go back to Monday.
+# Only hits are cached, a customer can give an order number before it reaches the board.
+lookup_cache = TTLCache(maxsize=int(os.getenv("MONDAY_CACHE_MAXSIZE", "1024")), ttl=float(os.getenv("MONDAY_CACHE_TTL", "300")))
+
+def _cache_key(kind, value):
+    value = "".join(str(value).split())
+    return (kind, value.casefold() if kind == "email" else value)
+
+def invalidate_monday_cache(order_number=None, email=None):
+    if order_number:
+        lookup_cache.pop(_cache_key("order", order_number))
+    if email:
+        lookup_cache.pop(_cache_key("email", email))
 
 
+###### LOCAL MIRROR ######
+# Optional Mongo copy of the boards kept in sync in the background (MONDAY_MIRROR_ENABLED=True).
+# Lookups read it while it is fresh and go to Monday live on misses or when it falls behind.
+monday_mirror = None
+if os.getenv("MONDAY_MIRROR_ENABLED") == "True" and testing_check != "True":
+    monday_mirror = MondayMirror(BOARDS, details_monday).start()
+
 
 ###### MAIN FUNCTION ######
+def _fetch_all_boards(column_key, value, label):
+    try:
+        # All three boards in one round trip, per-board queries only as a fallback
+        correct_details = monday_queries.fetch_all_boards(BOARDS, column_key, value, details_monday)
+        if not correct_details:
+            print(f"No results found for {label}: {value}")
+            return None
+        return correct_details
+    except Exception as e:
+        print(f"Error retrieving Monday details: {e}")
+        return None
+
 def get_Monday_details(order_number):
     if not order_number:
         print("Error: Cannot search with empty order number")
         return None
-    
+
+    key = _cache_key("order", order_number)
+    cached = lookup_cache.get(key)
+    if cached is not None:
+        print(f"Monday details for order number {order_number} served from cache")
+        return list(cached)
+
     if testing_check=="True":
         ans=get_Monday_details_testing(order_number)
-        return ans
+    else:
+        ans=monday_mirror.lookup("order_column", order_number) if monday_mirror is not None else None
+        if ans is None:
+            ans=_fetch_all_boards("order_column", order_number, "order number")
 
-    try:
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            # Submit each task to the thread pool
-            futures = [
-                executor.submit(get_painting_details, order_number),
-                executor.submit(get_resin_details, order_number),
-                executor.submit(get_pressed_details, order_number)
-            ]
-            
-            correct_details = []
-            for future in as_completed(futures):
-                try:
-                    details = future.result()
-                    if details is not None:
-                        correct_details.extend(details)
-                except Exception as e:
-                    print(f"Error retrieving details: {e}")
-                    
-            if not correct_details:
-                print(f"No results found for order number: {order_number}")
-                return None
-            return correct_details
-    except Exception as e:
-        print(f"Error retrieving Monday details: {e}")
-        return None
+    if ans:
+        lookup_cache.set(key, tuple(ans))
+    return ans
 
 def get_Monday_details_from_email(email):
     if not email:
         print("Error: Cannot search with empty email")
         return None
-    
+
+    key = _cache_key("email", email)
+    cached = lookup_cache.get(key)
+    if cached is not None:
+        print(f"Monday details for email {email} served from cache")
+        return list(cached)
+
     if testing_check=="True":
         ans=get_Monday_details_from_email_testing(email)
-        return ans
-        
-    try:    
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            futures = [
-                executor.submit(get_painting_details_from_email, email),
-                executor.submit(get_resin_details_from_email, email),
-                executor.submit(get_pressed_details_from_email, email)
-            ]
-        
-        correct_details = []
-        for future in as_completed(futures):
-            try:
-                details = future.result()
-                if details is not None:
-                    correct_details.extend(details)
-            except Exception as e:
-                print(f"Error retrieving details: {e}")
-                
-        if not correct_details:
-            print(f"No results found for email: {email}")
-            return None
-        return correct_details
-    except Exception as e:
-        print(f"Error retrieving Monday details: {e}")
-        return None
+    else:
+        ans=monday_mirror.lookup("email_column", email) if monday_mirror is not None else None
+        if ans is None:
+            ans=_fetch_all_boards("email_column", email, "email")
+
+    if ans:
+        lookup_cache.set(key, tuple(ans))
+    return ans
 
 
 ###### ORDER UPDATE ######
-def get_correct_order(order_number,email, name):
+def _name_key(name):
+    return " ".join(str(name).casefold().split())
 
-    correct_order=[]
+def _match_orders(order_number, email, name, ans, ans2):
+    # ans: lookup by order number, ans2: lookup by email
+    # Order number results count when the customer name is part of the item name, email
+    # results are added on top; items are deduplicated by item id in one pass over each list.
+    if not ((order_number is not None and name is not None) or email is not None):
+        return None
 
-    if order_number is not None and name is not None and email is not None:
-        ans=get_Monday_details(order_number)
-        if ans is not None:
-            for i in ans:
-                names=str(name).lower().strip()
-                order_name=str(i.name).lower().strip()
-                print(names)
-                print(order_name)
-                if names in order_name:
-                    correct_order.append(i)
+    correct_order={}
+    if order_number is not None and name is not None and ans is not None:
+        names=_name_key(name)
+        for i in ans:
+            if names in _name_key(i.name):
+                correct_order.setdefault(i.item_id, i)
 
-        ans2=get_Monday_details_from_email(email)
-        if ans2 is not None:
-            for i in ans2:
-                for i in ans2:
-                    for j in correct_order:
-                        if i.item_id!=j.item_id:
-                            correct_order.append(i)
-
-        print(correct_order)
-    elif order_number is not None and name is not None and email is None:
-        ans=get_Monday_details(order_number)
-        if ans is not None:
-            for i in ans:
-                names=str(name).lower().strip()
-                order_name=str(i.name).lower().strip()
-                print(names)
-                print(order_name)
-                if names in order_name:
-                    correct_order.append(i)
-
-    elif (order_number is  None or name is None )and email is not None:
-        ans=get_Monday_details_from_email(email)
-        if ans is not None:
-            for i in ans:
-                correct_order.append(i)
-    
-    else:
-        return None
+    if email is not None and ans2 is not None:
+        for i in ans2:
+            correct_order.setdefault(i.item_id, i)
 
-    if correct_order==[]:
+    if not correct_order:
         return None
-    return correct_order
+    return list(correct_order.values())
+
+def get_correct_order(order_number,email, name):
+    ans=None
+    ans2=None
+    if order_number is not None and name is not None:
+        ans=get_Monday_details(order_number)
+    if email is not None:
+        ans2=get_Monday_details_from_email(email)
+    return _match_orders(order_number, email, name, ans, ans2)
+
 
+def _cutoff_message(arrival_date):
+    return "Cannot update order as it is more than 4 months old from the date of flowers recieved. We recieved the flowers on "+arrival_date+". and the current date is "+datetime.now().strftime("%Y-%m-%d")+"You need to create a new order from the website."
+
+def _create_update_query(item_id, body):
+    return f'''mutation {{  
+            create_update (item_id: {item_id}, body: "{body}") {{
+                id
+            }}
+            }}'''
 
 def update_in_monday(order_number,name,email,details):
     correct_order=get_correct_order(order_number,email, name)
@@ -671,19 +229,15 @@ def update_in_monday(order_number,name,email,details):
         for i in correct_order:
             if i.arrival_date != 'Unknown':
                 if cutoff_date(i.arrival_date):
-                    return "Cannot update order as it is more than 4 months old from the date of flowers recieved. We recieved the flowers on "+i.arrival_date+". and the current date is "+datetime.now().strftime("%Y-%m-%d")+"You need to create a new order from the website.",True
+                    return _cutoff_message(i.arrival_date),True
 
             body="By AI BOT from <b>Debales Support Chatbot</b>\n\n" + details
+            data = {'query' : _create_update_query(i.item_id, body)}
 
-            query4=f'''mutation {{  
-            create_update (item_id: {i.item_id}, body: "{body}") {{
-                id
-            }}
-            }}'''
-            data = {'query' : query4}
-
-            r=requests.post(url=apiUrl, json=data, headers=headers)
+            r=monday_client.post(json=data, idempotent=False)
             print(r.json())
+            # the item just changed on Monday, next lookup should see it
+            invalidate_monday_cache(order_number, email)
 
             if r.status_code==200:
                 return correct_order[0].order_number,False
@@ -708,8 +262,9 @@ def update_in_monday_with_screenshot(order_number,name,email,screenshot):
             }}'''
             data = {'query' : query4}
 
-            r=requests.post(url=apiUrl, json=data, headers=headers)
+            r=monday_client.post(json=data, idempotent=False)
             print("create_update in monday blossom add screenshot = ",r.json())
+            invalidate_monday_cache(order_number, email)
 
             if r.status_code==200:
                 update_id=r.json().get("data",{}).get("create_update",{}).get("id",None)
@@ -728,7 +283,7 @@ def update_in_monday_with_screenshot(order_number,name,email,screenshot):
                     files = [
                         ('image', ('screenshot.jpg', jpeg_file, 'image/jpeg'))
                     ]
-                    r2=requests.post(url=file_url, data=payload, headers=headers2, files=files)
+                    r2=monday_client.post(url=monday_client.FILE_URL, data=payload, files=files, api_version="2024-04", timeout=30, idempotent=False)
                     print("add_file_to_update in monday blossom add screenshot = ",r2.json())
                     if r2.status_code!=200:
                         # image_url=r2.json().get("data",{}).get("add_file_to_update",{}).get("url",None)
@@ -760,3 +315,97 @@ def update_in_monday_with_screenshot(order_number,name,email,screenshot):
         return False
     
     return True
+
+
+###### ASYNC ######
+# Same lookups and updates on the event loop through monday_client.apost, so an asyncio
+# server does not hold a thread per outstanding Monday call.
+async def _afetch_all_boards(column_key, value, label):
+    try:
+        correct_details = await monday_queries.afetch_all_boards(BOARDS, column_key, value, details_monday)
+        if not correct_details:
+            print(f"No results found for {label}: {value}")
+            return None
+        return correct_details
+    except Exception as e:
+        print(f"Error retrieving Monday details: {e}")
+        return None
+
+async def aget_Monday_details(order_number):
+    if not order_number:
+        print("Error: Cannot search with empty order number")
+        return None
+
+    key = _cache_key("order", order_number)
+    cached = lookup_cache.get(key)
+    if cached is not None:
+        print(f"Monday details for order number {order_number} served from cache")
+        return list(cached)
+
+    if testing_check=="True":
+        ans=await asyncio.to_thread(get_Monday_details_testing, order_number)
+    else:
+        ans=await asyncio.to_thread(monday_mirror.lookup, "order_column", order_number) if monday_mirror is not None else None
+        if ans is None:
+            ans=await _afetch_all_boards("order_column", order_number, "order number")
+
+    if ans:
+        lookup_cache.set(key, tuple(ans))
+    return ans
+
+async def aget_Monday_details_from_email(email):
+    if not email:
+        print("Error: Cannot search with empty email")
+        return None
+
+    key = _cache_key("email", email)
+    cached = lookup_cache.get(key)
+    if cached is not None:
+        print(f"Monday details for email {email} served from cache")
+        return list(cached)
+
+    if testing_check=="True":
+        ans=await asyncio.to_thread(get_Monday_details_from_email_testing, email)
+    else:
+        ans=await asyncio.to_thread(monday_mirror.lookup, "email_column", email) if monday_mirror is not None else None
+        if ans is None:
+            ans=await _afetch_all_boards("email_column", email, "email")
+
+    if ans:
+        lookup_cache.set(key, tuple(ans))
+    return ans
+
+async def _none():
+    return None
+
+async def aget_correct_order(order_number,email, name):
+    # both lookups run concurrently when we have an order number and an email
+    ans, ans2 = await asyncio.gather(
+        aget_Monday_details(order_number) if order_number is not None and name is not None else _none(),
+        aget_Monday_details_from_email(email) if email is not None else _none(),
+    )
+    return _match_orders(order_number, email, name, ans, ans2)
+
+async def aupdate_in_monday(order_number,name,email,details):
+    correct_order=await aget_correct_order(order_number,email, name)
+    if correct_order is not None:
+        for i in correct_order:
+            if i.arrival_date != 'Unknown':
+                if cutoff_date(i.arrival_date):
+                    return _cutoff_message(i.arrival_date),True
+
+            body="By AI BOT from <b>Debales Support Chatbot</b>\n\n" + details
+            data = {'query' : _create_update_query(i.item_id, body)}
+
+            r=await monday_client.apost(json=data, idempotent=False)
+            print(r.json())
+            invalidate_monday_cache(order_number, email)
+
+            if r.status_code==200:
+                return correct_order[0].order_number,False
+            else:
+                return "Order update failed",True
+
+        return correct_order[0].order_number,False
+    else:
+        return "Order details from (Order number and name) or email not found",True
@@ -0,0 +1,138 @@
+import os
+import time
+import logging
+import asyncio
+import threading
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from pathlib import Path
+
+env_path = Path(__file__).resolve().parent.parent / ".env"
+load_dotenv(dotenv_path=env_path)
+
+logger = logging.getLogger(__name__)
+
+apiKey = os.getenv("MONDAY_API_KEY")
+API_URL = "https://api.monday.com/v2"
+FILE_URL = "https://api.monday.com/v2/file"
+
+POOL_SIZE = int(os.getenv("MONDAY_POOL_SIZE", "10"))
+MAX_RETRIES = int(os.getenv("MONDAY_MAX_RETRIES", "3"))
+BACKOFF_SECONDS = float(os.getenv("MONDAY_BACKOFF_SECONDS", "0.5"))
+RETRY_STATUSES = {500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+_async_clients = {}
+metrics = {"requests": 0, "retries": 0, "errors": 0, "total_seconds": 0.0}
+
+
+def get_session():
+    """Shared keep-alive session, so every Monday call reuses pooled TCP/TLS connections."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE)
+                session.mount("https://", adapter)
+                session.headers.update({"Authorization": apiKey})
+                _session = session
+    return _session
+
+
+def _retry_delay(response, attempt):
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return BACKOFF_SECONDS * (2 ** attempt)
+
+
+def post(json=None, data=None, files=None, url=API_URL, api_version="2023-04", timeout=10, idempotent=True):
+    """POST to the Monday API through the pooled session.
+
+    Rate limited (429) calls are always retried with backoff since Monday did not run them.
+    5xx responses and connection errors are only retried for idempotent calls (queries), so
+    mutations like create_update never post twice. Returns the final requests.Response and
+    raises requests exceptions like requests.post does.
+    """
+    session = get_session()
+    headers = {"API-Version": api_version}
+    attempt = 0
+    while True:
+        t0 = time.perf_counter()
+        response = None
+        try:
+            response = session.post(url=url, json=json, data=data, files=files, headers=headers, timeout=timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            elapsed = time.perf_counter() - t0
+            metrics["total_seconds"] += elapsed
+            if not idempotent or attempt >= MAX_RETRIES:
+                metrics["errors"] += 1
+                logger.error("Monday request failed after %.3fs (attempt %d): %s", elapsed, attempt + 1, e)
+                raise
+            logger.warning("Monday request error after %.3fs (attempt %d), retrying: %s", elapsed, attempt + 1, e)
+        else:
+            elapsed = time.perf_counter() - t0
+            metrics["requests"] += 1
+            metrics["total_seconds"] += elapsed
+            logger.info("Monday request took %.3fs (status %s, attempt %d)", elapsed, response.status_code, attempt + 1)
+            retryable = response.status_code == 429 or (idempotent and response.status_code in RETRY_STATUSES)
+            if not retryable or attempt >= MAX_RETRIES:
+                return response
+        delay = _retry_delay(response, attempt)
+        metrics["retries"] += 1
+        attempt += 1
+        time.sleep(delay)
+
+
+def get_async_client():
+    """Shared httpx.AsyncClient for the running event loop (clients cannot be shared across loops)."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        for other in [l for l in _async_clients if l.is_closed()]:
+            del _async_clients[other]
+        client = httpx.AsyncClient(
+            headers={"Authorization": apiKey or ""},
+            limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def apost(json=None, data=None, files=None, url=API_URL, api_version="2023-04", timeout=10, idempotent=True):
+    """Async version of post, same retry rules. Returns an httpx.Response and raises httpx errors."""
+    client = get_async_client()
+    headers = {"API-Version": api_version}
+    attempt = 0
+    while True:
+        t0 = time.perf_counter()
+        response = None
+        try:
+            response = await client.post(url, json=json, data=data, files=files, headers=headers, timeout=timeout)
+        except (httpx.ConnectError, httpx.TimeoutException, httpx.RemoteProtocolError) as e:
+            elapsed = time.perf_counter() - t0
+            metrics["total_seconds"] += elapsed
+            if not idempotent or attempt >= MAX_RETRIES:
+                metrics["errors"] += 1
+                logger.error("Monday request failed after %.3fs (attempt %d): %s", elapsed, attempt + 1, e)
+                raise
+            logger.warning("Monday request error after %.3fs (attempt %d), retrying: %s", elapsed, attempt + 1, e)
+        else:
+            elapsed = time.perf_counter() - t0
+            metrics["requests"] += 1
+            metrics["total_seconds"] += elapsed
+            logger.info("Monday request took %.3fs (status %s, attempt %d)", elapsed, response.status_code, attempt + 1)
+            retryable = response.status_code == 429 or (idempotent and response.status_code in RETRY_STATUSES)
+            if not retryable or attempt >= MAX_RETRIES:
+                return response
+        delay = _retry_delay(response, attempt)
+        metrics["retries"] += 1
+        attempt += 1
+        await asyncio.sleep(delay)
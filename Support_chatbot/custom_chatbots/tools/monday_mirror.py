@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime, timezone
+from pymongo import MongoClient, ASCENDING, UpdateOne
+from pymongo.errors import PyMongoError
+from Support_chatbot.custom_chatbots.tools import monday_client, monday_queries
+from Support_chatbot.custom_chatbots.tools.monday_records import details_monday
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 500
+
+
+def lookup_key(column_key, value):
+    """Normalized search key, the same way monday_blossom keys its lookup cache."""
+    value = "".join(str(value).split())
+    return value.casefold() if column_key == "email_column" else value
+
+
+def column_text(value):
+    """Plain text of a Monday column value (text columns are JSON strings, email columns JSON objects)."""
+    if not value:
+        return ""
+    try:
+        decoded = json.loads(value)
+    except (TypeError, ValueError):
+        return str(value)
+    if isinstance(decoded, dict):
+        return str(decoded.get("email") or decoded.get("text") or "")
+    return str(decoded)
+
+
+def _as_document(*args):
+    return details_monday(*args).to_dict()
+
+
+class MondayMirror:
+    """Local copy of the order boards in Mongo, kept up to date by a background sync thread.
+
+    The first pass of each board copies every item, later passes only fetch items updated
+    since the last one (``__last_updated__`` filter), and a periodic full pass removes items
+    that were deleted on Monday. Lookups are only answered while every board synced within
+    ``max_staleness`` seconds; otherwise, and on misses, callers query Monday live.
+    """
+
+    def __init__(self, boards, record, collection=None, state_collection=None, interval=None,
+                 max_staleness=None, full_sync_interval=None):
+        self.boards = boards
+        self.record = record
+        self.interval = interval or float(os.getenv("MONDAY_MIRROR_INTERVAL", "60"))
+        self.max_staleness = max_staleness or float(os.getenv("MONDAY_MIRROR_MAX_STALENESS", "300"))
+        self.full_sync_interval = full_sync_interval or float(os.getenv("MONDAY_MIRROR_FULL_SYNC_INTERVAL", str(6 * 3600)))
+        if collection is None or state_collection is None:
+            db = MongoClient(os.environ['MONGODB_URI'])[os.environ['MONGO_DB_EMBEDDINGS']]
+            collection = collection if collection is not None else db["Monday_mirror"]
+            state_collection = state_collection if state_collection is not None else db["Monday_mirror_state"]
+        self.collection = collection
+        self.state_collection = state_collection
+        self.state = {}
+        self.metrics = {"syncs": 0, "sync_errors": 0, "items_synced": 0, "hits": 0, "misses": 0, "stale": 0}
+        self._stop = threading.Event()
+        self._thread = None
+        self._ensure_indexes()
+        self._load_state()
+
+    def _ensure_indexes(self):
+        try:
+            self.collection.create_index([("board", ASCENDING), ("item_id", ASCENDING)], unique=True, name="board_item_unique")
+            self.collection.create_index([("order_number_key", ASCENDING)], name="order_number_key")
+            self.collection.create_index([("email_key", ASCENDING)], name="email_key")
+        except PyMongoError as e:
+            logger.warning("Could not create Monday mirror indexes: %s", e)
+
+    def _load_state(self):
+        try:
+            for doc in self.state_collection.find({"_id": {"$in": list(self.boards)}}):
+                self.state[doc["_id"]] = {k: v for k, v in doc.items() if k != "_id"}
+        except PyMongoError as e:
+            logger.warning("Could not load Monday mirror state: %s", e)
+
+    def _save_state(self, alias):
+        try:
+            self.state_collection.update_one({"_id": alias}, {"$set": self.state[alias]}, upsert=True)
+        except PyMongoError as e:
+            logger.warning("Could not save Monday mirror state for %s: %s", alias, e)
+
+    ###### Sync ######
+
+    def _items_fields(self, board):
+        columns = [board[key] for key in ("order_column", "email_column", "status_column", "date_column", "order_view_column") if board.get(key)]
+        return f'''cursor
+            items {{
+                id
+                name
+                updated_at
+                group {{
+                    title
+                }}
+                column_values (ids: {json.dumps(columns)}) {{
+                    id
+                    type
+                    value
+                    ... on StatusValue {{
+                        label
+                    }}
+                }}
+            }}'''
+
+    def _request(self, query):
+        r = monday_client.post(json={"query": query}, api_version="2024-04", timeout=30)
+        r.raise_for_status()
+        payload = r.json()
+        if payload.get("errors"):
+            raise RuntimeError(f"Monday returned errors: {payload['errors']}")
+        return payload.get("data") or {}
+
+    def _pages(self, board, since=None):
+        query_params = ""
+        if since:
+            # day granularity with an overlap, re-upserting an item is harmless
+            query_params = (', query_params: {rules: [{column_id: "__last_updated__", '
+                            f'compare_value: ["EXACT", {json.dumps(since)}], operator: greater_than_or_equals, '
+                            'compare_attribute: "UPDATED_AT"}]}')
+        fields = self._items_fields(board)
+        data = self._request(f'query {{ boards (ids: [{board["board_id"]}]) {{ items_page (limit: {PAGE_SIZE}{query_params}) {{ {fields} }} }} }}')
+        boards = data.get("boards") or []
+        page = boards[0].get("items_page") if boards else None
+        while page:
+            yield page.get("items") or []
+            cursor = page.get("cursor")
+            if not cursor:
+                break
+            data = self._request(f'query {{ next_items_page (limit: {PAGE_SIZE}, cursor: {json.dumps(cursor)}) {{ {fields} }} }}')
+            page = data.get("next_items_page")
+
+    def _document(self, item, alias, board, sync_id, now):
+        doc = monday_queries.parse_items([item], board, _as_document)[0]
+        email = ""
+        for column in item.get("column_values", []):
+            if column.get("id") == board["email_column"]:
+                email = column_text(column.get("value"))
+        doc.update({
+            "board": alias,
+            "email": email,
+            "order_number_key": lookup_key("order_column", column_text(doc["order_number"])),
+            "email_key": lookup_key("email_column", email),
+            "updated_at": item.get("updated_at"),
+            "sync_id": sync_id,
+            "synced_at": now,
+        })
+        return doc
+
+    def sync_board(self, alias, full=False):
+        board = self.boards[alias]
+        state = self.state.setdefault(alias, {})
+        full = full or not state.get("since") or time.time() - state.get("last_full", 0) > self.full_sync_interval
+        started = time.time()
+        sync_id = uuid.uuid4().hex
+        now = datetime.now(timezone.utc)
+        newest = state.get("since")
+        count = 0
+        for items in self._pages(board, since=None if full else state.get("since")):
+            ops = []
+            for item in items:
+                try:
+                    doc = self._document(item, alias, board, sync_id, now)
+                except (IndexError, KeyError) as e:
+                    logger.warning("Skipping Monday item %s: %s", item.get("id"), e)
+                    continue
+                ops.append(UpdateOne({"board": alias, "item_id": doc["item_id"]}, {"$set": doc}, upsert=True))
+                if doc["updated_at"] and (not newest or doc["updated_at"][:10] > newest):
+                    newest = doc["updated_at"][:10]
+            if ops:
+                self.collection.bulk_write(ops, ordered=False)
+                count += len(ops)
+        if full:
+            # items no longer on the board were not touched by this pass
+            self.collection.delete_many({"board": alias, "sync_id": {"$ne": sync_id}})
+            state["last_full"] = started
+        state["since"] = newest or now.strftime("%Y-%m-%d")
+        state["last_sync"] = started
+        self._save_state(alias)
+        self.metrics["items_synced"] += count
+        logger.info("Synced %d items from Monday board %s (%s)", count, alias, "full" if full else "incremental")
+        return count
+
+    def sync(self):
+        for alias in self.boards:
+            try:
+                self.sync_board(alias)
+                self.metrics["syncs"] += 1
+            except Exception as e:
+                self.metrics["sync_errors"] += 1
+                logger.error("Monday mirror sync failed for %s: %s", alias, e)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sync()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="monday-mirror", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    ###### Lookups ######
+
+    def is_fresh(self):
+        now = time.time()
+        return all(now - self.state.get(alias, {}).get("last_sync", 0) <= self.max_staleness for alias in self.boards)
+
+    def lookup(self, column_key, value):
+        """Records for an order number (column_key="order_column") or email, or None to query Monday live."""
+        if not self.is_fresh():
+            self.metrics["stale"] += 1
+            return None
+        field = "order_number_key" if column_key == "order_column" else "email_key"
+        key = lookup_key(column_key, value)
+        if not key:
+            return None
+        try:
+            docs = list(self.collection.find({field: key, "board": {"$in": list(self.boards)}}))
+        except PyMongoError as e:
+            logger.warning("Monday mirror lookup failed: %s", e)
+            return None
+        if not docs:
+            self.metrics["misses"] += 1
+            return None
+        self.metrics["hits"] += 1
+        order = list(self.boards)
+        docs.sort(key=lambda doc: order.index(doc["board"]))
+        return [self.record.from_dict(doc) for doc in docs]
+
+    def stats(self):
+        return {**self.metrics, "fresh": self.is_fresh(), "boards": {alias: dict(state) for alias, state in self.state.items()}}
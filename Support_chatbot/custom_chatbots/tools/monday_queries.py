@@ -0,0 +1,210 @@
+import os
+import json
+import asyncio
+import httpx
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from Support_chatbot.custom_chatbots.tools import monday_client
+
+# Boards are described as dicts:
+# {"order_type": "Painting", "board_id": ..., "order_column": ..., "email_column": ...,
+#  "status_column": ..., "date_column": ..., "order_view_column": ... or None}
+
+ITEM_FIELDS = '''
+        cursor
+        items {
+        id
+        name
+        group {
+            title
+        }
+        column_values {
+            id
+            type
+            value
+            ... on StatusValue  {
+                label
+                update_id
+            }
+        }
+        }'''
+
+# Only used when the batched query fails; shared so lookups do not build a pool per call
+_fallback_executor = ThreadPoolExecutor(max_workers=int(os.getenv("MONDAY_FALLBACK_WORKERS", "6")))
+
+
+def _label(column_key):
+    return "order" if column_key == "order_column" else "email"
+
+
+def _board_field(alias, board, column_key, value, limit=5):
+    # json.dumps gives a properly escaped GraphQL string literal for the searched value
+    return (
+        f'{alias}: items_page_by_column_values (limit: {limit}, board_id: {board["board_id"]}, '
+        f'columns: [{{column_id: "{board[column_key]}", column_values: [{json.dumps(str(value))}]}}]) {{'
+        f'{ITEM_FIELDS}\n    }}'
+    )
+
+
+def build_query(boards, column_key, value):
+    """One aliased GraphQL query that searches every board in ``boards`` (alias -> board) at once."""
+    fields = "\n    ".join(_board_field(alias, board, column_key, value) for alias, board in boards.items())
+    return f"query {{\n    {fields}\n}}"
+
+
+def parse_items(items, board, record):
+    """Turn the items of one board page into ``record`` objects (details_monday)."""
+    ans = []
+    for item in items:
+        try:
+            status = 'Unknown'
+            arrival_date = 'Unknown'
+            order_number_value = ''
+            order_view = '' if board.get("order_view_column") else None
+            for column in item.get('column_values', []):
+                column_id = column.get('id')
+                if column_id == board["status_column"]:
+                    status = column.get('label', 'Unknown')
+                elif column_id == board["date_column"]:
+                    try:
+                        arrival_date = json.loads(column.get('value', '{}')).get('date', 'Unknown')
+                    except Exception:
+                        arrival_date = 'Unknown'
+                elif column_id == board["order_column"]:
+                    order_number_value = column.get('value', '')
+                elif column_id == board.get("order_view_column"):
+                    order_view = column.get('value', '')
+            group_name = (item.get('group') or {}).get('title', 'Unknown')
+            ans.append(record(item.get('name', 'Unknown'), status, arrival_date, order_number_value, order_view,
+                              board["order_type"], item.get("id"), group_name))
+        except Exception as e:
+            print(f"Error processing {board['order_type'].lower()} item: {e}")
+            continue
+    return ans
+
+
+def fetch_board(board, column_key, value, record):
+    """Search a single board; returns a list of records or None, like the old per-board functions."""
+    board_name = board["order_type"].lower()
+    label = _label(column_key)
+    data = {"query": build_query({"board": board}, column_key, value)}
+
+    try:
+        r = monday_client.post(json=data, timeout=10)
+        r.raise_for_status()
+    except requests.exceptions.Timeout:
+        print(f"Timeout error when getting {board_name} details for {label} {value}")
+        return None
+    except requests.exceptions.RequestException as e:
+        print(f"Error in getting {board_name} details: {e}")
+        return None
+
+    try:
+        a = r.json()
+    except json.JSONDecodeError:
+        print(f"Invalid JSON response from Monday API for {board_name} {label} {value}")
+        return None
+
+    items = ((a.get('data') or {}).get('board') or {}).get('items', [])
+    if not items:
+        print(f"No details found in {board_name} for {label} {value}")
+        return None
+    return parse_items(items, board, record)
+
+
+def fetch_all_boards(boards, column_key, value, record):
+    """Search every board in one round trip.
+
+    Boards missing from the batched response (request failure or a per-field GraphQL
+    error) are queried one by one on the shared fallback pool.
+    """
+    details = []
+    missing = list(boards)
+    try:
+        r = monday_client.post(json={"query": build_query(boards, column_key, value)}, timeout=10)
+        r.raise_for_status()
+        payload = r.json()
+        if payload.get("errors"):
+            print(f"Monday batched query returned errors: {payload['errors']}")
+        data = payload.get("data") or {}
+        missing = []
+        for alias, board in boards.items():
+            page = data.get(alias)
+            if page is None:
+                missing.append(alias)
+                continue
+            details.extend(parse_items(page.get("items", []), board, record))
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Batched Monday query failed, falling back to per-board queries: {e}")
+
+    if missing:
+        futures = [_fallback_executor.submit(fetch_board, boards[alias], column_key, value, record) for alias in missing]
+        for future in as_completed(futures):
+            try:
+                board_details = future.result()
+                if board_details is not None:
+                    details.extend(board_details)
+            except Exception as e:
+                print(f"Error retrieving details: {e}")
+    return details
+
+
+async def afetch_board(board, column_key, value, record):
+    """Async version of fetch_board."""
+    board_name = board["order_type"].lower()
+    label = _label(column_key)
+    data = {"query": build_query({"board": board}, column_key, value)}
+
+    try:
+        r = await monday_client.apost(json=data, timeout=10)
+        r.raise_for_status()
+    except httpx.TimeoutException:
+        print(f"Timeout error when getting {board_name} details for {label} {value}")
+        return None
+    except httpx.HTTPError as e:
+        print(f"Error in getting {board_name} details: {e}")
+        return None
+
+    try:
+        a = r.json()
+    except json.JSONDecodeError:
+        print(f"Invalid JSON response from Monday API for {board_name} {label} {value}")
+        return None
+
+    items = ((a.get('data') or {}).get('board') or {}).get('items', [])
+    if not items:
+        print(f"No details found in {board_name} for {label} {value}")
+        return None
+    return parse_items(items, board, record)
+
+
+async def afetch_all_boards(boards, column_key, value, record):
+    """Async version of fetch_all_boards, missing boards are fetched concurrently on the event loop."""
+    details = []
+    missing = list(boards)
+    try:
+        r = await monday_client.apost(json={"query": build_query(boards, column_key, value)}, timeout=10)
+        r.raise_for_status()
+        payload = r.json()
+        if payload.get("errors"):
+            print(f"Monday batched query returned errors: {payload['errors']}")
+        data = payload.get("data") or {}
+        missing = []
+        for alias, board in boards.items():
+            page = data.get(alias)
+            if page is None:
+                missing.append(alias)
+                continue
+            details.extend(parse_items(page.get("items", []), board, record))
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"Batched Monday query failed, falling back to per-board queries: {e}")
+
+    if missing:
+        results = await asyncio.gather(*(afetch_board(boards[alias], column_key, value, record) for alias in missing),
+                                       return_exceptions=True)
+        for board_details in results:
+            if isinstance(board_details, Exception):
+                print(f"Error retrieving details: {board_details}")
+            elif board_details is not None:
+                details.extend(board_details)
+    return details
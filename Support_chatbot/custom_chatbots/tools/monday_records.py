@@ -0,0 +1,76 @@
+FIELDS = ("name", "status", "arrival_date", "order_number", "order_view", "order_type", "item_id", "group_name")
+
+
+class details_monday:
+    """One Monday board item, as returned by the order lookups.
+
+    Slotted and read-only, so results can be shared between the lookup cache, the
+    mirror and several tool calls; the rendered text is built once and memoized.
+    """
+
+    __slots__ = FIELDS + ("_str",)
+
+    def __init__(self,name,status,arrival_date,order_number,order_view,order_type,item_ids,group_name=None):
+        for field, value in zip(FIELDS, (name, status, arrival_date, order_number, order_view, order_type, item_ids, group_name)):
+            object.__setattr__(self, field, value)
+        object.__setattr__(self, "_str", None)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("details_monday is read-only")
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        # copy/deepcopy/pickle restore through here, __setattr__ is blocked
+        for field in FIELDS:
+            object.__setattr__(self, field, state.get(field))
+        object.__setattr__(self, "_str", None)
+
+    def __repr__(self):
+        return f"details_monday(item_id={self.item_id!r}, name={self.name!r}, order_type={self.order_type!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, details_monday) and self.get_details() + (self.item_id,) == other.get_details() + (other.item_id,)
+
+    def __hash__(self):
+        return hash((self.item_id, self.order_type))
+
+    def get_details(self):
+        return self.name,self.status,self.arrival_date,self.order_number,self.order_view,self.order_type,self.group_name
+
+    def str_details(self):
+        if self._str is not None:
+            return self._str
+        parts = [f"Name: {self.name}\nStatus: {self.status}"]
+
+        if self.arrival_date != 'Unknown':
+            parts.append(f"\nFlowers Recieved Date: {self.arrival_date}")
+
+        parts.append(f"\nOrder Number: {self.order_number}")
+
+        if self.order_view is not None and self.order_view:
+            parts.append(f"\nOrder View: {self.order_view}")
+
+        parts.append(f"\nOrder Type: {self.order_type}")
+
+        if self.group_name is not None and self.group_name != 'Unknown':
+            parts.append(f"\nCurrent Stage: {self.group_name}")
+
+        result = "".join(parts)
+        object.__setattr__(self, "_str", result)
+        return result
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a record from to_dict() output (extra keys, e.g. from the mirror collection, are ignored)."""
+        return cls(data.get("name"), data.get("status"), data.get("arrival_date"), data.get("order_number"),
+                   data.get("order_view"), data.get("order_type"), data.get("item_id"), data.get("group_name"))
+
+
+def render_details(records):
+    """Tool output for a list of records: each rendered block followed by a blank line."""
+    return "".join([f"{record.str_details()}\n\n" for record in records])
@@ -0,0 +1,198 @@
+import os
+import re
+import time
+import logging
+import difflib
+import threading
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD = re.compile(r"[^\w]+")
+DEFAULT_VARIANT_TITLES = {"default title", "default"}
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKC", str(text or "")).casefold()
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+def tokens(text):
+    return frozenset(normalize(text).split())
+
+
+def numeric_id(value):
+    """'gid://shopify/ProductVariant/123' or 123 -> '123' (add_line_item_and_commit builds the gid itself)."""
+    return str(value).rsplit("/", 1)[-1]
+
+
+class _Entry:
+    __slots__ = ("title", "norm", "tokens", "variant_id", "keys")
+
+    def __init__(self, title, variant_id=None, keys=()):
+        self.title = title
+        self.norm = normalize(title)
+        self.tokens = tokens(title)
+        self.variant_id = variant_id
+        # normalized strings the customer may use for a variant: title, sku, option values
+        self.keys = {normalize(key) for key in keys if key}
+
+
+def _product_title(doc):
+    return doc.get("title") or doc.get("product_title") or doc.get("name") or ""
+
+
+def _variant_keys(variant):
+    keys = [variant.get("title"), variant.get("sku")]
+    options = [variant.get(f"option{i}") for i in (1, 2, 3)]
+    options += [option.get("value") for option in variant.get("selectedOptions") or [] if isinstance(option, dict)]
+    keys += options
+    keys.append(" ".join(option for option in options if option))
+    return keys
+
+
+class ProductResolver:
+    """Resolves a product name / variant title to a Shopify variant id from the products_data catalog.
+
+    The catalog of each bot is indexed once (refreshed every ``ttl`` seconds) by normalized
+    product title and variant title, SKU and options. Resolution tries an exact title match,
+    then token overlap, then a fuzzy (difflib) match, and returns None when the result is
+    ambiguous so the caller can fall back to the LLM. Only match levels in ``auto_resolve``
+    (PRODUCT_RESOLVER_AUTO, default ``exact``) are returned; a token or fuzzy match would
+    edit a paid order on a guess, so by default it also goes to the LLM check.
+    """
+
+    def __init__(self, collection, ttl=None, fuzzy_cutoff=None, bot_field=None, auto_resolve=None):
+        self.collection = collection
+        self.ttl = ttl or float(os.getenv("PRODUCT_RESOLVER_TTL", "900"))
+        self.fuzzy_cutoff = fuzzy_cutoff or float(os.getenv("PRODUCT_RESOLVER_FUZZY_CUTOFF", "0.85"))
+        self.bot_field = bot_field or os.getenv("PRODUCT_RESOLVER_BOT_FIELD", "bot_id")
+        if auto_resolve is None:
+            auto_resolve = [level.strip() for level in os.getenv("PRODUCT_RESOLVER_AUTO", "exact").split(",") if level.strip()]
+        self.auto_resolve = frozenset(auto_resolve)
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self.metrics = {"exact": 0, "token": 0, "fuzzy": 0, "deferred": 0, "unresolved": 0}
+
+    ###### Index ######
+
+    def _build(self, bot_id):
+        products = []
+        for doc in self.collection.find({self.bot_field: bot_id}):
+            title = _product_title(doc)
+            if not title:
+                continue
+            variants = []
+            for variant in doc.get("variants") or []:
+                if isinstance(variant, dict) and variant.get("id") is not None:
+                    variants.append(_Entry(variant.get("title") or "", numeric_id(variant["id"]), _variant_keys(variant)))
+            if variants:
+                products.append((_Entry(title), variants))
+        by_title = {}
+        for position, (product, _) in enumerate(products):
+            by_title.setdefault(product.norm, []).append(position)
+        logger.info("Indexed %d products for bot_id %s", len(products), bot_id)
+        return {"products": products, "by_title": by_title, "titles": list(by_title), "built_at": time.monotonic()}
+
+    def index(self, bot_id):
+        index = self._indexes.get(bot_id)
+        if index is None or time.monotonic() - index["built_at"] > self.ttl:
+            with self._lock:
+                index = self._indexes.get(bot_id)
+                if index is None or time.monotonic() - index["built_at"] > self.ttl:
+                    index = self._build(bot_id)
+                    self._indexes[bot_id] = index
+        return index
+
+    def invalidate(self, bot_id=None):
+        with self._lock:
+            if bot_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(bot_id, None)
+
+    ###### Matching ######
+
+    @staticmethod
+    def _best_by_tokens(query_tokens, entries, get_tokens):
+        # Jaccard overlap of the token sets, a tie for the best score makes the match ambiguous
+        best, best_score, tie = None, 0.0, False
+        for entry in entries:
+            entry_tokens = get_tokens(entry)
+            if not entry_tokens:
+                continue
+            score = len(query_tokens & entry_tokens) / len(query_tokens | entry_tokens)
+            if score > best_score:
+                best, best_score, tie = entry, score, False
+            elif score == best_score and score > 0:
+                tie = True
+        return (None, 0.0) if tie else (best, best_score)
+
+    def _match_product(self, index, product_name):
+        norm = normalize(product_name)
+        if not norm:
+            return None, None
+        positions = index["by_title"].get(norm)
+        if positions:
+            return (index["products"][positions[0]], "exact") if len(positions) == 1 else (None, None)
+
+        query_tokens = tokens(product_name)
+        containing = [product for product in index["products"] if query_tokens <= product[0].tokens]
+        if len(containing) == 1:
+            return containing[0], "token"
+        product, score = self._best_by_tokens(query_tokens, index["products"], lambda p: p[0].tokens)
+        if product is not None and score >= 0.6:
+            return product, "token"
+
+        close = difflib.get_close_matches(norm, index["titles"], n=2, cutoff=self.fuzzy_cutoff)
+        if len(close) == 1 and len(index["by_title"][close[0]]) == 1:
+            return index["products"][index["by_title"][close[0]][0]], "fuzzy"
+        return None, None
+
+    def _match_variant(self, variants, variant_name):
+        norm = normalize(variant_name)
+        if not norm or norm in DEFAULT_VARIANT_TITLES:
+            # no variant asked for, only unambiguous when the product has a single one
+            return (variants[0], "exact") if len(variants) == 1 else (None, None)
+        exact = [variant for variant in variants if norm in variant.keys]
+        if exact:
+            return (exact[0], "exact") if len(exact) == 1 else (None, None)
+
+        query_tokens = tokens(variant_name)
+        containing = [variant for variant in variants if query_tokens <= variant.tokens]
+        if len(containing) == 1:
+            return containing[0], "token"
+
+        keys = {key: variant for variant in variants for key in variant.keys}
+        close = difflib.get_close_matches(norm, list(keys), n=2, cutoff=self.fuzzy_cutoff)
+        if len(close) == 1 or (len(close) == 2 and keys[close[0]] is keys[close[1]]):
+            return keys[close[0]], "fuzzy"
+        return None, None
+
+    def resolve(self, bot_id, product_name, variant_name):
+        """get_productid-style result with ``resolved_by`` set, or None when it needs the LLM (ambiguous or not in ``auto_resolve``)."""
+        try:
+            index = self.index(bot_id)
+        except Exception as e:
+            logger.error("Could not index products for bot_id %s: %s", bot_id, e)
+            return None
+        product, product_how = self._match_product(index, product_name)
+        variant, variant_how = (None, None)
+        if product is not None:
+            variant, variant_how = self._match_variant(product[1], variant_name)
+        if variant is None:
+            self.metrics["unresolved"] += 1
+            return None
+        # the weakest of the two steps says how the request was resolved
+        order = ("exact", "token", "fuzzy")
+        resolved_by = max(product_how, variant_how, key=order.index)
+        if resolved_by not in self.auto_resolve:
+            self.metrics["deferred"] += 1
+            logger.info("Match of %r / %r to variant %s is only %s, leaving it to the LLM check", product_name, variant_name, variant.variant_id, resolved_by)
+            return None
+        self.metrics[resolved_by] += 1
+        logger.info("Resolved %r / %r to variant %s (%s)", product_name, variant_name, variant.variant_id, resolved_by)
+        return {"variant_id": variant.variant_id, "product_found": True, "reason": "", "resolved_by": resolved_by}
+
+    def stats(self):
+        return {**self.metrics, "indexed_bots": len(self._indexes)}
@@ -0,0 +1,244 @@
+import os
+import re
+import time
+import asyncio
+import logging
+import threading
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+API_VERSION = "2024-04"
+shopify_api_key = os.environ.get("BLOSSOM_SHOPIFY_API_KEY")
+SHOP_DOMAIN = os.environ.get("BLOSSOM_SHOPIFY_SHOP_DOMAIN")
+
+POOL_SIZE = int(os.getenv("SHOPIFY_POOL_SIZE", "10"))
+MAX_RETRIES = int(os.getenv("SHOPIFY_MAX_RETRIES", "4"))
+BACKOFF_SECONDS = float(os.getenv("SHOPIFY_BACKOFF_SECONDS", "0.5"))
+DEFAULT_QUERY_COST = float(os.getenv("SHOPIFY_DEFAULT_QUERY_COST", "50"))
+RETRY_STATUSES = {500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+_async_clients = {}
+metrics = {"requests": 0, "retries": 0, "throttled": 0, "errors": 0, "total_seconds": 0.0, "total_cost": 0.0}
+
+_OPERATION = re.compile(r"\b(query|mutation)\b[^{]*\{\s*(\w+)")
+
+
+class ThrottleBucket:
+    """Client-side view of Shopify's leaky bucket, updated from ``extensions.cost.throttleStatus``.
+
+    Before a request we estimate the currently available points (last reported value plus
+    ``restoreRate`` per second since then) and wait until the expected cost of the query fits,
+    instead of sending it and getting THROTTLED back.
+    """
+
+    def __init__(self):
+        self.maximum = None
+        self.available = None
+        self.restore_rate = None
+        self.updated_at = 0.0
+        self.query_costs = {}
+        self._lock = threading.Lock()
+
+    def estimated_available(self, now=None):
+        if self.available is None:
+            return None
+        now = now or time.monotonic()
+        return min(self.maximum, self.available + self.restore_rate * (now - self.updated_at))
+
+    def expected_cost(self, operation):
+        return self.query_costs.get(operation, DEFAULT_QUERY_COST)
+
+    def wait_time(self, operation):
+        with self._lock:
+            available = self.estimated_available()
+            if available is None or not self.restore_rate:
+                return 0.0
+            cost = min(self.expected_cost(operation), self.maximum)
+            return max(0.0, (cost - available) / self.restore_rate)
+
+    def update(self, operation, cost):
+        if not cost:
+            return
+        status = cost.get("throttleStatus") or {}
+        with self._lock:
+            if cost.get("requestedQueryCost") is not None:
+                self.query_costs[operation] = float(cost["requestedQueryCost"])
+            if status:
+                self.maximum = float(status.get("maximumAvailable", self.maximum or 0))
+                self.available = float(status.get("currentlyAvailable", 0))
+                self.restore_rate = float(status.get("restoreRate", self.restore_rate or 50))
+                self.updated_at = time.monotonic()
+
+
+bucket = ThrottleBucket()
+
+
+def graphql_url():
+    return f"https://{SHOP_DOMAIN}/admin/api/{API_VERSION}/graphql.json"
+
+
+def _headers():
+    return {
+        "Content-Type": "application/json",
+        "X-Shopify-Access-Token": shopify_api_key or "",
+    }
+
+
+def _operation(graphql_query):
+    match = _OPERATION.search(graphql_query)
+    if match is None:
+        return "query", "unknown"
+    return match.group(1), match.group(2)
+
+
+def _is_throttled(data):
+    return any((error.get("extensions") or {}).get("code") == "THROTTLED" for error in data.get("errors") or [])
+
+
+def get_session():
+    """Shared keep-alive session for the Admin API."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE))
+                _session = session
+    return _session
+
+
+def get_async_client():
+    """Shared httpx.AsyncClient for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        for other in [l for l in _async_clients if l.is_closed()]:
+            del _async_clients[other]
+        client = httpx.AsyncClient(limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE))
+        _async_clients[loop] = client
+    return client
+
+
+def _record(operation, elapsed, data, attempt):
+    metrics["requests"] += 1
+    metrics["total_seconds"] += elapsed
+    cost = (data.get("extensions") or {}).get("cost") or {}
+    bucket.update(operation, cost)
+    actual = cost.get("actualQueryCost")
+    if actual is not None:
+        metrics["total_cost"] += float(actual)
+    available = (cost.get("throttleStatus") or {}).get("currentlyAvailable")
+    logger.info("Shopify %s took %.3fs (cost %s, available %s, attempt %d)", operation, elapsed, actual, available, attempt + 1)
+
+
+def _retry_delay(operation, response, attempt):
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return max(bucket.wait_time(operation), BACKOFF_SECONDS * (2 ** attempt))
+
+
+def execute(graphql_query, variables=None, timeout=10):
+    """Run a GraphQL query/mutation and return the decoded response.
+
+    Waits for the throttle bucket before sending, retries THROTTLED and 429 responses
+    (Shopify did not run them) and, for queries only, 5xx and connection errors.
+    Raises requests exceptions like requests.post/raise_for_status did.
+    """
+    kind, operation = _operation(graphql_query)
+    idempotent = kind == "query"
+    payload = {"query": graphql_query}
+    if variables:
+        payload["variables"] = variables
+    attempt = 0
+    while True:
+        wait = bucket.wait_time(operation)
+        if wait:
+            logger.info("Waiting %.2fs for Shopify throttle budget before %s", wait, operation)
+            time.sleep(wait)
+        t0 = time.perf_counter()
+        response = None
+        try:
+            response = get_session().post(graphql_url(), json=payload, headers=_headers(), timeout=timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            metrics["total_seconds"] += time.perf_counter() - t0
+            if not idempotent or attempt >= MAX_RETRIES:
+                metrics["errors"] += 1
+                raise
+            logger.warning("Shopify %s failed (attempt %d), retrying: %s", operation, attempt + 1, e)
+        else:
+            elapsed = time.perf_counter() - t0
+            retryable = response.status_code == 429 or (idempotent and response.status_code in RETRY_STATUSES)
+            if not retryable:
+                response.raise_for_status()
+                data = response.json()
+                _record(operation, elapsed, data, attempt)
+                if not _is_throttled(data):
+                    return data
+                metrics["throttled"] += 1
+                if attempt >= MAX_RETRIES:
+                    return data
+            elif attempt >= MAX_RETRIES:
+                metrics["errors"] += 1
+                response.raise_for_status()
+        delay = _retry_delay(operation, response, attempt)
+        metrics["retries"] += 1
+        attempt += 1
+        time.sleep(delay)
+
+
+async def aexecute(graphql_query, variables=None, timeout=10):
+    """Async version of execute, sharing the same throttle bucket and metrics."""
+    kind, operation = _operation(graphql_query)
+    idempotent = kind == "query"
+    payload = {"query": graphql_query}
+    if variables:
+        payload["variables"] = variables
+    attempt = 0
+    while True:
+        wait = bucket.wait_time(operation)
+        if wait:
+            logger.info("Waiting %.2fs for Shopify throttle budget before %s", wait, operation)
+            await asyncio.sleep(wait)
+        t0 = time.perf_counter()
+        response = None
+        try:
+            response = await get_async_client().post(graphql_url(), json=payload, headers=_headers(), timeout=timeout)
+        except (httpx.ConnectError, httpx.TimeoutException, httpx.RemoteProtocolError) as e:
+            metrics["total_seconds"] += time.perf_counter() - t0
+            if not idempotent or attempt >= MAX_RETRIES:
+                metrics["errors"] += 1
+                raise
+            logger.warning("Shopify %s failed (attempt %d), retrying: %s", operation, attempt + 1, e)
+        else:
+            elapsed = time.perf_counter() - t0
+            retryable = response.status_code == 429 or (idempotent and response.status_code in RETRY_STATUSES)
+            if not retryable:
+                response.raise_for_status()
+                data = response.json()
+                _record(operation, elapsed, data, attempt)
+                if not _is_throttled(data):
+                    return data
+                metrics["throttled"] += 1
+                if attempt >= MAX_RETRIES:
+                    return data
+            elif attempt >= MAX_RETRIES:
+                metrics["errors"] += 1
+                response.raise_for_status()
+        delay = _retry_delay(operation, response, attempt)
+        metrics["retries"] += 1
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+def stats():
+    return {**metrics, "available": bucket.estimated_available(), "maximum": bucket.maximum,
+            "restore_rate": bucket.restore_rate, "query_costs": dict(bucket.query_costs)}
@@ -1,165 +1,188 @@
-import requests
 import json
 import os
-import json
-import requests
+import asyncio
+import logging
 from datetime import datetime
-
-API_VERSION   = "2024-04"        # or "unstable" if you truly need it
-shopify_api_key=os.environ.get("BLOSSOM_SHOPIFY_API_KEY")
-SHOP_DOMAIN=os.environ.get("BLOSSOM_SHOPIFY_SHOP_DOMAIN")
+from Support_chatbot.custom_chatbots.tools import shopify_client
+from caching.memory_cache import TTLCache
 
 from Database.mongo_db.mongo import MongoDatabase
 mongo_db=MongoDatabase()
 
+logger = logging.getLogger(__name__)
+
 def execute_query(graphql_query):
     try:
-        payload = {"query": graphql_query}
-        url = f"https://{SHOP_DOMAIN}/admin/api/{API_VERSION}/graphql.json"
-        headers = {
-            "Content-Type": "application/json",
-            "X-Shopify-Access-Token": shopify_api_key,
-        }
-
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
-        response.raise_for_status()               
-        data = response.json()
-        return data
+        # pooled session, throttle-aware retries and cost metrics live in shopify_client
+        return shopify_client.execute(graphql_query)
     except Exception as e:
         print(f"\n\nError executing GraphQL query: {str(e)}\n\n")
         raise
 
 
-def get_order_details(order_number,chat_id,bot_id,session_id):
+async def aexecute_query(graphql_query):
     try:
-        order_number=str(order_number).replace('"','').replace("'","").replace(" ","")
-        if order_number is None:
-            return "\n\nOrder id is not found\n\n"
-        elif order_number[0]!='#':
-            order_number=f"#{order_number}"
-        graphql_query = f"""
-        query {{
-          orders(first: 50, query: "name:{order_number}") {{
-            edges {{
-              node {{
+        return await shopify_client.aexecute(graphql_query)
+    except Exception as e:
+        print(f"\n\nError executing GraphQL query: {str(e)}\n\n")
+        raise
+
+
+def _normalize_order_number(order_number):
+    order_number=str(order_number).replace('"','').replace("'","").replace(" ","")
+    if order_number[0]!='#':
+        order_number=f"#{order_number}"
+    return order_number
+
+
+# Fields of an order node, requested by the order lookup and by orderEditCommit
+ORDER_FIELDS = """
                 id
                 name
-                currentTotalPriceSet {{
-                  shopMoney {{
+                updatedAt
+                currentTotalPriceSet {
+                  shopMoney {
                     amount
                     currencyCode
-                  }}
-                }}
-                lineItems(first: 50) {{
-                  nodes {{
+                  }
+                }
+                lineItems(first: 50) {
+                  nodes {
                     id
                     name
                     variantTitle
-                    variant {{
+                    variant {
                       id
-                    }}
+                    }
                     quantity
-                    originalTotalSet {{
-                      shopMoney {{
+                    originalTotalSet {
+                      shopMoney {
                         amount
-                      }}
-                    }}
-                    discountedTotalSet {{
-                      shopMoney {{
+                      }
+                    }
+                    discountedTotalSet {
+                      shopMoney {
                         amount
-                      }}
-                    }}
-                  }}
-                }}
+                      }
+                    }
+                  }
+                }"""
+
+
+def _order_details_query(order_number):
+    return f"""
+        query {{
+          orders(first: 50, query: "name:{order_number}") {{
+            edges {{
+              node {{{ORDER_FIELDS}
               }}
             }}
           }}
         }}
         """
-        data = execute_query(graphql_query)
+
+
+def _order_update_record(data,order_number,chat_id,bot_id,session_id):
+    products = []
+    total_price = 0
+
+    for edge in data['data']['orders']['edges']:
+        order_node = edge['node']
+        total_price = float(order_node['currentTotalPriceSet']['shopMoney']['amount'])
+        for item in order_node['lineItems']['nodes']:
+            price = float(item['originalTotalSet']['shopMoney']['amount'])
+            price_after_discount = float(item['discountedTotalSet']['shopMoney']['amount'])
+            products.append({
+                "id": item['id'],
+                "title": item['name'],
+                "Variant_id": item['variant']['id'] if item['variant'] else None,
+                "Variant_title": item['variantTitle'],
+                "price": price,
+                "discount": round(price - price_after_discount, 2),
+                "discount_percentage": (str(round((price - price_after_discount) / price * 100, 2)) if price else "0.0")+"%",
+                "price_after_discount": price_after_discount
+            })
+
+    return {
+        "order_number": order_number,
+        "chat_id": chat_id,
+        "bot_id": bot_id,
+        "session_id": session_id,
+        "timestamp": datetime.utcnow(),
+        "Products": products,
+        "Total_price": total_price
+    }
+
+
+###### ORDER SNAPSHOTS ######
+# Last fetched order data per order number, versioned by the orders' updatedAt. Reads within
+# a conversation are served from here, edits made through the bot replace the entry with the
+# commit response, and a snapshot is only logged to Mongo again for a chat once it changed.
+order_snapshots = TTLCache(maxsize=int(os.getenv("SHOPIFY_SNAPSHOT_CACHE_MAXSIZE", "512")), ttl=float(os.getenv("SHOPIFY_SNAPSHOT_CACHE_TTL", "300")))
+
+def _snapshot_version(data):
+    return tuple((edge['node']['id'], edge['node'].get('updatedAt')) for edge in data['data']['orders']['edges'])
+
+def _store_snapshot(order_number, data):
+    version = _snapshot_version(data)
+    previous = order_snapshots.get(order_number)
+    logged = previous["logged"] if previous is not None and previous["version"] == version else {}
+    entry = {"version": version, "data": data, "logged": logged}
+    order_snapshots.set(order_number, entry)
+    return entry
+
+def _snapshot_record(entry, order_number, chat_id, bot_id, session_id):
+    # the order_update log record, or None when this chat already logged this version
+    if entry["logged"].get(chat_id) == entry["version"]:
+        print(f"Order {order_number} unchanged since last log for chat {chat_id}, skipping")
+        return None
+    entry["logged"][chat_id] = entry["version"]
+    return _order_update_record(entry["data"],order_number,chat_id,bot_id,session_id)
+
+def _order_snapshot(order_number, refresh=False):
+    entry = None if refresh else order_snapshots.get(order_number)
+    if entry is None:
+        data = execute_query(_order_details_query(order_number))
+        print("In get_order_details data: ", data)
+        entry = _store_snapshot(order_number, data)
+    return entry
+
+async def _aorder_snapshot(order_number, refresh=False):
+    entry = None if refresh else order_snapshots.get(order_number)
+    if entry is None:
+        data = await aexecute_query(_order_details_query(order_number))
         print("In get_order_details data: ", data)
+        entry = _store_snapshot(order_number, data)
+    return entry
+
+
+def get_order_details(order_number,chat_id,bot_id,session_id,refresh=False):
+    try:
+        if order_number is None:
+            return "\n\nOrder id is not found\n\n"
+        order_number=_normalize_order_number(order_number)
+        entry=_order_snapshot(order_number, refresh)
 
-        products = []
-        total_price = 0
-
-        for edge in data['data']['orders']['edges']:
-            order_node = edge['node']
-            total_price = float(order_node['currentTotalPriceSet']['shopMoney']['amount'])
-            for item in order_node['lineItems']['nodes']:
-                price = float(item['originalTotalSet']['shopMoney']['amount'])
-                price_after_discount = float(item['discountedTotalSet']['shopMoney']['amount'])
-                products.append({
-                    "id": item['id'],
-                    "title": item['name'],
-                    "Variant_id": item['variant']['id'] if item['variant'] else None,
-                    "Variant_title": item['variantTitle'],
-                    "price": price,
-                    "discount": round(price - price_after_discount, 2),
-                    "discount_percentage": str(round((price - price_after_discount) / price * 100, 2))+"%",
-                    "price_after_discount": price_after_discount
-                })
-
-        order_update_dict={
-            "order_number": order_number,
-            "chat_id": chat_id,
-            "bot_id": bot_id,
-            "session_id": session_id,
-            "timestamp": datetime.utcnow(),
-            "Products": products,
-            "Total_price": total_price
-        }
-        mongo_db.logging_order_update(order_update_dict)
+        record=_snapshot_record(entry,order_number,chat_id,bot_id,session_id)
+        if record is not None:
+            mongo_db.logging_order_update(record)
         return True
 
     except Exception as e:
         print(f"\n\nError getting order details: {str(e)}\n\n")
         return False
 
-###### FIND ORDER ID ######
-def get_order_id(order_number):
-    try:
-        order_id=None
-        graphql_query = f"""
-        query {{
-        orders(first: 10, query: "name:{order_number}") {{
-            edges {{
-            cursor
-            node {{
-                id
-                name
-                lineItems(first: 10) {{
-                nodes {{
-                    id
-                    name
-                    variantTitle
-                    variant {{
-                    id
-                    }}
-                    quantity
-                    discountedTotalSet {{
-                    shopMoney {{ amount currencyCode }}
-                    }}
-                }}
-                }}
-                }}
-            }}
-            }}
-            
-        }}
-        """
-        data=execute_query(graphql_query)
-        print("In get_order_id data: ",data)
-        for edge in data['data']['orders']['edges']:
-            order_id=edge['node']['id']
-        return order_id
-    except Exception as e:
-        print(f"\n\nError getting order ID: {str(e)}\n\n")
-        raise
+###### ORDER ID ######
+# the order id comes from the cached order snapshot, see add_line_item_and_commit
+def _parse_order_id(data):
+    order_id=None
+    for edge in data['data']['orders']['edges']:
+        order_id=edge['node']['id']
+    return order_id
 
 
-def get_order_edit_begin_id(order_id):
-    try:
-        graphql_query = f"""
+def _order_edit_begin_query(order_id):
+    return f"""
         mutation orderEditBegin {{
         orderEditBegin(id: "{order_id}") {{
             calculatedOrder {{
@@ -168,7 +191,11 @@ def get_order_edit_begin_id(order_id):
         }}
         }}
         """
-        data=execute_query(graphql_query)
+
+
+def get_order_edit_begin_id(order_id):
+    try:
+        data=execute_query(_order_edit_begin_query(order_id))
         print("In get_order_edit_begin_id data: ",data)
 
         return data['data']['orderEditBegin']['calculatedOrder']['id']
@@ -177,18 +204,9 @@ def get_order_edit_begin_id(order_id):
         raise
 
 
-def add_line_item_and_discount(order_edit_id, variant_id, quantity=1, discount_pct=15):
-    """
-    1. Adds a ProductVariant line item to an order edit.
-    2. Applies a percentage discount to that line item.
-    Returns the same order_edit_id on success.
-    Raises on any API error (raises exception with details).
-    """
-    try:
-        print(f"\n\norder_edit_id: {order_edit_id}\n\nvariant_id: {variant_id}\n\nquantity: {quantity}\n\ndiscount_pct: {discount_pct}\n\n")
-        # 1. Add the variant to the order edit
-        variant_gid = f"gid://shopify/ProductVariant/{variant_id}"  # Global ID format :contentReference[oaicite:0]{index=0}
-        add_variant_mutation = f"""
+def _add_variant_query(order_edit_id, variant_id, quantity):
+    variant_gid = f"gid://shopify/ProductVariant/{variant_id}"  # Global ID format
+    return f"""
         mutation addVariantToEdit {{
           orderEditAddVariant(
             id: "{order_edit_id}"
@@ -202,13 +220,11 @@ def add_line_item_and_discount(order_edit_id, variant_id, quantity=1, discount_p
           }}
         }}
         """
-        result = execute_query(add_variant_mutation)
-        line_item = result['data']['orderEditAddVariant']['calculatedLineItem']
-        line_item_id = line_item['id']
 
-        # 2. Apply the percentage discount to that line item
-        #    Using OrderEditAppliedDiscountInput (description, percentValue) :contentReference[oaicite:1]{index=1}
-        discount_mutation = f"""
+
+def _line_item_discount_query(order_edit_id, line_item_id, discount_pct):
+    # Using OrderEditAppliedDiscountInput (description, percentValue)
+    return f"""
         mutation addLineItemDiscount {{
           orderEditAddLineItemDiscount(
             id: "{order_edit_id}"
@@ -236,12 +252,32 @@ def add_line_item_and_discount(order_edit_id, variant_id, quantity=1, discount_p
           }}
         }}
         """
+
+
+def _parse_discount(discount_result):
+    actual_discount = discount_result['data']['orderEditAddLineItemDiscount']['addedDiscountStagedChange']
+    return actual_discount['value']['percentage'], actual_discount['description']
+
+
+def add_line_item_and_discount(order_edit_id, variant_id, quantity=1, discount_pct=15):
+    """
+    1. Adds a ProductVariant line item to an order edit.
+    2. Applies a percentage discount to that line item.
+    Returns the same order_edit_id on success.
+    Raises on any API error (raises exception with details).
+    """
+    try:
+        print(f"\n\norder_edit_id: {order_edit_id}\n\nvariant_id: {variant_id}\n\nquantity: {quantity}\n\ndiscount_pct: {discount_pct}\n\n")
+        # 1. Add the variant to the order edit
+        result = execute_query(_add_variant_query(order_edit_id, variant_id, quantity))
+        line_item = result['data']['orderEditAddVariant']['calculatedLineItem']
+        line_item_id = line_item['id']
+
+        # 2. Apply the percentage discount to that line item
         if discount_pct != 0:
-          discount_result = execute_query(discount_mutation)
+          discount_result = execute_query(_line_item_discount_query(order_edit_id, line_item_id, discount_pct))
           print(f"\n\ndiscount_result: {discount_result}\n\n")
-          actual_discount = discount_result['data']['orderEditAddLineItemDiscount']['addedDiscountStagedChange']
-          actual_percentage = actual_discount['value']['percentage']
-          actual_description = actual_discount['description']
+          actual_percentage, actual_description = _parse_discount(discount_result)
         else:
           actual_percentage = 0.0
           actual_description = ""
@@ -252,18 +288,15 @@ def add_line_item_and_discount(order_edit_id, variant_id, quantity=1, discount_p
         raise
 
 
-def commit_order_edit(order_edit_id):
-    try:
-        graphql_query = f"""
+def _commit_query(order_edit_id):
+    return f"""
         mutation commitOrderEditAndSendInvoice {{
         orderEditCommit(
             id: "{order_edit_id}"   # calculatedOrder.id from orderEditBegin
             notifyCustomer: true                            # emails updated invoice
             staffNote: "Adjusted variant via API"           # optional internal note
         ) {{
-            order {{                                        # ✅ edited order, not orderEdit
-            id
-            name
+            order {{                                        # edited order, same fields as the order lookup{ORDER_FIELDS}
             subtotalPriceSet {{ presentmentMoney {{ amount currencyCode }} }}
             totalPriceSet   {{ presentmentMoney {{ amount currencyCode }} }}
             }}
@@ -275,39 +308,153 @@ def commit_order_edit(order_edit_id):
         }}
 
         """
-        data=execute_query(graphql_query)
-        print(f"\n\ndata: {data}\n\n")
-        return "done"
-    except Exception as e:
-        print(f"\n\nError committing order edit: {str(e)}\n\n")
-        raise
 
 
-def add_line_item_and_commit(order_number,variantid,quantity=1):
+def _committed_order(data):
+    # orderEditCommit response shaped like an orders lookup, for _order_update_record
+    commit = data['data']['orderEditCommit']
+    if commit.get('userErrors'):
+        print(f"\n\norderEditCommit userErrors: {commit['userErrors']}\n\n")
+    return {"data": {"orders": {"edges": [{"node": commit['order']}]}}}
+
+
+def _discount_for_variant(variantid):
+    if str(variantid) == "43070878941363" or str(variantid) == "46489435898104":
+        return 0
+    return 15
+
+
+def _order_updated_message(discount_percentage, discount_description):
+    return {
+        "message": "\n\nProduct has been added to the order and the new bill has been sent to the customer email. Please pay the amount from the email.\n\n",
+        "discount_percentage": discount_percentage,
+        "discount_description": discount_description
+    }
+
+
+def _commit_errors(data):
+    # errors meaning orderEditCommit did not apply the edit, empty when it did
+    commit = (data.get('data') or {}).get('orderEditCommit')
+    if commit is None:
+        return data.get('errors') or ["orderEditCommit returned no result"]
+    return commit.get('userErrors') or []
+
+
+def _log_snapshot(entry, order_number, chat_id, bot_id, session_id):
+    # best effort, a logging failure must not turn an applied edit into a reported failure
+    try:
+        record=_snapshot_record(entry,order_number,chat_id,bot_id,session_id)
+        if record is not None:
+            mongo_db.logging_order_update(record)
+    except Exception:
+        logger.exception("Could not log order snapshot for %s", order_number)
+
+
+def _store_committed(order_number, committed):
+    # the commit response is the new snapshot of the order
+    try:
+        return _store_snapshot(order_number,_committed_order(committed))
+    except Exception:
+        logger.exception("Could not store the committed snapshot for %s", order_number)
+        order_snapshots.pop(order_number)
+        return None
+
+
+def add_line_item_and_commit(order_number,variantid,quantity=1,chat_id=None,bot_id=None,session_id=None):
+    """Add a variant to an order and send the new invoice.
+
+    One order lookup (or the cached snapshot) gives both the order id and the before snapshot, the discount is only
+    requested when there is one, and the commit response carries the after snapshot, so
+    an edit takes 4-5 Shopify calls. When chat_id is given both snapshots are logged to
+    Mongo, which replaces calling get_order_details before and after.
+    """
     try:
-        order_number=str(order_number).replace('"','').replace("'","").replace(" ","")
         if order_number is None:
             return "\n\nOrder id is not found\n\n"
-        elif order_number[0]!='#':
-            order_number=f"#{order_number}"
+        order_number=_normalize_order_number(order_number)
 
         print(f"\n\norder_number: {order_number}\n\n")
-        order_id=get_order_id(order_number)
+        entry=_order_snapshot(order_number)
+        order_id=_parse_order_id(entry["data"])
         print(f"\n\norder_id: {order_id}\n\n")
+        if chat_id is not None:
+            _log_snapshot(entry,order_number,chat_id,bot_id,session_id)
+
         order_edit_id=get_order_edit_begin_id(order_id)
-        if str(variantid) == "43070878941363" or str(variantid) == "46489435898104":
-            discount_pct=0
-        else:
-            discount_pct=15
+        discount_pct=_discount_for_variant(variantid)
         order_edit_id, discount_percentage, discount_description = add_line_item_and_discount(order_edit_id,variantid,quantity,discount_pct)
-        commit_order_edit(order_edit_id)
-        return {
-            "message": "\n\nProduct has been added to the order and the new bill has been sent to the customer email. Please pay the amount from the email.\n\n",
-            "discount_percentage": discount_percentage,
-            "discount_description": discount_description
-        }
+
+        committed=execute_query(_commit_query(order_edit_id))
+        print(f"\n\ndata: {committed}\n\n")
     except Exception as e:
         print(f"\n\nError in add_line_item_and_commit: {str(e)}\n\n")
         return "\n\nFailed to add product to order. Please try again later.\n\n"
-        
 
+    errors=_commit_errors(committed)
+    if errors:
+        logger.error("orderEditCommit for %s was not applied: %s", order_number, errors)
+        return "\n\nFailed to add product to order. Please try again later.\n\n"
+    # the edit is applied and the invoice sent from here on, only report success
+    entry=_store_committed(order_number,committed)
+    if entry is not None and chat_id is not None:
+        _log_snapshot(entry,order_number,chat_id,bot_id,session_id)
+    return _order_updated_message(discount_percentage, discount_description)
+
+
+###### ASYNC ######
+async def aget_order_details(order_number,chat_id,bot_id,session_id,refresh=False):
+    try:
+        if order_number is None:
+            return "\n\nOrder id is not found\n\n"
+        order_number=_normalize_order_number(order_number)
+        entry=await _aorder_snapshot(order_number, refresh)
+
+        record=_snapshot_record(entry,order_number,chat_id,bot_id,session_id)
+        if record is not None:
+            await asyncio.to_thread(mongo_db.logging_order_update, record)
+        return True
+
+    except Exception as e:
+        print(f"\n\nError getting order details: {str(e)}\n\n")
+        return False
+
+
+async def aadd_line_item_and_commit(order_number,variantid,quantity=1,chat_id=None,bot_id=None,session_id=None):
+    try:
+        if order_number is None:
+            return "\n\nOrder id is not found\n\n"
+        order_number=_normalize_order_number(order_number)
+
+        entry=await _aorder_snapshot(order_number)
+        order_id=_parse_order_id(entry["data"])
+        print(f"\n\norder_id: {order_id}\n\n")
+        if chat_id is not None:
+            await asyncio.to_thread(_log_snapshot,entry,order_number,chat_id,bot_id,session_id)
+
+        data=await aexecute_query(_order_edit_begin_query(order_id))
+        order_edit_id=data['data']['orderEditBegin']['calculatedOrder']['id']
+
+        discount_pct=_discount_for_variant(variantid)
+        result=await aexecute_query(_add_variant_query(order_edit_id, variantid, quantity))
+        line_item_id=result['data']['orderEditAddVariant']['calculatedLineItem']['id']
+        if discount_pct != 0:
+            discount_result=await aexecute_query(_line_item_discount_query(order_edit_id, line_item_id, discount_pct))
+            discount_percentage, discount_description = _parse_discount(discount_result)
+        else:
+            discount_percentage, discount_description = 0.0, ""
+
+        committed=await aexecute_query(_commit_query(order_edit_id))
+        print(f"\n\ndata: {committed}\n\n")
+    except Exception as e:
+        print(f"\n\nError in add_line_item_and_commit: {str(e)}\n\n")
+        return "\n\nFailed to add product to order. Please try again later.\n\n"
+
+    errors=_commit_errors(committed)
+    if errors:
+        logger.error("orderEditCommit for %s was not applied: %s", order_number, errors)
+        return "\n\nFailed to add product to order. Please try again later.\n\n"
+    # the edit is applied and the invoice sent from here on, only report success
+    entry=_store_committed(order_number,committed)
+    if entry is not None and chat_id is not None:
+        await asyncio.to_thread(_log_snapshot,entry,order_number,chat_id,bot_id,session_id)
+    return _order_updated_message(discount_percentage, discount_description)
@@ -1,8 +1,18 @@
 # cache.py
+import os
+import re
+import copy
+import json
+import hashlib
 import time
+import threading
 from datetime import datetime, timezone
 import logging
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
 from Database.mongo_db.mongo import MongoDatabase
+from caching.memory_cache import TTLCache
+from caching.normalize import normalize_question, normalize_chat_history
 
 # Configure logging
 logging.basicConfig(
@@ -11,24 +21,214 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# generate_cache_key output; older documents embed the raw bot/history/question/language
+HASHED_KEY = re.compile(r"^[0-9a-f]{64}$")
+
 class LLMCache:
 
-    def __init__(self):
+    def __init__(self, local_maxsize=None, local_ttl=None, ttl_seconds=None, semantic=None, semantic_threshold=None, share_templated=None):
         logger.info("Initializing LLMCache")
         self.db = MongoDatabase()
         self.collection = self.db.cache_retriever()
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+        self.ensure_indexes()
+
+        # Order numbers and emails are templated out of questions before keying. Their raw values stay
+        # in the key by default (share_templated=False): answers to order questions carry that order's
+        # status, items and customer data, so sharing them would serve one customer's order to another.
+        # The templating still folds formatting variants ("#1234" / "order no. 1234") into one entry.
+        # Set LLM_CACHE_SHARE_TEMPLATED=True only for bots whose answers never depend on the entity.
+        if share_templated is None:
+            share_templated = os.getenv("LLM_CACHE_SHARE_TEMPLATED", "False") == "True"
+        self.share_templated = share_templated
+
+        # In-process tier in front of the Debales_cache collection, one bounded LRU per bot
+        self.local_maxsize = local_maxsize if local_maxsize is not None else int(os.getenv("LLM_CACHE_LOCAL_MAXSIZE", "512"))
+        self.local_ttl = local_ttl if local_ttl is not None else float(os.getenv("LLM_CACHE_LOCAL_TTL", "900"))
+        self.local_caches = {}
+        self._local_lock = threading.Lock()
+        self.counters = {"local_hits": 0, "mongo_hits": 0, "misses": 0, "inserts": 0}
+
+        # Opt-in semantic tier: similar questions asked in the same context reuse a cached answer
+        if semantic is None:
+            semantic = os.getenv("LLM_CACHE_SEMANTIC", "False") == "True"
+        self.semantic = semantic
+        self.semantic_threshold = semantic_threshold if semantic_threshold is not None else float(os.getenv("LLM_CACHE_SEMANTIC_THRESHOLD", "0.95"))
+        self.semantic_k = int(os.getenv("LLM_CACHE_SEMANTIC_K", "4"))
+        self.semantic_stores = {}
+        self.semantic_counters = {"lookups": 0, "hits": 0, "false_hits": 0, "errors": 0}
+
+    def _local_cache(self, bot_id):
+        cache = self.local_caches.get(bot_id)
+        if cache is None:
+            with self._local_lock:
+                cache = self.local_caches.get(bot_id)
+                if cache is None:
+                    cache = TTLCache(maxsize=self.local_maxsize, ttl=self.local_ttl)
+                    self.local_caches[bot_id] = cache
+        return cache
+
+    def ensure_indexes(self):
+        """Unique index on the hashed cache_key and a TTL index on timestamp so entries expire on their own."""
+        try:
+            self.collection.create_index([("cache_key", ASCENDING)], unique=True, name="cache_key_unique")
+        except PyMongoError as e:
+            # Debales_cache predates hashed keys and upserts, so it can hold duplicate and legacy keys
+            logger.warning("Unique cache_key index build failed (%s), cleaning up Debales_cache and retrying", e)
+            self._ensure_cache_key_index_after_cleanup()
+        try:
+            self.collection.create_index(
+                [("timestamp", ASCENDING)],
+                expireAfterSeconds=self.ttl_seconds,
+                name="timestamp_ttl",
+            )
+        except PyMongoError as e:
+            logger.warning("Could not create timestamp TTL index: %s", e)
+
+    def purge_legacy_entries(self):
+        """Delete documents keyed the pre-hash way (unreachable by lookups) and keep the newest document per cache_key."""
+        removed = self.collection.delete_many({"cache_key": {"$not": HASHED_KEY}}).deleted_count
+        duplicates = self.collection.aggregate([
+            {"$sort": {"timestamp": -1}},
+            {"$group": {"_id": "$cache_key", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+        ], allowDiskUse=True)
+        for group in duplicates:
+            removed += self.collection.delete_many({"_id": {"$in": group["ids"][1:]}}).deleted_count
+        logger.info("Removed %d legacy or duplicate Debales_cache documents", removed)
+        return removed
+
+    def _ensure_cache_key_index_after_cleanup(self):
+        try:
+            self.purge_legacy_entries()
+            self.collection.create_index([("cache_key", ASCENDING)], unique=True, name="cache_key_unique")
+            logger.info("Created unique cache_key index after cleanup")
+            return
+        except PyMongoError as e:
+            logger.error("Unique cache_key index still failing after cleanup: %s", e)
+        try:
+            # lookups and upserts still need an index, even without the uniqueness guarantee
+            self.collection.create_index([("cache_key", ASCENDING)], name="cache_key")
+            logger.error("Using a non-unique cache_key index, Debales_cache may keep duplicate keys")
+        except PyMongoError as e:
+            logger.error("Could not create any cache_key index, cache lookups will scan Debales_cache: %s", e)
+
+    def normalize_inputs(self, question, chat_history):
+        """Normalized question, normalized chat history and the entity values that must stay in the key."""
+        normalized_question, question_entities = normalize_question(question)
+        normalized_history, history_entities = normalize_chat_history(chat_history)
+        entities = [] if self.share_templated else question_entities + history_entities
+        return normalized_question, normalized_history, entities
+
+    @staticmethod
+    def _hash(value: str) -> str:
+        return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+    def _semantic_store(self, bot_id):
+        store = self.semantic_stores.get(bot_id)
+        if store is None:
+            with self._local_lock:
+                store = self.semantic_stores.get(bot_id)
+                if store is None:
+                    store = self.db.cache_vector_store(bot_id, ttl_seconds=self.ttl_seconds)
+                    self.semantic_stores[bot_id] = store
+        return store
+
+    def _count(self, counters, name):
+        # requests run in threads (asyncio.to_thread, executor pools), so counters are updated under the lock
+        with self._local_lock:
+            counters[name] += 1
+
+    def _semantic_context(self, question, chat_history, language):
+        _, normalized_history, entities = self.normalize_inputs(question, chat_history)
+        return self._hash(json.dumps([normalized_history, str(language), entities], ensure_ascii=False))
+
+    def _check_semantic(self, bot_id, question, chat_history, language):
+        self._count(self.semantic_counters, "lookups")
+        try:
+            context = self._semantic_context(question, chat_history, language)
+            results = self._semantic_store(bot_id).similarity_search_with_score(
+                normalize_question(question)[0], k=self.semantic_k
+            )
+        except Exception as e:
+            self._count(self.semantic_counters, "errors")
+            logger.warning("[SEMANTIC CACHE] Lookup failed for bot_id %s: %s", bot_id, e)
+            return None
+
+        for document, score in results:
+            metadata = document.metadata or {}
+            if metadata.get("context") != context:
+                continue
+            if score < self.semantic_threshold:
+                logger.debug("[SEMANTIC CACHE] Best candidate below threshold (%.4f < %.4f)", score, self.semantic_threshold)
+                return None
+            key = metadata.get("cache_key")
+            local = self._local_cache(bot_id)
+            cached = local.get(key)
+            if cached is None:
+                doc = self.collection.find_one({"cache_key": key})
+                if not doc:
+                    continue
+                cached = doc.get("cached_output")
+                local.set(key, copy.deepcopy(cached))
+            self._count(self.semantic_counters, "hits")
+            logger.info("[CACHE HIT][SEMANTIC] score=%.4f matched %r for key: %s", score, document.page_content, key)
+            return copy.deepcopy(cached)
+        return None
+
+    def _insert_semantic(self, bot_id, question, chat_history, language, key):
+        try:
+            self._semantic_store(bot_id).add_texts(
+                [normalize_question(question)[0]],
+                metadatas=[{
+                    "cache_key": key,
+                    "context": self._semantic_context(question, chat_history, language),
+                    "timestamp": datetime.now(timezone.utc),
+                }],
+            )
+        except Exception as e:
+            self._count(self.semantic_counters, "errors")
+            logger.warning("[SEMANTIC CACHE] Insert failed for bot_id %s: %s", bot_id, e)
+
+    def report_false_hit(self, bot_id: str):
+        """Record that a semantic cache hit returned an answer that did not fit the question."""
+        self._count(self.semantic_counters, "false_hits")
+        logger.warning("[SEMANTIC CACHE] False hit reported for bot_id: %s", bot_id)
 
     def generate_cache_key(self, bot_id: str, question: str, chat_history: str,language) -> str:
         logger.debug("Generating cache key for bot_id: %s", bot_id)
-        return f"{bot_id}::{chat_history}::{question}::{language}"
+        normalized_question, normalized_history, entities = self.normalize_inputs(question, chat_history)
+        payload = json.dumps(
+            [bot_id, normalized_history, normalized_question, str(language), entities],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
     def check_cache(self, bot_id: str, question: str, chat_history: str, language = "multilingual"):
         logger.debug("Checking cache for bot_id: %s", bot_id)
         key = self.generate_cache_key(bot_id, question, chat_history, language)
+        local = self._local_cache(bot_id)
+
+        t0 = time.perf_counter()
+        cached = local.get(key)
+        if cached is not None:
+            self._count(self.counters, "local_hits")
+            logger.info("[CACHE HIT][LOCAL] Returning cached response in %.6fs for key: %s", time.perf_counter() - t0, key)
+            return copy.deepcopy(cached)
+
         doc = self.collection.find_one({"cache_key": key})
         if doc:
-            logger.info("[CACHE HIT] Returning cached response for key: %s", key)
-            return doc.get("cached_output")
+            self._count(self.counters, "mongo_hits")
+            cached = doc.get("cached_output")
+            local.set(key, copy.deepcopy(cached))
+            logger.info("[CACHE HIT][MONGO] Returning cached response for key: %s", key)
+            return cached
+
+        if self.semantic:
+            cached = self._check_semantic(bot_id, question, chat_history, language)
+            if cached is not None:
+                return cached
+        self._count(self.counters, "misses")
         logger.info("[CACHE MISS] No cached response found for key: %s", key)
         return None
 
@@ -43,5 +243,39 @@ class LLMCache:
             "language": langauge,
             "timestamp": datetime.now(timezone.utc)
         }
-        self.collection.insert_one(doc)
-        logger.info("[CACHE INSERT] Stored new response in cache for key: %s", key)
\ No newline at end of file
+        self.collection.update_one({"cache_key": key}, {"$set": doc}, upsert=True)
+        # Callers keep mutating the output after caching it (e.g. adding tags), so store a copy
+        self._local_cache(bot_id).set(key, copy.deepcopy(output_data))
+        if self.semantic:
+            self._insert_semantic(bot_id, question, chat_history, langauge, key)
+        self._count(self.counters, "inserts")
+        logger.info("[CACHE INSERT] Stored new response in cache for key: %s", key)
+
+    def invalidate_local(self, bot_id=None):
+        """Drop the in-process tier for one bot, or for every bot when bot_id is None."""
+        with self._local_lock:
+            if bot_id is None:
+                self.local_caches.clear()
+            else:
+                self.local_caches.pop(bot_id, None)
+
+    def cache_stats(self):
+        with self._local_lock:
+            counters = dict(self.counters)
+            semantic_counters = dict(self.semantic_counters)
+            local_caches = list(self.local_caches.items())
+        semantic_hits = semantic_counters["hits"]
+        lookups = counters["local_hits"] + counters["mongo_hits"] + counters["misses"] + semantic_hits
+        hits = counters["local_hits"] + counters["mongo_hits"] + semantic_hits
+        return {
+            **counters,
+            "hit_rate": (hits / lookups) if lookups else 0.0,
+            "semantic": {
+                **semantic_counters,
+                "enabled": self.semantic,
+                "threshold": self.semantic_threshold,
+                "hit_rate": (semantic_hits / semantic_counters["lookups"]) if semantic_counters["lookups"] else 0.0,
+                "false_hit_rate": (semantic_counters["false_hits"] / semantic_hits) if semantic_hits else 0.0,
+            },
+            "local": {bot_id: cache.stats() for bot_id, cache in local_caches},
+        }
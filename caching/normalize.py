@@ -0,0 +1,69 @@
+# normalize.py
+import re
+import unicodedata
+
+EMAIL_PLACEHOLDER = "<email>"
+ORDER_NUMBER_PLACEHOLDER = "<order_number>"
+
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+# Shopify/Monday order numbers: "#1234", or 4+ digits right after "order", "order no. 12345",
+# "order number: 12345", "order is #1234". Bare numbers (quantities, prices, years, zip codes)
+# are left alone so they keep telling questions apart.
+ORDER_NUMBER_RE = re.compile(
+    r"(?P<context>\borders?\b(?:\s*(?:number|num|no|id)\b)?(?:\s+is\b)?[\s.:]*)"
+    r"(?:#\s?(?P<hashed>\d{3,})|(?P<number>\d{4,}))\b"
+    r"|#\s?(?P<bare>\d{3,})\b"
+)
+EMOJI_RE = re.compile(
+    "["
+    "\U0001F000-\U0001FAFF"  # pictographs, emoticons, transport, symbols & flags
+    "\u2600-\u27BF"          # misc symbols and dingbats
+    "\u2B00-\u2BFF"          # arrows and stars
+    "\uFE0F\u200D"           # variation selector and zero width joiner
+    "]+"
+)
+APOSTROPHE_RE = re.compile("['\u2018\u2019`]")
+PUNCTUATION_RE = re.compile(r"[^\w<>]+")
+
+
+def normalize_question(question, template_entities=True):
+    """Normalize a question for cache lookups.
+
+    Returns ``(normalized_text, entities)`` where ``entities`` lists the raw
+    order numbers and emails that were replaced by placeholders, in order of
+    appearance, so callers can decide whether they belong in the cache key.
+    """
+    text = unicodedata.normalize("NFKC", str(question or "")).casefold()
+    entities = []
+
+    if template_entities:
+        def _template(placeholder):
+            def _replace(match):
+                entities.append(match.group(0).replace(" ", "").lstrip("#"))
+                return f" {placeholder} "
+            return _replace
+
+        def _template_order_number(match):
+            # keep the "order number" wording, only the digits become the placeholder
+            entities.append(match.group("hashed") or match.group("number") or match.group("bare"))
+            return f"{match.group('context') or ''} {ORDER_NUMBER_PLACEHOLDER} "
+
+        text = EMAIL_RE.sub(_template(EMAIL_PLACEHOLDER), text)
+        text = ORDER_NUMBER_RE.sub(_template_order_number, text)
+
+    text = EMOJI_RE.sub(" ", text)
+    text = APOSTROPHE_RE.sub("", text)
+    text = PUNCTUATION_RE.sub(" ", text)
+    return " ".join(text.split()), entities
+
+
+def normalize_chat_history(chat_history, template_entities=True):
+    """Apply normalize_question line by line to a formatted (human-only) chat history."""
+    lines = []
+    entities = []
+    for line in str(chat_history or "").splitlines():
+        normalized, found = normalize_question(line, template_entities)
+        if normalized:
+            lines.append(normalized)
+            entities.extend(found)
+    return "\n".join(lines), entities